@@ -12,10 +12,14 @@ to plot these links, as well as print some statistics of the resulting graph.
 """
 
 # Imports needed.
-from collections import Counter
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
 import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
 import sys
+import threading
 import time
 import json
 from TwitterAPI import TwitterAPI
@@ -54,9 +58,44 @@ def read_screen_names(filename):
     return r
 
 
+def wait_for_call(calls, limit, window):
+    """ Block until a rate limit of limit calls every window seconds allows one
+    more call, and record it. Threads sharing calls stay within the limit together.
+    Args:
+        calls....A deque of the times of the last calls, shared by the threads.
+        limit....The number of calls allowed per window.
+        window...The length of the rate limit window, in seconds.
+    Returns:
+        The number of seconds spent waiting.
+
+    >>> calls = deque()
+    >>> [wait_for_call(calls, 2, 0.1) > 0 for i in range(3)]
+    [False, False, True]
+    """
+    with CALLS_LOCK:
+        now = time.monotonic()
+        waited = 0.
+        if len(calls) >= limit:
+            # Sleeping with the lock held: the other threads have to wait their turn anyway.
+            waited = max(calls[-limit] + window - now, 0.)
+            time.sleep(waited)
+        calls.append(now + waited)
+        while len(calls) > limit:
+            calls.popleft()
+        return waited
+
+
+CALLS_LOCK = threading.Lock()
+# friends/ids allows 15 requests per 15 minute window; the times of the requests,
+# shared by all the threads.
+FRIENDS_CALLS = deque()
+
+
 # You should call this method whenever you need to access the Twitter API.
 def robust_request(twitter, resource, params, max_tries=5):
-    """ If a Twitter request fails, sleep for 15 minutes.
+    """ If a Twitter request fails, sleep until the rate limit window resets
+    (read from the x-rate-limit-reset header), or for 15 minutes if the
+    response does not say.
     Do this at most max_tries times before quitting.
     Args:
       twitter .... A TwitterAPI object.
@@ -72,9 +111,11 @@ def robust_request(twitter, resource, params, max_tries=5):
         if request.status_code == 200:
             return request
         else:
-            print('Got error %s \nsleeping for 15 minutes.' % request.text)
+            reset = request.headers.get('x-rate-limit-reset')
+            wait = max(int(reset) - time.time(), 0) + 1 if reset else 61 * 15
+            print('Got error %s \nsleeping for %d seconds.' % (request.text, wait))
             sys.stderr.flush()
-            time.sleep(61 * 15)
+            time.sleep(wait)
 
 
 def get_users(twitter, screen_names):
@@ -95,9 +136,13 @@ def get_users(twitter, screen_names):
     >>> [u['id'] for u in users]
     [6253282, 783214]
     """
+    # users/lookup accepts up to 100 screen names per request.
+    batches = [screen_names[i:i + 100] for i in range(0, len(screen_names), 100)]
     results = []
-    for s in screen_names:
-        results.extend(robust_request(twitter, "users/lookup", {'screen_name': s}))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for request in executor.map(lambda batch: robust_request(twitter, "users/lookup",
+                                                                  {'screen_name': ','.join(batch)}), batches):
+            results.extend(request)
     return results
 
 
@@ -128,15 +173,19 @@ def get_friends(twitter, screen_name):
     return sorted(request.json()['ids'])
 
 
-def add_all_friends(twitter, users):
+def add_all_friends(twitter, users, max_workers=4, calls=FRIENDS_CALLS):
     """ Get the list of accounts each user follows.
-    I.e., call the get_friends method for all 4 candidates.
+    I.e., call the get_friends method for all 4 candidates, keeping up to
+    max_workers requests in flight at once. Every request first waits for its
+    turn in calls, so the threads together stay within the friends/ids rate limit.
 
     Store the result in each user's dict using a new key called 'friends'.
 
     Args:
-        twitter...The TwitterAPI object.
-        users.....The list of user dicts.
+        twitter.......The TwitterAPI object.
+        users.........The list of user dicts.
+        max_workers...The maximum number of concurrent requests.
+        calls.........The times of the friends/ids requests, shared by the threads.
     Returns:
         Nothing
 
@@ -146,8 +195,14 @@ def add_all_friends(twitter, users):
     >>> users[0]['friends'][:5]
     [695023, 1697081, 8381682, 10204352, 11669522]
     """
-    for u in users:
-        u['friends'] = get_friends(twitter, u['screen_name'])
+    def fetch(u):
+        wait_for_call(calls, 15, 15 * 60)
+        return get_friends(twitter, u['screen_name'])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        friends = executor.map(fetch, users)
+        for u, f in zip(users, friends):
+            u['friends'] = f
 
 
 def print_num_friends(users):
@@ -174,10 +229,13 @@ def count_friends(users):
     >>> c.most_common()
     [(2, 3), (3, 2), (1, 1)]
     """
-    result = Counter()
-    for u in users:
-        result.update(u['friends'])
-    return result 
+    # Count all the ids at once; ids keep the order they are first seen in, as with Counter.update.
+    ids = [f for u in users for f in u['friends']]
+    if not ids:
+        return Counter()
+    unique, first, counts = np.unique(ids, return_index=True, return_counts=True)
+    order = np.argsort(first)
+    return Counter(dict(zip(unique[order].tolist(), counts[order].tolist())))
 
 
 def friend_overlap(users):
@@ -201,14 +259,69 @@ def friend_overlap(users):
     ...     ])
     [('a', 'c', 3), ('a', 'b', 2), ('b', 'c', 2)]
     """
-    results = []
-    for i, u1 in enumerate(users):
-        for j, u2 in enumerate(users[i+1:]):
-            overlap = len(set(u1['friends']) & set(u2['friends']))
-            results.append((u1['screen_name'], u2['screen_name'], overlap))
+    # One row per user and one column per account followed; the product of this
+    # matrix with its transpose counts the accounts followed by each pair at once.
+    columns = {}
+    indices = [[columns.setdefault(f, len(columns)) for f in set(u['friends'])] for u in users]
+    indptr = np.cumsum([0] + [len(i) for i in indices])
+    X = csr_matrix((np.ones(indptr[-1], dtype=np.int32), [c for i in indices for c in i], indptr),
+                   shape=(len(users), len(columns)))
+    overlaps = (X @ X.T).toarray()
+    rows, cols = np.triu_indices(len(users), k=1)
+    results = [(users[i]['screen_name'], users[j]['screen_name'], int(overlaps[i, j]))
+               for i, j in zip(rows.tolist(), cols.tolist())]
     return sorted(results, key=lambda x: (-x[2], x[0], x[1]))
 
 
+def followed_by(users, screen_names=None, min_count=None):
+    """
+    Find the accounts followed by at least min_count of the given users, from
+    the friends already stored in each user dict (see add_all_friends).
+
+    Params:
+        users..........The list of user dicts.
+        screen_names...The screen_names of the users to consider, or None for all of them.
+        min_count......The number of these users that must follow an account, or
+                       None for all of them.
+    Returns:
+        A sorted list of the Twitter IDs followed by at least min_count users.
+
+    >>> users = [{'screen_name': 'a', 'friends': [1, 2, 3]},
+    ...          {'screen_name': 'b', 'friends': [2, 3, 4]},
+    ...          {'screen_name': 'c', 'friends': [3, 4, 5]}]
+    >>> followed_by(users), followed_by(users, ['a', 'b']), followed_by(users, min_count=2)
+    ([3], [2, 3], [2, 3, 4])
+    """
+    selected = [u for u in users if screen_names is None or u['screen_name'] in screen_names]
+    min_count = len(selected) if min_count is None else min_count
+    counts = count_friends([{'friends': set(u['friends'])} for u in selected])
+    return sorted(i for i, n in counts.items() if n >= min_count)
+
+
+# Users already looked up by id, shared by every call of get_users_by_ids.
+_users_by_id = {}
+
+
+def get_users_by_ids(twitter, ids):
+    """Retrieve the Twitter user objects for each id, in batches of 100 ids per
+    users/lookup request. Users already looked up are not requested again.
+    Params:
+        twitter...The TwitterAPI object.
+        ids.......A list of Twitter IDs.
+    Returns:
+        A list of user dicts, in the order of ids; ids that are not found are skipped.
+    """
+    missing = [i for i in ids if i not in _users_by_id]
+    batches = [missing[i:i + 100] for i in range(0, len(missing), 100)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for request in executor.map(lambda batch: robust_request(twitter, "users/lookup",
+                                                                  {'user_id': ','.join(str(i) for i in batch)}), batches):
+            if request is not None and request.status_code == 200:
+                for u in request:
+                    _users_by_id[u['id']] = u
+    return [_users_by_id[i] for i in ids if i in _users_by_id]
+
+
 def followed_by_hillary_and_donald(users, twitter):
     """
     Find and return the screen_names of the Twitter users followed by both Hillary
@@ -216,6 +329,9 @@ def followed_by_hillary_and_donald(users, twitter):
     the Twitter ID to a screen_name. See:
     https://dev.twitter.com/rest/reference/get/users/lookup
 
+    The friends already in users are used (see followed_by), and the ids are
+    converted in batches of 100 (see get_users_by_ids).
+
     Params:
         users.....The list of user dicts
         twitter...The Twitter API object
@@ -223,21 +339,8 @@ def followed_by_hillary_and_donald(users, twitter):
         A list of strings containing the Twitter screen_names of the users
         that are followed by both Hillary Clinton and Donald Trump.
     """
-    dt_friends = get_friends(twitter, 'realDonaldTrump')
-    hc_friends = get_friends(twitter, 'HillaryClinton')
-    both = list(set(dt_friends) & set(hc_friends))
-    print(both)
-    
-    users_obj = robust_request(twitter, "users/lookup", 
-                              {'user_id': both})
-
-    result = [u['screen_name'] for u in users_obj]
-
-    print(result)
-    return result
-    #result = []
-    #ids = [user['id'] for user in users]
-    #def i2dscreen():
+    both = followed_by(users, ['HillaryClinton', 'realDonaldTrump'])
+    return [u['screen_name'] for u in get_users_by_ids(twitter, both)]
 
 
 def create_graph(users, friend_counts):
@@ -258,13 +361,13 @@ def create_graph(users, friend_counts):
     ###TODO
     # Create a graph
     graph = nx.Graph()
-    #friends = Counter()
+    # Friends followed by more than one candidate, to filter each list at once.
+    shared = np.array([f for f, count in friend_counts.items() if count > 1], dtype=np.int64)
     for u in users:
         graph.add_node(u['screen_name'])
-        friends = u['friends']
-        for f in friends:
-            if (friend_counts.get(f)>1):
-                graph.add_edge(u['screen_name'], f)
+        friends = np.asarray(u['friends'], dtype=np.int64)
+        friends = friends[np.isin(friends, shared)]
+        graph.add_edges_from((u['screen_name'], f) for f in friends.tolist())
     return graph
 
 
@@ -16,9 +16,13 @@ from collections import Counter, defaultdict, deque
 import copy
 from itertools import combinations
 import math
+import os
 import networkx as nx
+import numpy as np
 import urllib.request
 
+from csrgraph import CSRGraph, read_edgelist
+
 
 ## Community Detection
 
@@ -46,7 +50,7 @@ def bfs(graph, root, max_depth):
       https://docs.python.org/3.5/library/collections.html#collections.deque
 
     Params:
-      graph.......A networkx Graph
+      graph.......A networkx Graph or a CSRGraph
       root........The root node in the search graph (a string). We are computing
                   shortest paths from this node to all others.
       max_depth...An integer representing the maximum depth to search.
@@ -75,41 +79,92 @@ def bfs(graph, root, max_depth):
     [('B', 1), ('D', 1), ('E', 1), ('F', 1), ('G', 2)]
     >>> sorted((node, sorted(parents)) for node, parents in node2parents.items())
     [('B', ['D']), ('D', ['E']), ('F', ['E']), ('G', ['D', 'F'])]
+
+    A CSRGraph (see csrgraph.py) is searched a level at a time over its arrays:
+
+    >>> node2distances, node2num_paths, node2parents = bfs(CSRGraph.from_networkx(example_graph()), 'E', 5)
+    >>> sorted(node2num_paths.items())
+    [('A', 1), ('B', 1), ('C', 1), ('D', 1), ('E', 1), ('F', 1), ('G', 2)]
+
+    Both give the same result; in a 3 x 3 grid there are 6 shortest paths
+    from one corner to the other:
+
+    >>> grid = nx.relabel_nodes(nx.grid_2d_graph(3, 3), lambda xy: '%d%d' % xy)
+    >>> results = [bfs(g, '00', 4) for g in (grid, CSRGraph.from_networkx(grid))]
+    >>> [(r[0]['22'], r[1]['22'], sorted(r[2]['22'])) for r in results]
+    [(4, 6, ['12', '21']), (4, 6, ['12', '21'])]
+    >>> results[0][:2] == results[1][:2]
+    True
     """
+    if isinstance(graph, CSRGraph):
+        return bfs_csr(graph, root, max_depth)
     q = deque()
     q.append(root)
-    seen = set()       # nodes we have already visited.
-    res = []
-    depth = 1  # Track depth of the search
     node2distances = defaultdict(int)
     node2num_paths = defaultdict(int)
     node2parents = defaultdict(list)
     node2distances[root] = 0
     node2num_paths[root] = 1
-    if max_depth == 0:
-        return node2distances, node2num_paths, node2parents
     while len(q) > 0:  # while more to visit
         n = q.popleft()
-        if n == 'null':
-            depth += 1
-            continue
+        depth = node2distances[n] + 1
         if depth > max_depth:
-            return node2distances, node2num_paths, node2parents
-        if n not in seen:
-            res.append(n)
-            seen.add(n)
+            break
         for nn in graph.neighbors(n):
-            if nn not in seen:
-                if not q.__contains__(nn):
-                    q.append(nn)
-                if not node2distances.__contains__(nn):
-                    node2distances[nn] = depth
-            if node2distances[nn] == (node2distances[n]+1):
+            if nn not in node2distances:
+                node2distances[nn] = depth
+                q.append(nn)
+            if node2distances[nn] == depth:
+                # Every shortest path to n, followed by the edge to nn.
                 node2parents[nn].append(n)
-                node2num_paths[nn] += 1 
-        q.append('null')
-        if n == root:
-            depth += 1
+                node2num_paths[nn] += node2num_paths[n]
+    return node2distances, node2num_paths, node2parents
+
+
+def bfs_csr(graph, root, max_depth):
+    """
+    bfs for a CSRGraph. Each level is expanded at once: the neighbors of all the
+    nodes at depth d - 1 are gathered from the CSR arrays, those not seen yet get
+    depth d, and every edge into a node at depth d adds the number of paths of
+    its parent to it.
+
+    Params:
+      graph.......A CSRGraph
+      root........The root node name.
+      max_depth...An integer representing the maximum depth to search.
+
+    Returns:
+      The node2distances, node2num_paths and node2parents dicts of bfs.
+    """
+    n = graph.order()
+    distances = np.full(n, -1, dtype=np.int64)
+    num_paths = np.zeros(n, dtype=np.int64)
+    root_id = graph.index[root]
+    distances[root_id] = 0
+    num_paths[root_id] = 1
+    frontier = np.array([root_id], dtype=np.int64)
+    parent_ids = []
+    child_ids = []
+    for depth in range(1, max_depth + 1):
+        neighbors, owners = graph.gather(frontier)
+        parents = frontier[owners]
+        distances[neighbors[distances[neighbors] == -1]] = depth
+        down = distances[neighbors] == depth
+        parents, neighbors = parents[down], neighbors[down]
+        if len(neighbors) == 0:
+            break
+        np.add.at(num_paths, neighbors, num_paths[parents])
+        parent_ids.append(parents)
+        child_ids.append(neighbors)
+        frontier = np.unique(neighbors)
+    labels = graph.labels
+    reached = np.flatnonzero(distances >= 0).tolist()
+    node2distances = defaultdict(int, ((labels[i], int(distances[i])) for i in reached))
+    node2num_paths = defaultdict(int, ((labels[i], int(num_paths[i])) for i in reached))
+    node2parents = defaultdict(list)
+    for parents, children in zip(parent_ids, child_ids):
+        for parent, child in zip(parents.tolist(), children.tolist()):
+            node2parents[labels[child]].append(labels[parent])
     return node2distances, node2num_paths, node2parents
 
 
@@ -189,7 +244,7 @@ def approximate_betweenness(graph, max_depth):
     end to get the final betweenness.
 
     Params:
-      graph.......A networkx Graph
+      graph.......A networkx Graph or a CSRGraph
       max_depth...An integer representing the maximum depth to search.
 
     Returns:
@@ -293,11 +348,20 @@ def volume(nodes, graph):
     nodes.
     Params:
       nodes...a list of strings for the nodes to compute the volume of.
-      graph...a networkx graph
+      graph...a networkx graph or a CSRGraph
 
     >>> volume(['A', 'B', 'C'], example_graph())
     4
+    >>> volume(['A', 'B', 'C'], CSRGraph.from_networkx(example_graph()))
+    4
     """
+    if isinstance(graph, CSRGraph):
+        ids = graph.ids(nodes)
+        member = np.zeros(graph.order(), dtype=bool)
+        member[ids] = True
+        neighbors, _ = graph.gather(ids)
+        int_edges = int(member[neighbors].sum())
+        return round(int_edges/2 + len(neighbors) - int_edges)
     ext_edges = 0
     int_edges = 0
     for node in nodes:
@@ -323,7 +387,14 @@ h    Returns:
 
     >>> cut(['A', 'B', 'C'], ['D', 'E', 'F', 'G'], example_graph())
     1
+    >>> cut(['A', 'B', 'C'], ['D', 'E', 'F', 'G'], CSRGraph.from_networkx(example_graph()))
+    1
     """
+    if isinstance(graph, CSRGraph):
+        member = np.zeros(graph.order(), dtype=bool)
+        member[graph.ids(node for node in T if node in graph)] = True
+        neighbors, _ = graph.gather(graph.ids(S))
+        return int(member[neighbors].sum())
     cut_set = 0
     for node in S:
         for neighbor in graph.neighbors(node):
@@ -457,7 +528,7 @@ def jaccard(graph, node, k):
     Note that we don't return scores for edges that already appear in the graph.
 
     Params:
-      graph....a networkx graph
+      graph....a networkx graph or a CSRGraph
       node.....a node in the graph (a string) to recommend links for.
       k........the number of links to recommend.
 
@@ -475,7 +546,11 @@ def jaccard(graph, node, k):
     >>> train_graph = make_training_graph(g, 'D', 2)
     >>> jaccard(train_graph, 'D', 2)
     [(('D', 'E'), 0.5), (('D', 'A'), 0.0)]
+    >>> jaccard(CSRGraph.from_networkx(train_graph), 'D', 2)
+    [(('D', 'E'), 0.5), (('D', 'A'), 0.0)]
     """
+    if isinstance(graph, CSRGraph):
+        return jaccard_csr(graph, node, k)
     new_edges = defaultdict(float)
     neighbors = set(graph.neighbors(node))
     scores = []
@@ -487,6 +562,38 @@ def jaccard(graph, node, k):
     return sorted(new_edges.items(), key=lambda x: (-x[1], x[0][1]))[:k]
 
 
+def jaccard_csr(graph, node, k):
+    """
+    jaccard for a CSRGraph. The common neighbors of node and every other node are
+    counted at once, by adding one to each neighbor of each neighbor of node;
+    the union sizes follow from the degrees.
+
+    Params:
+      graph....a CSRGraph
+      node.....a node name to recommend links for.
+      k........the number of links to recommend.
+
+    Returns:
+      The list of (edge, score) tuples of jaccard.
+    """
+    i = graph.index[node]
+    neighbors = graph.neighbor_ids(i)
+    common = np.bincount(graph.gather(neighbors)[0], minlength=graph.order())
+    union = len(neighbors) + graph.degrees() - common
+    candidates = np.ones(graph.order(), dtype=bool)
+    candidates[neighbors] = False
+    candidates[i] = False
+    candidates = np.flatnonzero(candidates)
+    scores = common[candidates] / union[candidates]
+    if k < len(candidates):
+        # Only sort the names of the candidates scoring at least the k-th best score.
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        candidates, scores = candidates[scores >= kth], scores[scores >= kth]
+    labels = graph.labels
+    new_edges = [((node, labels[j]), score) for j, score in zip(candidates.tolist(), scores.tolist())]
+    return sorted(new_edges, key=lambda x: (-x[1], x[0][1]))[:k]
+
+
 def evaluate(predicted_edges, graph):
     """
     Return the fraction of the predicted edges that exist in the graph.
@@ -520,18 +627,21 @@ Next, we'll download a real dataset to see how our algorithm performs.
 """
 def download_data():
     """
-    Download the data. Done for you.
+    Download the data, unless a previous run did. Done for you.
     """
+    if os.path.exists('edges.txt.gz'):
+        return
     urllib.request.urlretrieve('http://cs.iit.edu/~culotta/cs579/a1/edges.txt.gz', 'edges.txt.gz')
 
 
 def read_graph():
-    """ Read 'edges.txt.gz' into a networkx **undirected** graph.
-    Done for you.
+    """ Read 'edges.txt.gz' into an **undirected** CSRGraph (see csrgraph.py).
+    The first run parses the file and caches the graph in 'edges.txt.gz.csr';
+    later runs load the cache.
     Returns:
-      A networkx undirected graph.
+      A CSRGraph.
     """
-    return nx.read_edgelist('edges.txt.gz', delimiter='\t')
+    return read_edgelist('edges.txt.gz', delimiter='\t')
 
 
 def main():
@@ -542,7 +652,8 @@ def main():
     graph = read_graph()
     print('graph has %d nodes and %d edges' %
           (graph.order(), graph.number_of_edges()))
-    subgraph = get_subgraph(graph, 2)
+    # Girvan-Newman and the training graph remove edges, so they work on a networkx copy.
+    subgraph = get_subgraph(graph, 2).to_networkx()
     print('subgraph has %d nodes and %d edges' %
           (subgraph.order(), subgraph.number_of_edges()))
     print('norm_cut scores by max_depth:')
@@ -0,0 +1,299 @@
+"""
+Compact graphs for the a1 algorithms.
+
+An undirected graph is held as CSR (compressed sparse row) arrays over
+contiguous int32 node ids: the neighbors of node i are the sorted
+indices[indptr[i]:indptr[i + 1]], labels[i] is its name and index maps each
+name back to its id. Each edge takes 8 bytes (4 per direction), against a few
+hundred bytes for the dicts of a networkx Graph, and the algorithms of a1.py
+walk the arrays instead of hashing node names on every edge visit.
+
+CSRGraph also has the read methods of a networkx Graph used by a1.py
+(nodes, neighbors, has_edge, degree, ...), with node names, so code written for
+networkx runs on it unchanged.
+
+read_edgelist parses a (gzipped) tab separated edge list a large chunk at a
+time straight into a CSRGraph, and caches the graph in a directory next to the
+file, which later runs load instead of parsing the text again:
+
+    meta.json           the format version, the numbers of nodes and edges, and
+                        the size and modification time of the edge list
+    indptr.npy          the CSR offsets
+    indices.npy         the CSR neighbor ids
+    labels.txt          the node names, one per line, in id order
+
+The arrays are memory-mapped on load.
+"""
+import gzip
+import json
+import os
+import shutil
+
+import numpy as np
+
+CACHE_FORMAT = 1
+# Bytes of the edge list parsed at a time.
+CHUNK_SIZE = 1 << 22
+
+
+class CSRGraph(object):
+    """
+    An undirected graph in CSR form.
+
+    Params:
+        indptr.....int64 array of n + 1 offsets into indices.
+        indices....int32 array of the sorted neighbor ids of each node.
+        labels.....The list of the n node names.
+
+    >>> graph = CSRGraph.from_edges([('A', 'B'), ('A', 'C'), ('B', 'C'), ('B', 'D')])
+    >>> graph.labels, graph.indptr.tolist(), graph.indices.tolist()
+    (['A', 'B', 'C', 'D'], [0, 2, 5, 7, 8], [1, 2, 0, 2, 3, 0, 1, 1])
+    >>> sorted(graph.neighbors('B')), graph.has_edge('D', 'B'), graph.number_of_edges()
+    (['A', 'C', 'D'], True, 4)
+    """
+
+    def __init__(self, indptr, indices, labels):
+        self.indptr = indptr
+        self.indices = indices
+        self.labels = labels
+        self.index = dict(zip(labels, range(len(labels))))
+
+    @classmethod
+    def from_arrays(cls, labels, sources, targets):
+        """ Build a graph from the node names and two arrays of node ids, one edge
+        per pair. Repeated edges, in either direction, are kept once.
+        """
+        n = len(labels)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        # Both directions of each edge as row * n + column keys; sorting them sorts by row.
+        keys = np.sort(np.concatenate([sources * n + targets, targets * n + sources]))
+        keys = keys[np.diff(keys, prepend=-1) != 0]
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(keys // n, minlength=n))
+        return cls(indptr, (keys % n).astype(np.int32), list(labels))
+
+    @classmethod
+    def from_edges(cls, edges, nodes=()):
+        """ Build a graph from (u, v) name pairs. Nodes are numbered in the order
+        they first appear, starting with those of nodes (e.g., isolated nodes).
+        """
+        index = dict((label, i) for i, label in enumerate(nodes))
+        ends = []
+        for u, v in edges:
+            ends.append(index.setdefault(u, len(index)))
+            ends.append(index.setdefault(v, len(index)))
+        ends = np.array(ends, dtype=np.int64)
+        return cls.from_arrays(list(index), ends[0::2], ends[1::2])
+
+    @classmethod
+    def from_networkx(cls, graph):
+        """ Build a graph from a networkx Graph, keeping the order of its nodes. """
+        return cls.from_edges(graph.edges(), graph.nodes())
+
+    def subgraph(self, nodes):
+        """ Return the CSRGraph induced by the node names, keeping their id order.
+        Names that are not nodes are ignored, as by networkx.
+        """
+        keep = np.zeros(self.order(), dtype=bool)
+        keep[self.ids(node for node in nodes if node in self.index)] = True
+        new_ids = np.cumsum(keep) - 1
+        rows, cols = self.edge_ids()
+        inside = keep[rows] & keep[cols]
+        labels = [label for label, k in zip(self.labels, keep.tolist()) if k]
+        return CSRGraph.from_arrays(labels, new_ids[rows[inside]], new_ids[cols[inside]])
+
+    def to_networkx(self):
+        """ Return the graph as a networkx Graph, with the nodes in id order. """
+        import networkx as nx
+        graph = nx.Graph()
+        graph.add_nodes_from(self.labels)
+        rows, cols = self.edge_ids()
+        labels = self.labels
+        graph.add_edges_from((labels[u], labels[v]) for u, v in zip(rows.tolist(), cols.tolist()))
+        return graph
+
+    def neighbor_ids(self, i):
+        """ Return the array of the neighbor ids of node id i. """
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def gather(self, ids):
+        """ Return the ids of every neighbor of the node ids, and the position in ids
+        of the node each one is a neighbor of.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        starts = self.indptr[ids]
+        counts = self.indptr[ids + 1] - starts
+        owners = np.repeat(np.arange(len(ids)), counts)
+        offsets = np.arange(len(owners)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.indices[starts[owners] + offsets], owners
+
+    def degrees(self):
+        """ Return the array of the degree of every node id. """
+        return np.diff(self.indptr)
+
+    def edge_ids(self):
+        """ Return two arrays with the ends u <= v of every edge, sorted. """
+        rows = np.repeat(np.arange(len(self.labels), dtype=np.int32), self.degrees())
+        keep = rows <= self.indices
+        return rows[keep], self.indices[keep]
+
+    def ids(self, nodes):
+        """ Return the int64 array of the ids of node names. """
+        return np.array([self.index[node] for node in nodes], dtype=np.int64)
+
+    # The networkx Graph methods used by a1.py, with node names.
+
+    def nodes(self):
+        return list(self.labels)
+
+    def neighbors(self, node):
+        labels = self.labels
+        return iter([labels[i] for i in self.neighbor_ids(self.index[node]).tolist()])
+
+    def has_edge(self, u, v):
+        if u not in self.index or v not in self.index:
+            return False
+        neighbors = self.neighbor_ids(self.index[u])
+        i = np.searchsorted(neighbors, self.index[v])
+        return bool(i < len(neighbors) and neighbors[i] == self.index[v])
+
+    def degree(self):
+        return list(zip(self.labels, self.degrees().tolist()))
+
+    def edges(self):
+        rows, cols = self.edge_ids()
+        labels = self.labels
+        return [(labels[u], labels[v]) for u, v in zip(rows.tolist(), cols.tolist())]
+
+    def order(self):
+        return len(self.labels)
+
+    def number_of_nodes(self):
+        return len(self.labels)
+
+    def number_of_edges(self):
+        return len(self.edge_ids()[0])
+
+    def __contains__(self, node):
+        return node in self.index
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        return iter(self.labels)
+
+
+def _parse_lines(lines, delimiter, comments, index, ends):
+    """ Append the node ids of the two ends of the edge of each line to ends,
+    numbering new node names (bytes) in index. Lines are handled as
+    networkx.read_edgelist does: anything after the comment character is dropped,
+    and so are blank lines and the columns after the second.
+    """
+    setdefault = index.setdefault
+    for line in lines:
+        p = line.find(comments)
+        if p >= 0:
+            line = line[:p]
+        fields = line.strip().split(delimiter)
+        if len(fields) < 2:
+            continue
+        ends.append(setdefault(fields[0], len(index)))
+        ends.append(setdefault(fields[1], len(index)))
+
+
+def parse_edgelist(filename, delimiter='\t', comments='#', chunk_size=CHUNK_SIZE):
+    """ Read an edge list, gzipped if its name ends with .gz, into a CSRGraph.
+    Nodes are numbered in the order they first appear, as networkx.read_edgelist adds them.
+
+    >>> import tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'edges.txt.gz')
+    >>> with gzip.open(filename, 'wt') as fout:
+    ...     _ = fout.write('# likes\\nBill Gates\\tTED\\nTED\\tNASA\\n\\nNASA\\tBill Gates\\n')
+    >>> graph = parse_edgelist(filename, chunk_size=8)
+    >>> graph.labels, graph.number_of_edges()
+    (['Bill Gates', 'TED', 'NASA'], 3)
+    """
+    opener = gzip.open if filename.endswith('.gz') else open
+    delimiter, comments = delimiter.encode('utf-8'), comments.encode('utf-8')
+    index = {}
+    ends = []
+    rest = b''
+    with opener(filename, 'rb') as fin:
+        while True:
+            chunk = fin.read(chunk_size)
+            if not chunk:
+                break
+            lines = (rest + chunk).split(b'\n')
+            # The last line may go on in the next chunk.
+            rest = lines.pop()
+            _parse_lines(lines, delimiter, comments, index, ends)
+    _parse_lines([rest], delimiter, comments, index, ends)
+    ends = np.array(ends, dtype=np.int64)
+    labels = [label.decode('utf-8') for label in index]
+    return CSRGraph.from_arrays(labels, ends[0::2], ends[1::2])
+
+
+def _source_stamp(filename):
+    stat = os.stat(filename)
+    return {'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+
+
+def write_cache(graph, directory, source):
+    """ Store a CSRGraph read from the file source in directory, replacing what was there.
+    The cache is written next to it first, so readers never see half a cache.
+    """
+    tmp = directory.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, 'indptr.npy'), graph.indptr)
+    np.save(os.path.join(tmp, 'indices.npy'), graph.indices)
+    with open(os.path.join(tmp, 'labels.txt'), 'w', encoding='utf-8') as fout:
+        fout.write('\n'.join(graph.labels))
+    meta = dict(_source_stamp(source), format=CACHE_FORMAT, nodes=graph.order(), edges=graph.number_of_edges())
+    with open(os.path.join(tmp, 'meta.json'), 'w') as fout:
+        json.dump(meta, fout)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(tmp, directory)
+
+
+def read_cache(directory, source):
+    """ Return the CSRGraph cached in directory, or None if there is no cache, or it
+    has another format or was made from another version of the file source.
+    """
+    try:
+        with open(os.path.join(directory, 'meta.json')) as fin:
+            meta = json.load(fin)
+    except (IOError, ValueError):
+        return None
+    if meta.get('format') != CACHE_FORMAT or any(meta.get(k) != v for k, v in _source_stamp(source).items()):
+        return None
+    indptr = np.load(os.path.join(directory, 'indptr.npy'), mmap_mode='r')
+    indices = np.load(os.path.join(directory, 'indices.npy'), mmap_mode='r')
+    with open(os.path.join(directory, 'labels.txt'), encoding='utf-8') as fin:
+        labels = fin.read().split('\n') if meta['nodes'] else []
+    return CSRGraph(indptr, indices, labels)
+
+
+def read_edgelist(filename, delimiter='\t', cache=True):
+    """ Read an edge list into a CSRGraph, from its cache (filename + '.csr') if it is
+    up to date, else by parsing it and, if cache is True, writing the cache.
+
+    >>> import tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'edges.txt')
+    >>> with open(filename, 'w') as fout:
+    ...     _ = fout.write('A\\tB\\nB\\tC\\n')
+    >>> read_edgelist(filename).labels, os.path.exists(filename + '.csr/meta.json')
+    (['A', 'B', 'C'], True)
+    >>> graph = read_edgelist(filename)
+    >>> type(graph.indices).__name__, sorted(graph.neighbors('B'))
+    ('memmap', ['A', 'C'])
+    """
+    directory = filename + '.csr'
+    graph = read_cache(directory, filename) if cache else None
+    if graph is None:
+        graph = parse_edgelist(filename, delimiter)
+        if cache:
+            write_cache(graph, directory, filename)
+    return graph
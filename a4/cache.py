@@ -0,0 +1,139 @@
+"""
+Response cache.
+
+An on-disk, content addressed cache of Twitter responses, keyed by resource and
+normalized parameters. Each endpoint has its own time to live, and 404 (not
+found) and 401 (protected account) answers are cached too, so they are not asked
+for again. In offline mode every request is served from the cache and a miss is
+an error, so the whole pipeline can be replayed without network.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+# Seconds a cached response stays fresh, per endpoint. Only these endpoints are cached.
+DAY = 24 * 60 * 60
+TTLS = {
+    'users/lookup': DAY,
+    'friends/ids': DAY,
+    'followers/ids': DAY,
+}
+# Seconds a "not found" or "protected" answer stays fresh.
+NEGATIVE_TTL = 7 * DAY
+NEGATIVE_STATUS_CODES = (401, 404)
+
+
+class CacheMiss(LookupError):
+    """ Raised in offline mode when a request is not in the cache. """
+
+
+class CachedResponse(object):
+    """
+    A stored response, with the same attributes as a TwitterResponse.
+
+    >>> r = CachedResponse(200, '[{"id": 1}, {"id": 2}]')
+    >>> r.json()[0], [u['id'] for u in r]
+    ({'id': 1}, [1, 2])
+    """
+
+    def __init__(self, status_code, text, headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.text)
+
+    def __iter__(self):
+        data = self.json()
+        return iter(data if isinstance(data, list) else [data])
+
+
+def normalize_params(params):
+    """ Return params with sorted keys and every value as a string; lists are comma joined.
+
+    >>> normalize_params({'user_id': [2, 1], 'count': 5000, 'cursor': None})
+    [['count', '5000'], ['user_id', '2,1']]
+    """
+    normalized = []
+    for key in sorted(params or {}):
+        value = params[key]
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ','.join(str(v) for v in value)
+        normalized.append([key, str(value)])
+    return normalized
+
+
+def cache_key(resource, params):
+    """ Return the hex digest identifying a request.
+
+    >>> cache_key('friends/ids', {'screen_name': 'a', 'count': 5000}) == \\
+    ...     cache_key('friends/ids', {'count': '5000', 'screen_name': 'a'})
+    True
+    """
+    key = json.dumps([resource, normalize_params(params)])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class ResponseCache(object):
+    """
+    Stores responses as JSON files under directory/<resource>/<xx>/<key>.json.
+
+    Params:
+        directory......Root directory of the cache.
+        ttls...........Dict from resource to seconds a response stays fresh. Resources
+                       not in the dict are never cached.
+        negative_ttl...Seconds a 401 or 404 response stays fresh.
+        offline........If True, never expire entries; requests not in the cache raise CacheMiss.
+    """
+
+    def __init__(self, directory='data/cache', ttls=TTLS, negative_ttl=NEGATIVE_TTL, offline=False):
+        self.directory = directory
+        self.ttls = ttls
+        self.negative_ttl = negative_ttl
+        self.offline = offline
+
+    def cacheable(self, resource):
+        return resource in self.ttls
+
+    def path(self, resource, params):
+        key = cache_key(resource, params)
+        return os.path.join(self.directory, resource.replace('/', '-'), key[:2], key + '.json')
+
+    def get(self, resource, params):
+        """ Return the fresh CachedResponse for this request, or None.
+        In offline mode a request that is not cached raises CacheMiss.
+        """
+        filename = self.path(resource, params)
+        entry = None
+        if self.cacheable(resource) and os.path.exists(filename):
+            with open(filename) as fin:
+                entry = json.load(fin)
+            ttl = self.negative_ttl if entry['status_code'] in NEGATIVE_STATUS_CODES else self.ttls[resource]
+            if not self.offline and time.time() - entry['stored_at'] > ttl:
+                entry = None
+        if entry is None:
+            if self.offline:
+                raise CacheMiss('%s %s is not cached' % (resource, normalize_params(params)))
+            return None
+        return CachedResponse(entry['status_code'], entry['text'], entry['headers'])
+
+    def put(self, resource, params, response):
+        """ Store a response if its resource is cacheable and it is a success, not found or protected answer. """
+        if not self.cacheable(resource) or not (response.status_code == 200 or
+                                                response.status_code in NEGATIVE_STATUS_CODES):
+            return
+        filename = self.path(resource, params)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        entry = {'resource': resource, 'params': normalize_params(params), 'stored_at': time.time(),
+                 'status_code': response.status_code, 'headers': dict(response.headers), 'text': response.text}
+        # Write to a temporary file first, so concurrent readers never see half an entry.
+        tmp = '%s.%d.%d.tmp' % (filename, os.getpid(), threading.get_ident())
+        with open(tmp, 'w') as fout:
+            json.dump(entry, fout)
+        os.replace(tmp, filename)
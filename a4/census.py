@@ -0,0 +1,161 @@
+"""
+Census name index.
+
+The 1990 census first name tables are downloaded once into a versioned local
+cache, then compiled into a compact index: a sorted array of names and two arrays
+with the frequency (in percent) of each name among males and females. The arrays
+are stored as .npy files and memory-mapped on load. Lookups are vectorized, so
+the gender probabilities of many first names are computed at once.
+"""
+import json
+import os
+
+import numpy as np
+import requests
+
+
+CENSUS_URLS = {
+    'male': 'http://www2.census.gov/topics/genealogy/1990surnames/dist.male.first',
+    'female': 'http://www2.census.gov/topics/genealogy/1990surnames/dist.female.first',
+}
+# Bump when the layout of the compiled index changes, so old caches are rebuilt.
+INDEX_VERSION = 1
+CENSUS_DIR = 'data/census'
+
+
+def download_census(directory=CENSUS_DIR):
+    """ Download the census tables into directory/raw, unless they are already there.
+    Returns:
+      A dict from 'male' and 'female' to the text of each table.
+    """
+    raw_dir = os.path.join(directory, 'raw')
+    os.makedirs(raw_dir, exist_ok=True)
+    tables = {}
+    for gender, url in CENSUS_URLS.items():
+        filename = os.path.join(raw_dir, os.path.basename(url))
+        if not os.path.exists(filename):
+            text = requests.get(url).text
+            with open(filename + '.tmp', 'w') as fout:
+                fout.write(text)
+            os.replace(filename + '.tmp', filename)
+            print("Census %s names downloaded to %s" % (gender, filename))
+        with open(filename) as fin:
+            tables[gender] = fin.read()
+    return tables
+
+
+def parse_table(text):
+    """ Parse a census table into a dict from lower cased name to frequency in percent.
+
+    >>> parse_table('JAMES          3.318  3.318      1\\nJOHN           3.271  6.589      2\\n')
+    {'james': 3.318, 'john': 3.271}
+    """
+    return dict((line.split()[0].lower(), float(line.split()[1])) for line in text.split('\n') if line.strip())
+
+
+class CensusIndex(object):
+    """
+    Sorted name array with the male and female frequency of each name.
+
+    Params:
+        names.....Sorted array of ASCII encoded names (numpy bytes array).
+        male......Array with the percent of males with each name.
+        female....Array with the percent of females with each name.
+
+    >>> index = CensusIndex.build({'mary': 2.6, 'jordan': 0.2}, {'mary': 0.01, 'jordan': 0.05, 'ann': 0.4})
+    >>> index.genders(['jordan', 'ann', 'mary', 'zzz'])
+    array([ 0,  1,  0, -1])
+    >>> index.probabilities(['jordan', 'zzz'])[1].round(2).tolist()
+    [0.2, nan]
+    """
+
+    def __init__(self, names, male, female):
+        self.names = names
+        self.male = male
+        self.female = female
+
+    @classmethod
+    def build(cls, males_pct, females_pct):
+        """ Compile the index from two dicts from name to frequency. """
+        names = sorted(set(males_pct) | set(females_pct))
+        return cls(np.array([n.encode('ascii') for n in names]),
+                   np.array([males_pct.get(n, 0.) for n in names], dtype=np.float32),
+                   np.array([females_pct.get(n, 0.) for n in names], dtype=np.float32))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'names.npy'), self.names)
+        np.save(os.path.join(directory, 'male.npy'), self.male)
+        np.save(os.path.join(directory, 'female.npy'), self.female)
+        with open(os.path.join(directory, 'version.json'), 'w') as fout:
+            json.dump({'version': INDEX_VERSION, 'names': len(self.names)}, fout)
+
+    @classmethod
+    def load(cls, directory):
+        """ Memory-map a saved index. Returns None if it is missing or of another version. """
+        try:
+            with open(os.path.join(directory, 'version.json')) as fin:
+                if json.load(fin)['version'] != INDEX_VERSION:
+                    return None
+        except (IOError, ValueError, KeyError):
+            return None
+        return cls(*[np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+                     for name in ('names', 'male', 'female')])
+
+    def __len__(self):
+        return len(self.names)
+
+    def find(self, names):
+        """ Return the position of each name in the index, and a mask of the names found. """
+        query = np.array([(n or '').encode('ascii', 'replace') for n in names], dtype=bytes)
+        if len(self.names) == 0 or len(query) == 0:
+            return np.zeros(len(query), dtype=int), np.zeros(len(query), dtype=bool)
+        idx = np.minimum(np.searchsorted(self.names, query), len(self.names) - 1)
+        return idx, self.names[idx] == query
+
+    def probabilities(self, names):
+        """ Return the probability of each name being male and female (nan if not a census name). """
+        idx, found = self.find(names)
+        male, female = np.asarray(self.male)[idx], np.asarray(self.female)[idx]
+        total = male + female
+        p_male = np.full(len(idx), np.nan)
+        p_female = np.full(len(idx), np.nan)
+        p_male[found] = male[found] / total[found]
+        p_female[found] = female[found] / total[found]
+        return p_male, p_female
+
+    def genders(self, names):
+        """ Return 1 for names more frequent among females, 0 for males and -1 for
+        names not in the census or as frequent for both.
+        """
+        idx, found = self.find(names)
+        male, female = np.asarray(self.male)[idx], np.asarray(self.female)[idx]
+        result = np.full(len(idx), -1)
+        result[found & (female > male)] = 1
+        result[found & (male > female)] = 0
+        return result
+
+    def male_names(self):
+        """ Return the set of names more frequent among males. """
+        return set(n.decode('ascii') for n in np.asarray(self.names)[np.asarray(self.male) > np.asarray(self.female)])
+
+    def female_names(self):
+        """ Return the set of names more frequent among females. """
+        return set(n.decode('ascii') for n in np.asarray(self.names)[np.asarray(self.female) > np.asarray(self.male)])
+
+
+def load_census_index(directory=CENSUS_DIR):
+    """ Load the census index, downloading and compiling it on first use.
+    Params:
+        directory....The cache directory; the index is kept in directory/v<INDEX_VERSION>.
+    Returns:
+        A CensusIndex.
+    """
+    index_dir = os.path.join(directory, 'v%d' % INDEX_VERSION)
+    index = CensusIndex.load(index_dir)
+    if index is None:
+        tables = download_census(directory)
+        CensusIndex.build(parse_table(tables['male']), parse_table(tables['female'])).save(index_dir)
+        index = CensusIndex.load(index_dir)
+        print("Census name index with %d names saved to %s" % (len(index), index_dir))
+    return index
@@ -17,29 +17,30 @@ from sklearn.metrics import accuracy_score, confusion_matrix
 import numpy as np
 from TwitterAPI import TwitterAPI
 import matplotlib.pyplot as plt
+from census import load_census_index
+from dedupe import Deduplicator
+from sink import read_segments
 
 
 def read_census_names():
     """
-    Read census names collected in the collect python script.
+    Read the census name index compiled in the collect python script (see census.py).
 
     Returns:
-        Two lists of male_names and female_names
+        A CensusIndex with the male and female frequency of each name.
     """
-    male_names = pickle.load(open('data/collect/male_names.pkl', 'rb'))
-    female_names = pickle.load(open('data/collect/female_names.pkl', 'rb'))
-    return male_names, female_names
+    return load_census_index()
 
 
-def read_real_time_tweets(filename):
+def read_real_time_tweets(directory):
     """Read real time tweets retrieved during collect phase
     
     Params:
-        filename.....The file where the tweets are stored.
+        directory....The directory where the tweet segments are stored (see sink.py).
     Returns:
-        The list of real time tweets
+        The list of real time tweets, without duplicates (see dedupe.py).
     """
-    return pickle.load(open(filename, 'rb'))
+    return list(Deduplicator(collapse_retweets=False).filter(read_segments(directory)))
 
 
 def get_first_name(tweet):
@@ -151,15 +152,22 @@ def make_feature_matrix(tweets, tokens_list, vocabulary):
     return X.tocsr()
 
 
-def get_gender(tweet, male_names, female_names):
+def get_gender(tweet, census):
     # Let 1=Female, 0=Male.
-    name = get_first_name(tweet)
-    if name in female_names:
-        return 1
-    elif name in male_names:
-        return 0
-    else:
-        return -1
+    return get_genders([tweet], census)[0]
+
+
+def get_genders(tweets, census):
+    """
+    Label many tweets at once with the gender of their user's first name.
+
+    Params:
+        tweets....List of tweets.
+        census....The CensusIndex.
+    Returns:
+        An array with 1 for female, 0 for male and -1 for unknown names.
+    """
+    return census.genders([get_first_name(t) for t in tweets])
 
 
 def do_cross_val(X, y, nfolds=5):
@@ -394,18 +402,17 @@ def print_top_misclassified(test_tweets, test_labels, X_test, clf, n):
 def main():
 	
 	# 0 - Establish twitter connection and read all the names picked from the U.S. census.
-    male_names, female_names = read_census_names()
-    print('found %d female and %d male names' % (len(female_names), len(male_names)))
+    census = read_census_names()
+    print('found %d female and %d male names' % (len(census.female_names()), len(census.male_names())))
 
 	# 1 - Retrieve the real time tweets
-    filename = 'data/collect/real-time-tweets.pkl'
-    tweets = read_real_time_tweets(filename)
+    tweets = read_real_time_tweets('data/collect/real-time-tweets')
     print('Read %d tweets for training data' % len(tweets))
     print('top names:', Counter(get_first_name(t) for t in tweets).most_common(10))
 
 
     # 2 - Obtain accuracies for all possible options
-    labels = np.array([get_gender(t, male_names, female_names) for t in tweets])
+    labels = get_genders(tweets, census)
     argnames, option_iter = generate_all_opts()
     results_sorted  = eval_all_combinations(tweets, labels)
     
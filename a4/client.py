@@ -0,0 +1,117 @@
+"""
+Shared Twitter client.
+
+TwitterAPI opens a new HTTP session, and so a new TLS connection, for every
+request. PooledTwitterAPI keeps one session per credential set, with a pool of
+keep-alive connections shared by all the threads, for every REST request; the
+streaming endpoints still get a connection of their own. get_twitter returns
+one RequestScheduler per config file for the whole process, so every stage of a
+pipeline run in one process (see summarize.py) reuses the same connections.
+"""
+import configparser
+import ssl
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from TwitterAPI import TwitterAPI, TwitterResponse
+from TwitterAPI.TwitterAPI import ENDPOINTS
+from TwitterAPI.TwitterError import TwitterConnectionError
+
+from cache import ResponseCache
+from fetch import RequestScheduler
+
+# Connections kept open per credential set; as many as the concurrent requests of fetch.py.
+POOL_SIZE = 10
+
+
+class PooledTwitterAPI(TwitterAPI):
+    """
+    A TwitterAPI whose REST requests go through one long-lived session with
+    keep-alive connections.
+
+    It reuses private helpers of TwitterAPI (_get_endpoint, _prepare_url), so
+    the TwitterAPI version is pinned in requirements.txt.
+
+    Params:
+        pool_size....The number of connections kept open.
+    Other arguments are those of TwitterAPI.
+
+    Here the requests go to a local stand-in (see mockapi.py) instead of api.twitter.com:
+
+    >>> from mockapi import MockData, MockTwitterServer
+    >>> data = MockData([{'id': 1, 'screen_name': 'alice', 'protected': False, 'friends': [2, 3]}])
+    >>> with MockTwitterServer(data) as server:
+    ...     twitter = PooledTwitterAPI('key', 'secret', 'token', 'token secret')
+    ...     twitter._prepare_url = lambda subdomain, path: '%s/1.1/%s.json' % (server.url, path)
+    ...     responses = [twitter.request('friends/ids', {'screen_name': 'alice'}) for i in range(3)]
+    ...     lookup = twitter.request('users/lookup', {'user_id': '1'})
+    ...     pools = twitter.session.get_adapter(server.url).poolmanager.pools
+    >>> [r.status_code for r in responses], responses[0].json()['ids'], [u['screen_name'] for u in lookup]
+    ([200, 200, 200], [2, 3], ['alice'])
+    >>> [(pools[key].num_connections, pools[key].num_requests) for key in pools.keys()]
+    [(1, 4)]
+    """
+
+    def __init__(self, *args, pool_size=POOL_SIZE, **kwargs):
+        super(PooledTwitterAPI, self).__init__(*args, **kwargs)
+        self.session = requests.Session()
+        self.session.auth = self.auth
+        self.session.headers['User-Agent'] = self.USER_AGENT
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, resource, params=None, **kwargs):
+        path, endpoint = self._get_endpoint(resource)
+        method, subdomain = ENDPOINTS.get(endpoint, (None, ''))
+        # Streams, uploads and anything but a plain v1.1 GET or POST keep the TwitterAPI behavior.
+        if kwargs or method not in ('GET', 'POST') or 'stream' in subdomain or self.version != '1.1':
+            return super(PooledTwitterAPI, self).request(resource, params, **kwargs)
+        try:
+            r = self.session.request(method, self._prepare_url(subdomain, path),
+                                     params=params if method == 'GET' else None,
+                                     data=params if method == 'POST' else None,
+                                     timeout=(self.CONNECTION_TIMEOUT, self.REST_TIMEOUT), proxies=self.proxies)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                ssl.SSLError, socket.error) as e:
+            raise TwitterConnectionError(e)
+        return TwitterResponse(r, {'api_version': self.version, 'is_stream': False, 'hydrate_type': 0})
+
+    def close(self):
+        self.session.close()
+
+
+_twitters = {}
+_twitters_lock = threading.Lock()
+
+
+def get_twitter(config_file='twitter.cfg', cache_dir='data/cache', offline=False, sections=None):
+    """ Return the RequestScheduler of a config file, created on first use and shared
+    by every later call in the process with the same arguments.
+    Args:
+      config_file ... A config file in ConfigParser format with Twitter credentials. Every
+                      section whose name starts with "twitter" is a credential set.
+      cache_dir ..... Directory of the response cache (see cache.py), or None for no cache.
+      offline ....... If True, serve every request from the cache and never touch the network.
+      sections ...... The names of the credential sets to use, or None for all of them.
+    Returns:
+      A RequestScheduler over one PooledTwitterAPI per credential set.
+    """
+    key = (config_file, cache_dir, offline, tuple(sections) if sections else None)
+    with _twitters_lock:
+        if key not in _twitters:
+            cache = ResponseCache(cache_dir, offline=offline) if cache_dir else None
+            clients = []
+            if not offline:
+                config = configparser.ConfigParser()
+                config.read(config_file)
+                clients = [PooledTwitterAPI(config.get(section, 'consumer_key'),
+                                            config.get(section, 'consumer_secret'),
+                                            config.get(section, 'access_token'),
+                                            config.get(section, 'access_token_secret'))
+                           for section in config.sections()
+                           if section.startswith('twitter') and (sections is None or section in sections)]
+            _twitters[key] = RequestScheduler(clients, cache)
+        return _twitters[key]
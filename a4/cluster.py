@@ -6,38 +6,39 @@ from collections import defaultdict
 import matplotlib.pyplot as plt
 import networkx as nx
 import sys
-import time
 import json
-import configparser
-from TwitterAPI import TwitterAPI
 from itertools import combinations
 import warnings
 import itertools
 from networkx.algorithms import community as nxcommunity
 import community # necessary to specify in the requirements algorithm the package to install
-import pickle
+import numpy as np
+import client
+from csrgraph import CSRGraph
+from fetch import rate_limited_request
+from idlists import as_ids, count_ids, intersect
+from history import diff_snapshots, list_snapshots, record_snapshot
+from paginate import iterate_cursor
+from snapshot import set_attributes, write_snapshot
+from userstore import read_user_store
 warnings.filterwarnings("ignore")
 
+# The graph and the communities found in it (see snapshot.py).
+GRAPH_FILE = 'data/cluster/graph.snapshot'
+
 
 def get_twitter(config_file):
-    """ Read the config_file and construct an instance of TwitterAPI.
+    """ Return the Twitter connection shared by the whole process (see client.py).
     Args:
       config_file ... A config file in ConfigParser format with Twitter credentials
     Returns:
-      An instance of TwitterAPI.
+      A RequestScheduler, used in place of a TwitterAPI instance.
     """
-    config = configparser.ConfigParser()
-    config.read(config_file)
-    twitter = TwitterAPI(
-                   config.get('twitter', 'consumer_key'),
-                   config.get('twitter', 'consumer_secret'),
-                   config.get('twitter', 'access_token'),
-                   config.get('twitter', 'access_token_secret'))
-    return twitter
+    return client.get_twitter(config_file)
 
 
 def robust_request(twitter, resource, params, max_tries=5):
-    """ If a Twitter request fails, sleep for 15 minutes.
+    """ Make a Twitter request within the endpoint's rate window (see fetch.rate_limited_request).
     Do this at most max_tries times before quitting.
     Args:
       twitter .... A TwitterAPI object.
@@ -48,56 +49,42 @@ def robust_request(twitter, resource, params, max_tries=5):
     Returns:
       A TwitterResponse object, or None if failed.
     """
-    for i in range(max_tries):
-        request = twitter.request(resource, params)
-        if request.status_code == 200 | request.status_code == 404:
-            return request
-        else:
-            print('Got error %s \n with status code %s\nsleeping for 15 minutes.' % (request.text, request.status_code))
-            sys.stderr.flush()
-            time.sleep(61 * 15)
+    return rate_limited_request(twitter, resource, params, max_tries)
             
 
 def robust_request_iterate(twitter, resource, params, max_pages=5):
     """ Function for managing pagination of results
     It will sequentially obtain all the pages using the cursor provided by Twittter.
+    See paginate.iterate_cursor for a streaming, resumable version.
     Args:
       twitter .... A TwitterAPI object.
-      resource ... A resource string to request
+      resource ... A cursored resource string to request, e.g. "followers/ids".
       params ..... A parameter dict for the request, e.g., to specify
                    parameters like screen_name or count.
-      max_pages .. The maximum number of pages to ask for.
+      max_pages .. The maximum number of pages to ask for, or None for all of them.
     Returns:
-      A TwitterResponse object, or None if failed.
+      A list with the ids of all the pages.
+    Raises:
+      paginate.PageError if a page cannot be fetched.
     """
-    ### TODO:
-    cursor = -1
-    # Add cursor parameter to params:
-    params['cursor'] = cursor
-    print(params)
     results = []
-    while True:
-        response = robust_request(twitter, resource, params)
-        results.extend(response)
-        print(response)
-        next_cursor = response.json()['next_cursor']
-        print(next_cursor)
-        params['cursor'] = next_cursor
-        if (next_cursor == 0):
-            break
+    for page in iterate_cursor(twitter, resource, params, max_pages):
+        results.extend(page)
     return results
 
 
-def read_users(filename):
+def read_users(directory, fields=None):
     """
-    Read the json file that contains all the user dicts.
+    Read the users stored by the collect python script (see userstore.py).
     
     Params:
-        filename....Name of the file to read
+        directory....The user store directory.
+        fields.......The fields to read, or None for all of them. Only these columns are loaded.
     Returns:
-        A list of users dicts, in the order they are listed in the file.
+        A list of users dicts, in the order they were stored, with their friends
+        and followers as sorted id arrays.
     """
-    pickle.load(open(filename, 'rb'))
+    return read_user_store(directory, fields)
 
 def read_users_from_json(filename):
     """
@@ -130,21 +117,75 @@ def read_screen_names(filename):
     return r
 
 
-def count_friends_and_followers(users):
+def count_friends_and_followers(users, capacity=None):
     """ Count how often each user is followed or follows the defined users.
     Params:
         users: a list of user dicts
+        capacity: None to count exactly, or the number of ids kept by a bounded
+                  memory heavy hitters count, for crawls too large to count exactly
     Returns:
-        a Counter object mapping each friend to the number of candidates who follow them.
+        a Counter like IdCounts mapping each friend to the number of candidates who follow them
+        (see idlists.py).
     """
-    result = Counter()
-    for u in users:
-        result.update(u['friends'])
-        result.update(u['followers'])
-    return result
+    id_lists = (ids for u in users for ids in (u['friends'], u['followers']))
+    return count_ids(id_lists, capacity)
+
+
+def build_graph(users, friend_and_followers_counts, initial_screen_names, min_value=2):
+    """
+    Build the graph of create_graph as a CSRGraph (see csrgraph.py), filtering the ids of
+    all the users with array operations. The nodes are numbered in the order create_graph
+    adds them: each user, then its frequent friends, then its frequent followers.
+
+    Args:
+      users..........................The list of user dicts.
+      friend_and_followers_counts....The IdCounts mapping each friend and follower to the number of candidates that follow them.
+      initial_screen_names...........The list of the ethreum accounts we started the project with.
+      min_value......................The threshold for adding a user to the graph or not.
+    Returns:
+      A CSRGraph whose labels are the screen_names of the candidates and the user ids, as strings, of the others.
+      A list of users that should have labels.
+
+    >>> users = [{'id': 1, 'screen_name': 'a', 'friends': [3, 4], 'followers': [5]},
+    ...          {'id': 2, 'screen_name': 'b', 'friends': [4], 'followers': [3]}]
+    >>> graph, labeled = build_graph(users, count_ids([[3, 4], [5], [4], [3]]), ['a', 'b'], min_value=1)
+    >>> graph.labels, graph.indptr.tolist(), graph.indices.tolist(), labeled
+    (['a', '3', '4', 'b'], [0, 2, 4, 6, 8], [1, 2, 0, 3, 0, 3, 1, 2], ['a', 'b'])
+    """
+    counts = friend_and_followers_counts
+    # Ids followed by or following more than min_value users, to filter the lists at once.
+    frequent = counts.ids[counts.counts > min_value]
+    candidates = set(initial_screen_names)
+    # Every node is keyed by its user id, except the candidates, keyed by -(their position + 1).
+    user_keys = np.array([-(i + 1) if u['screen_name'] in candidates else u['id'] for i, u in enumerate(users)],
+                         dtype=np.int64)
+    labeled = np.array([u['screen_name'] in candidates or counts[u['id']] > min_value for u in users], dtype=bool)
+    targets = [np.concatenate([intersect(as_ids(u['friends']), frequent), intersect(as_ids(u['followers']), frequent)])
+               for u in users]
+    sizes = np.array([len(t) for t in targets], dtype=np.int64)
+    sources = np.repeat(user_keys, sizes)
+    targets = np.concatenate(targets) if users else np.zeros(0, dtype=np.int64)
+    # Node keys in the order they first appear: a user (if it is a node), then its edges.
+    in_graph = labeled | (sizes > 0)
+    slots = in_graph + sizes
+    user_slots = (np.cumsum(slots) - slots)[in_graph]
+    is_user = np.zeros(int(slots.sum()), dtype=bool)
+    is_user[user_slots] = True
+    order_keys = np.empty(len(is_user), dtype=np.int64)
+    order_keys[is_user] = user_keys[in_graph]
+    order_keys[~is_user] = targets
+    keys, first = np.unique(order_keys, return_index=True)
+    order = np.argsort(first)
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[order] = np.arange(len(keys))
+    node_keys = keys[order]
+    labels = [str(users[-k - 1]['screen_name']) if k < 0 else str(k) for k in node_keys.tolist()]
+    graph = CSRGraph.from_arrays(labels, rank[np.searchsorted(keys, sources)], rank[np.searchsorted(keys, targets)])
+    nodes_with_labels = [labels[i] for i in rank[np.searchsorted(keys, user_keys[labeled])].tolist()]
+    return graph, nodes_with_labels
 
 
-def create_graph(users, friend_and_followers_counts, initial_screen_names, filename='data/cluster/graph-nodesLabeled.pkl', min_value=2):
+def create_graph(users, friend_and_followers_counts, initial_screen_names, filename=GRAPH_FILE, min_value=2):
     """ 
     Create a networkx undirected Graph, adding each candidate, friend and follower
     as a node.  Note: while all candidates and  10 top most common ids should be added to the graph,
@@ -153,50 +194,22 @@ def create_graph(users, friend_and_followers_counts, initial_screen_names, filen
 
     Each candidate in the Graph will be represented by their screen_name. Each of the most_common
     ids will be represented by their user id, as well as each friend and follower will be represented by their user id.
+    The graph is built as a CSRGraph by build_graph and converted once to networkx.
 
     Args:
       users..........................The list of user dicts.
-      friend__and_followers_counts...The Counter dict mapping each friend and follower to the number of candidates that follow them.
+      friend__and_followers_counts...The IdCounts mapping each friend and follower to the number of candidates that follow them.
       initial_screen_names...........The list of the ethreum accounts we started the project with.
-      filename.......................Filename to store the tuple of the graph and the nodes with labels list.
+      filename.......................The graph snapshot to store the graph in, with the nodes with labels as the 'labeled' attribute (see snapshot.py).
       min_value......................The threshold for adding a user to the graph or not. If the number of people who follow or are friends for a user is less than this number, then do nt added to the graph.
     Returns:
       A networkx Graph
       A list of users that should have labels.
     """
-    # Create a graph
-    graph = nx.Graph()
-    # Set the names for the initial_screen_names and the most common ids.
-    nodes_with_labels = []
-    for u in users:
-        # Create nodes
-        if u['screen_name'] in initial_screen_names:
-            # Really important to convert the names as strings
-            name_in_graph = str(u['screen_name'])
-            nodes_with_labels.append(name_in_graph)
-            if name_in_graph not in graph:
-                graph.add_node(name_in_graph)
-        else:
-            name_in_graph = str(u['id'])
-            # Only add if count is greater than min_value
-            if friend_and_followers_counts.get(u['id'])>min_value:
-                nodes_with_labels.append(name_in_graph)
-                if name_in_graph not in graph:
-                    graph.add_node(name_in_graph)
-        # Create edges
-        friends = u['friends']
-        for f in friends:
-            if (friend_and_followers_counts.get(f)>min_value):
-                if not graph.has_edge(name_in_graph, str(f)):
-                    graph.add_edge(name_in_graph, str(f))
-        followers = u['followers']
-        for follower in followers:
-            if (friend_and_followers_counts.get(follower)>min_value):
-                if not graph.has_edge(name_in_graph, str(follower)):
-                    graph.add_edge(name_in_graph, str(follower))
-
-    values_persist = tuple([graph, nodes_with_labels])
-    pickle.dump(values_persist, open(filename, 'wb'))
+    csr_graph, nodes_with_labels = build_graph(users, friend_and_followers_counts, initial_screen_names, min_value)
+    graph = csr_graph.to_networkx()
+    labeled = set(nodes_with_labels)
+    write_snapshot(filename, csr_graph, {'labeled': [label in labeled for label in csr_graph.labels]})
     print("Graph file stored to %s" % filename)
     return graph, nodes_with_labels
 
@@ -290,7 +303,7 @@ def comm_detect_girvan_newman(graph, nodes_labeled, filename, k=3):
     Args:
       graph...............The networkx graph.
       nodes_labeled.......The list of nodes that should have a label in the drawing.
-      filename............The name of the file to store the clustering of nodes.
+      filename............The graph snapshot to store the clustering of nodes in, as a girvan_newman_<number of clusters> attribute per level.
       k...................The number of clusters we want to obtain.
     Returns:
       The result of the Girvan Newman clustering
@@ -317,7 +330,7 @@ def comm_detect_girvan_newman(graph, nodes_labeled, filename, k=3):
         #print(level_cluster)
         #result.append(level_cluster)
         result.append(level_dict)
-    pickle.dump(result, open(filename, 'wb'))
+    set_attributes(filename, dict(('girvan_newman_%d' % (max(level.values()) + 1), level) for level in result))
     return result
 
 
@@ -327,12 +340,12 @@ def comm_detect_community(graph, filename):
 
     Args:
       graph.................The networkx graph from where to find clusters.
-      filename..............The name of the file to store the partitioned graph image.
+      filename..............The graph snapshot to store the partition in, as the louvain attribute.
     Returns:
       A dict from nodes to cluster value.
     """
     partition = community.best_partition(graph, random_state=1234)
-    pickle.dump(partition, open(filename, 'wb'))
+    set_attributes(filename, {'louvain': partition})
     return partition
 
 
@@ -344,7 +357,7 @@ def comm_detect_greedy_modularity_community(graph, filename):
         for node in comm:
             node2comm_dict[str(node)] = comm_number
         comm_number += 1
-    pickle.dump(node2comm_dict, open(filename, 'wb'))
+    set_attributes(filename, {'greedy_modularity': node2comm_dict})
     return node2comm_dict
 
 
@@ -369,13 +382,8 @@ def print_comm_summary(node2cluster_dict, nodes_labeled, algorithm):
 
 
 def main(args):
-    twitter = get_twitter('twitter.cfg')
-    print('Established Twitter connection.')
-
-
     # 0 - Read users from file created by collect python script and initial screen_names.
-    #users = read_users('data/collect/users.pkl')
-    users = read_users_from_json('data/collect/users.json')
+    users = read_users('data/collect/users', ['id', 'screen_name', 'friends', 'followers'])
     print("Read %d user objects" % len(users)) # Check len of users, must be 17 users in the list
     initial_screen_names = read_screen_names('data/collect/ethereum-accounts.txt')
     print('\nRead screen names: %s' % initial_screen_names)
@@ -390,8 +398,7 @@ def main(args):
 
     # 2 - Create graph setting min_value of followers and friends for a node to be added to the graph. 
     min_value = 2
-    filename = 'data/cluster/graph-nodesLabeled.pkl'
-    graph, nodes_with_labels = create_graph(users, friend_and_followers_counts, initial_screen_names, filename=filename, min_value=min_value)
+    graph, nodes_with_labels = create_graph(users, friend_and_followers_counts, initial_screen_names, filename=GRAPH_FILE, min_value=min_value)
     print('\ngraph has %s nodes and %s edges with min_value = %d' % (len(graph.nodes()), len(graph.edges()), min_value))
 
 
@@ -409,8 +416,7 @@ def main(args):
         if args[1] == 'True':
             num_clusters = 3
             print('\nGirvan Newman Algorithm Clustering:')
-            filename = 'data/cluster/community-detection-girvan-newman-'+str(num_clusters)+'-clusters.pkl'
-            result_gn_list_dict = comm_detect_girvan_newman(graph, nodes_with_labels, filename, k=num_clusters)
+            result_gn_list_dict = comm_detect_girvan_newman(graph, nodes_with_labels, GRAPH_FILE, k=num_clusters)
             for i in range(len(result_gn_list_dict)):
                 filename = 'images/cluster/community_detection_girvan-newman-'+str(i+2)+'-clusters.png'
                 draw_network_communities(graph, result_gn_list_dict[i], initial_screen_names, nodes_with_labels, filename)
@@ -420,8 +426,7 @@ def main(args):
 
     # 4.2 - Community detection using Louvain Algorithm.
     print('\nLouvain Algorithm Clustering:')
-    filename = 'data/cluster/community-detection-louvian.pkl'
-    comm_community_dict = comm_detect_community(graph, filename)
+    comm_community_dict = comm_detect_community(graph, GRAPH_FILE)
     filename = 'images/cluster/community-detection-louvian.png'
     draw_network_communities(graph, comm_community_dict, initial_screen_names, nodes_with_labels, filename)
     print('Clustering of network using Louvain Algorithm drawn to %s' % filename)
@@ -429,12 +434,18 @@ def main(args):
 
     # 4.3 - Community detection using Greedy Modularity.
     print('\nGreedy Modularity Clustering:')
-    filename = 'data/cluster/community-detection-greedy-modularity.pkl'
-    comm_community_dict = comm_detect_greedy_modularity_community(graph, filename)
+    comm_community_dict = comm_detect_greedy_modularity_community(graph, GRAPH_FILE)
     filename = 'images/cluster/community-detection-greedy-modularity.png'
     draw_network_communities(graph, comm_community_dict, initial_screen_names, nodes_with_labels, filename)
     print('Clustering of network using Greedy Modularity Algorithm drawn to %s' % filename)
     print_comm_summary(comm_community_dict, nodes_with_labels, "Greedy Modularity")
 
+    # 5 - Keep the graph of this run in the history and compare it with the previous run.
+    recorded = record_snapshot(GRAPH_FILE)
+    snapshots = list_snapshots()
+    print('\nGraph snapshot recorded to %s' % recorded)
+    if len(snapshots) > 1:
+        print(diff_snapshots(snapshots[-2], recorded).summary())
+
 if __name__ == "__main__":
     main(sys.argv)
\ No newline at end of file
@@ -11,47 +11,63 @@ import networkx as nx
 import sys
 import time
 import json
-import configparser
-import pickle
-import requests
-from TwitterAPI import TwitterAPI
+import client
+from census import CENSUS_DIR, load_census_index
+from dedupe import Deduplicator
+from fetch import get_scheduler, lookup_users, rate_limited_request
+from frontier import CrawlFrontier
+from idlists import count_ids, followed_by
+from lazyjson import filter_stream
+from metrics import METRICS
+from paginate import fetch_ids, get_all_ids
+from sink import TweetSink, read_segments
+from userstore import read_user_store, write_user_store
+
+
+# Maximum number of pages of 5000 ids fetched per user for friends and followers
+# (None follows the cursor to the end), and where the pages are checkpointed.
+MAX_ID_PAGES = 20
+PAGES_DIR = 'data/collect/pages'
+# Directory of the on-disk response cache.
+CACHE_DIR = 'data/cache'
+# Directory of the real time tweet segments.
+TWEETS_DIR = 'data/collect/real-time-tweets'
+FRONTIER_FILE = 'data/collect/frontier.db'
+# Directory of the columnar user store (see userstore.py).
+USERS_DIR = 'data/collect/users'
+# Where the request metrics of a run are written (see metrics.py).
+METRICS_FILE = 'data/collect/metrics'
+# Hops from the seed accounts to crawl, and how many accounts to crawl past the seeds.
+MAX_DEPTH = 1
+MAX_NEW_USERS = 10
 
 
 # Fetch male/female names from Census.
 
 def get_census_names():
-    """ Fetch a list of common male/female names from the census.
+    """ Load the index of male/female names from the census (see census.py).
+    The census tables are downloaded and compiled only the first time.
     For ambiguous names, we select the more frequent gender."""
-    males = requests.get('http://www2.census.gov/topics/genealogy/1990surnames/dist.male.first').text.split('\n')
-    females = requests.get('http://www2.census.gov/topics/genealogy/1990surnames/dist.female.first').text.split('\n')
-    males_pct = dict([(m.split()[0].lower(), float(m.split()[1])) for m in males if m])
-    females_pct = dict([(f.split()[0].lower(), float(f.split()[1])) for f in females if f])
-    male_names = set([m for m in males_pct if m not in females_pct or males_pct[m] > females_pct[m]])
-    female_names = set([f for f in females_pct if f not in males_pct or females_pct[f] > males_pct[f]])
-    filename = "data/collect/male_names.pkl"
-    pickle.dump(male_names, open(filename,'wb'))
-    print("Census male names file saved to %s" % filename)
-    filename = "data/collect/female_names.pkl"
-    pickle.dump(female_names, open(filename,'wb'))   
-    print("Census female names file saved to %s" % filename)
-    return male_names, female_names
-
-
-def get_twitter(config_file):
-    """ Read the config_file and construct an instance of TwitterAPI.
+    census = load_census_index()
+    print("Census name index loaded from %s" % CENSUS_DIR)
+    return census
+
+
+def get_twitter(config_file, cache_dir=CACHE_DIR, offline=False, sections=None):
+    """ Return the RequestScheduler shared by the whole process (see client.py): one
+    pooled TwitterAPI connection per credential set, in front of an on-disk response cache.
+
+    Every section whose name starts with "twitter" (e.g. [twitter], [twitter2])
+    is a credential set; requests rotate across them when one is exhausted.
     Args:
       config_file ... A config file in ConfigParser format with Twitter credentials
+      cache_dir ..... Directory of the response cache (see cache.py), or None for no cache.
+      offline ....... If True, serve every request from the cache and never touch the network.
+      sections ...... The names of the credential sets to use, or None for all of them.
     Returns:
-      An instance of TwitterAPI.
+      A RequestScheduler, used in place of a TwitterAPI instance.
     """
-    config = configparser.ConfigParser()
-    config.read(config_file)
-    twitter = TwitterAPI(
-                   config.get('twitter', 'consumer_key'),
-                   config.get('twitter', 'consumer_secret'),
-                   config.get('twitter', 'access_token'),
-                   config.get('twitter', 'access_token_secret'))
-    return twitter
+    return client.get_twitter(config_file, cache_dir, offline, sections)
 
 
 def read_screen_names(filename):
@@ -71,10 +87,13 @@ def read_screen_names(filename):
 
 
 def robust_request(twitter, resource, params, max_tries=5):
-    """ If a Twitter request fails, sleep for 15 minutes.
+    """ Make a Twitter request within the endpoint's rate window.
+    The rate limit headers of each response tell how many calls are left and when
+    the window resets; when a credential set is exhausted the next one is used,
+    and only when all are exhausted do we sleep, until the earliest reset.
     Do this at most max_tries times before quitting.
     Args:
-      twitter .... A TwitterAPI object.
+      twitter .... A TwitterAPI object or a RequestScheduler.
       resource ... A resource string to request
       params ..... A parameter dict for the request, e.g., to specify
                    parameters like screen_name or count.
@@ -82,14 +101,7 @@ def robust_request(twitter, resource, params, max_tries=5):
     Returns:
       A TwitterResponse object, or None if failed.
     """
-    for i in range(max_tries):
-        request = twitter.request(resource, params)
-        if request.status_code == 200 or request.status_code == 404:
-            return request
-        else:
-            print('Got error %s \n with status code %s\nsleeping for 15 minutes.' % (request.text, request.status_code))
-            sys.stderr.flush()
-            time.sleep(61 * 15)
+    return rate_limited_request(twitter, resource, params, max_tries)
 
 
 def get_first_name(tweet):
@@ -107,11 +119,47 @@ def get_first_name(tweet):
             return parts[0].lower()
 
 
-def get_realtime_tweets(twitter, limit, words, male_names, female_names, filename):
+def stream_tweets(twitter, words, accept):
+    """ Yield the tweets of the filter stream that match any of the words, are written in
+    english and located in the U.S., reconnecting with an exponential backoff whenever the
+    stream drops. Only the errors of the stream are handled here: an error raised by the
+    caller while handling a tweet ends the iteration.
+    Params:
+        twitter....The TwitterAPI object.
+        words......A list of strings, defining all the words that a tweet can match.
+        accept.....A function of a name: only tweets whose raw bytes show a name it accepts
+                   are decoded (see lazyjson.py).
+    """
+    backoff = 5
+    while True:
+        try:
+            # Restrict to U.S.
+            response = twitter.request('statuses/filter',
+                        {'track': words, 'locations':'-124.637,24.548,-66.993,48.9974', 'language': 'en'})
+            if response.status_code != 200:
+                raise IOError('stream answered %s: %s' % (response.status_code, response.text))
+            for tweet in filter_stream(response, accept):
+                backoff = 5
+                yield tweet
+        except Exception as e:
+            # The stream dropped: reconnect with an exponential backoff.
+            print("Stream error, reconnecting in %d seconds: %s" % (backoff, e))
+            METRICS.inc('retries_total', resource='statuses/filter')
+            METRICS.inc('sleep_seconds_total', backoff, resource='statuses/filter', reason='backoff')
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 320)
+
+
+def get_realtime_tweets(twitter, limit, words, male_names, female_names, directory):
     """Retrieve real time tweets objects that match any of the words provided, are written in english and located 
     in the U.S.
     
     Store only those tweets that include a user name that matches either a male or female name from the census.
+    Tweets are appended to compressed segments in directory as they arrive (see sink.py), so memory
+    stays flat and a partial collection survives a crash. Tweets already in directory count towards
+    the limit, so an interrupted collection resumes where it stopped.
+    Retweets are collapsed to the tweet they retweet, and tweets already stored (same id or same
+    normalized text) are dropped (see dedupe.py).
     
     Params:
         twitter........The TwitterAPI object.
@@ -119,95 +167,119 @@ def get_realtime_tweets(twitter, limit, words, male_names, female_names, filenam
         words..........A list of strings, defining all the words that a tweet can match.
         male_names.....List of all male names retrieved from the census.
         female_names...List of all female names retrieved from the census.
-        filename.......Name of the file for storing the real time tweets picked.
+        directory......Name of the directory for storing the real time tweets picked.
     Returns:
-        A list of dicts, one per tweet, containing all the tweet information
+        The number of tweets stored in directory.
+
+    >>> import tempfile
+    >>> class Stream(list):
+    ...     status_code = 200
+
+    A retweet counts by the author of the tweet it retweets:
+
+    >>> bob = {'id': 1, 'text': 'eth up', 'user': {'name': 'Bob'}}
+    >>> class Twitter(object):
+    ...     def request(self, resource, params):
+    ...         return Stream([{'id': 2, 'text': 'RT @bob: eth up', 'user': {'name': 'Ann'}, 'retweeted_status': bob},
+    ...                        {'id': 3, 'text': 'eth down', 'user': {'name': 'Ann'}}])
+    >>> get_realtime_tweets(Twitter(), 1, ['eth'], {'ann'}, set(), tempfile.mkdtemp())  # doctest: +ELLIPSIS
+    Real time tweets saved to ... (kept 1 tweets, dropped 0 with a seen id and 0 with a seen text, collapsed 0 retweets)
+    1
+
+    Stream errors are retried; an error of the sink ends the collection:
+
+    >>> class Twitter(object):
+    ...     def request(self, resource, params):
+    ...         tweets = [{'id': i, 'text': 'eth %d' % i, 'user': {'name': 'Ann'}} for i in range(100000)]
+    ...         tweets[0]['unstorable'] = object()
+    ...         return Stream(tweets)
+    >>> get_realtime_tweets(Twitter(), 100000, ['eth'], {'ann'}, set(), tempfile.mkdtemp())
+    Traceback (most recent call last):
+    ...
+    TypeError: Object of type object is not JSON serializable
     """
-    tweets = []
-    while True:
-        try:
-            # Restrict to U.S.
-            for response in twitter.request('statuses/filter',
-                        {'track': words, 'locations':'-124.637,24.548,-66.993,48.9974', 'language': 'en'}):
-                # Check if Twitter object contains user description.
-                if 'user' in response:
-                    # Obtain First name from user description dict.
-                    name = get_first_name(response)
-                    #Append tweet only if name is in any of male or female names
-                    if name in male_names or name in female_names:
-                        tweets.append(response)
-                        if len(tweets) % 100 == 0:
-                            print('found %d tweets' % len(tweets))
-                        if len(tweets) >= limit:
-                            return tweets
-        except:
-            print("Unexpected error:", sys.exc_info()[0])
-    pickle.dump(tweets, open(filename, 'wb'))
-    print("Real time tweets saved to %s" % filename)
-    return tweets
+    is_census_name = lambda name: name in male_names or name in female_names
+    dedupe = Deduplicator()
+    found = 0
+    for t in read_segments(directory):
+        dedupe.add(t)
+        found += 1
+    # A failure of the sink (e.g. a full disk) is raised out of the loop, not retried.
+    with TweetSink(directory) as sink:
+        if found < limit:
+            for tweet in stream_tweets(twitter, words, is_census_name):
+                # Obtain First name from user description dict, of the tweet that would be kept.
+                name = get_first_name(dedupe.original(tweet))
+                #Append tweet only if name is in any of male or female names
+                if not is_census_name(name):
+                    continue
+                # Checked last, so only the tweets stored are counted as kept.
+                tweet = dedupe.check(tweet)
+                if tweet is None:
+                    continue
+                sink.put(tweet)
+                found += 1
+                if found % 100 == 0:
+                    print('found %d tweets' % found)
+                if found >= limit:
+                    break
+    print("Real time tweets saved to %s (%s)" % (directory, dedupe.report()))
+    return found
 
 
 def get_users_by_screen_name(twitter, screen_names):
     """Retrieve the Twitter user objects for each screen_name.
+    Screen names are looked up in concurrent batches of 100 (see fetch.py).
     Params:
         twitter........The TwitterAPI object.
         screen_names...A list of strings, one per screen_name
     Returns:
         A list of dicts, one per user, containing all the user information
-        (e.g., screen_name, id, location, etc)
+        (e.g., screen_name, id, location, etc), in the order of screen_names.
     """
-    results = []
-    for s in screen_names:
-        results.extend(robust_request(twitter, "users/lookup", {'screen_name': s}))
-    return results
+    return lookup_users(twitter, screen_names=screen_names)
 
 
-def get_friends(twitter, screen_name):
-    """ Return a list of Twitter IDs for users that this person follows, up to 5000.
+def get_friends(twitter, screen_name, max_pages=MAX_ID_PAGES, checkpoint_dir=PAGES_DIR):
+    """ Return a list of Twitter IDs for users that this person follows.
     See https://dev.twitter.com/rest/reference/get/friends/ids
 
     Args:
-        twitter.......The TwitterAPI object
-        screen_name... a string of a Twitter screen name
+        twitter..........The TwitterAPI object
+        screen_name......a string of a Twitter screen name
+        max_pages........The maximum number of pages of 5000 ids to follow, or None for all of them.
+        checkpoint_dir...Directory where the pages are checkpointed (see paginate.py).
     Returns:
-        A list of ints, one per friend ID, sorted in ascending order.
-
-    Note: If a user follows more than 5000 accounts, we will limit ourselves to
-    the first 5000 accounts returned.
+        A list of ints, one per friend ID, sorted in ascending order. Empty if
+        the user was not found.
     """
-    #print("Inside: Requesting friends for screen_name %s" % screen_name)
-    request = robust_request(twitter, "friends/ids", 
-                              {'screen_name': screen_name, 'count':5000})
-    if (request.status_code != 404):
-        return sorted(request.json()['ids'])
-    else:
-        return str(request.status_code)
-
-      
-def add_all_friends(twitter, users):
+    return get_all_ids(twitter, "friends/ids", screen_name, max_pages, checkpoint_dir)
+
+
+def add_all_friends(twitter, users, max_workers=4, max_pages=MAX_ID_PAGES, checkpoint_dir=PAGES_DIR):
     """ Get the list of accounts each user follows.
 
     Store the result in each user's dict using a new key called 'friends'.
+    Users whose friends could not be fetched get no 'friends' key.
+    Several users are paginated at once (see paginate.py).
 
     Args:
-        twitter...The TwitterAPI object.
-        users.....The list of user dicts.
+        twitter..........The TwitterAPI object.
+        users............The list of user dicts.
+        max_workers......The maximum number of concurrent requests.
+        max_pages........The maximum number of pages of 5000 ids per user, or None for all of them.
+        checkpoint_dir...Directory where the pages are checkpointed.
     Returns:
         Nothing
     """
-    #print("Requesting friends for a total of %s users" % len(users))
+    # Make the requests only for users that are not protected, else store friends as an empty list
+    screen_names = [u['screen_name'] for u in users if u['protected'] != True]
+    friends = fetch_ids(twitter, 'friends/ids', screen_names, max_workers, max_pages, checkpoint_dir)
     for u in users:
-        #print("Outside: Requesting friends for screen_name %s" % u['screen_name'])
-        # Make the requst only if the user is not protected, else store friends as an empty list
-        if u['protected'] != True:
-            response = get_friends(twitter, u['screen_name'])
-            if response == "404":
-                u['friends'] = []
-            else:
-                u['friends'] = response
-        else:
-            #
-            u['friends'] = []
+        ids = friends.get(u['screen_name'], [])
+        # None: the list could not be fetched; leave it out so the user can be tried again.
+        if ids is not None:
+            u['friends'] = ids
 
 
 def print_num_friends(users):
@@ -227,56 +299,68 @@ def count_friends(users):
     Args:
         users: a list of user dicts
     Returns:
-        a Counter object mapping each friend to the number of candidates who follow them.
+        a Counter like IdCounts mapping each friend to the number of candidates who follow them
+        (see idlists.py).
     """
-    result = Counter()
-    for u in users:
-        result.update(u['friends'])
-    return result
+    return count_ids(u['friends'] for u in users)
 
 
-def get_followers(twitter, screen_name):
-    """ Return a list of Twitter IDs for users that follow this person, up to 2000.
-
+def common_follows(twitter, users, screen_names=None, min_count=None, key='friends'):
+    """ Find the accounts followed by at least min_count of some users, from the
+    friends already collected, and look them up.
     Args:
-        twitter.......The TwitterAPI object
-        screen_name... a string of a Twitter screen name
+        twitter........The TwitterAPI object.
+        users..........The list of user dicts, with their friends (or followers).
+        screen_names...The screen names of the users to consider, or None for all of them.
+        min_count......The number of these users that must follow an account, or None for all of them.
+        key............'friends' for the accounts they follow, 'followers' for the accounts following them.
     Returns:
-        A list of ints, one per friend ID, sorted in ascending order.
+        A list of user dicts, sorted by screen_name. The ids are looked up in cached
+        batches of 100 (see fetch.lookup_users).
+    """
+    selected = [u for u in users if screen_names is None or u['screen_name'] in screen_names]
+    ids = followed_by([u[key] for u in selected], min_count)
+    return get_users_by_ids(twitter, ids.tolist())
+
 
-    Note: If a user has more than 5000 followers, we will limit ourselves to
-    the first 5000 accounts returned.
+def get_followers(twitter, screen_name, max_pages=MAX_ID_PAGES, checkpoint_dir=PAGES_DIR):
+    """ Return a list of Twitter IDs for users that follow this person.
+
+    Args:
+        twitter..........The TwitterAPI object
+        screen_name......a string of a Twitter screen name
+        max_pages........The maximum number of pages of 5000 ids to follow, or None for all of them.
+        checkpoint_dir...Directory where the pages are checkpointed (see paginate.py).
+    Returns:
+        A list of ints, one per follower ID, sorted in ascending order. Empty if
+        the user was not found.
     """
-    #print("Inside: Requesting followers for screen_name %s" % screen_name)
-    request = robust_request(twitter, "followers/ids", 
-                              {'screen_name': screen_name, 'count':5000})
-    if (request.status_code != 404):
-        return sorted(request.json()['ids'])
-    else:
-        return str(request.status_code)
-    
+    return get_all_ids(twitter, "followers/ids", screen_name, max_pages, checkpoint_dir)
+
 
-def add_all_followers(twitter, users):
+def add_all_followers(twitter, users, max_workers=4, max_pages=MAX_ID_PAGES, checkpoint_dir=PAGES_DIR):
     """ Get all the followers a user has.
 
     Store the result in each user's dict using a new key called 'followers'.
+    Users whose followers could not be fetched get no 'followers' key.
+    Several users are paginated at once (see paginate.py).
 
     Args:
-        twitter...The TwitterAPI object.
-        users.....The list of user dicts.
+        twitter..........The TwitterAPI object.
+        users............The list of user dicts.
+        max_workers......The maximum number of concurrent requests.
+        max_pages........The maximum number of pages of 5000 ids per user, or None for all of them.
+        checkpoint_dir...Directory where the pages are checkpointed.
     Returns:
         Nothing
     """
+    screen_names = [u['screen_name'] for u in users if u['protected'] != True]
+    followers = fetch_ids(twitter, 'followers/ids', screen_names, max_workers, max_pages, checkpoint_dir)
     for u in users:
-        #print("Outside: Requesting followers for screen_name %s" % u['screen_name'])
-        if u['protected'] != True:
-            response = get_followers(twitter, u['screen_name'])
-            if response == "404":
-                u['followers'] = []
-            else:
-                u['followers'] = response
-        else:
-            u['followers'] = []
+        ids = followers.get(u['screen_name'], [])
+        # None: the list could not be fetched; leave it out so the user can be tried again.
+        if ids is not None:
+            u['followers'] = ids
 
 
 def print_num_followers(users):
@@ -289,49 +373,155 @@ def print_num_followers(users):
     print('\n'.join('%s %d' % (u['screen_name'], len(u['followers'])) for u in users))
 
 
-def count_friends_and_followers(users):
+def count_friends_and_followers(users, capacity=None):
     """ Count how often each user is followed or follows the defined users.
     Args:
         users: a list of user dicts
+        capacity: None to count exactly, or the number of ids kept by a bounded
+                  memory heavy hitters count, for crawls too large to count exactly
     Returns:
-        a Counter object mapping each friend to the number of candidates who follow them.
+        a Counter like IdCounts mapping each friend to the number of candidates who follow them
+        (see idlists.py).
     """
-    result = Counter()
-    for u in users:
-        result.update(u['friends'])
-        result.update(u['followers'])
-    return result
+    id_lists = (ids for u in users for ids in (u['friends'], u['followers']))
+    return count_ids(id_lists, capacity)
 
 
 def get_users_by_ids(twitter, ids):
     """Retrieve the Twitter user objects for each id.
+    Ids are looked up in concurrent batches of 100 (see fetch.py).
     Params:
         twitter........The TwitterAPI object.
         ids............A list of strings, one per id
     Returns:
         A list of dicts, one per user, containing all the user information
-        (e.g., screen_name, id, location, etc)
+        (e.g., screen_name, id, location, etc), sorted by screen_name.
     """
-    results = robust_request(twitter, "users/lookup", {'user_id': ids})
-    return sorted(results.json(), key=lambda x: x['screen_name'])
+    return sorted(lookup_users(twitter, ids=ids), key=lambda x: x['screen_name'])
 
 
-def store_users(users, filename):
-    pickle.dump(users, open(filename, 'wb'))
-    print("Users file saved to %s" % filename)
+def expand_network(twitter, frontier, max_users, batch_size=100):
+    """ Crawl the accounts of a frontier, the best connected first, until max_users
+    accounts have been crawled or the frontier is empty.
+    Each batch is looked up, its friends and followers are fetched, and it is
+    recorded in the frontier before the next batch is popped, so an interrupted
+    crawl resumes from the last batch. Accounts whose friends or followers could
+    not be fetched are left queued, for the next run to try again.
+    Args:
+        twitter......The TwitterAPI object.
+        frontier.....A CrawlFrontier with its seeds added.
+        max_users....The total number of accounts to crawl, seeds included.
+        batch_size...The number of accounts crawled at once.
+    Returns:
+        The number of accounts crawled.
+    """
+    crawled = frontier.counts().get('fetched', 0)
+    failed = set()
+    while crawled < max_users:
+        n = min(batch_size, max_users - crawled)
+        ids = [i for i in frontier.pop(n + len(failed)) if i not in failed][:n]
+        if not ids:
+            break
+        users = get_users_by_ids(twitter, ids)
+        add_all_friends(twitter, users)
+        add_all_followers(twitter, users)
+        complete = [u for u in users if 'friends' in u and 'followers' in u]
+        for u in complete:
+            frontier.record(u)
+        failed.update(u['id'] for u in users if 'friends' not in u or 'followers' not in u)
+        frontier.discard(set(ids) - set(u['id'] for u in users))
+        crawled += len(complete)
+        print('crawled %d users, %d queued' % (crawled, frontier.counts().get('queued', 0)))
+    if failed:
+        print('%d users could not be crawled and stay queued' % len(failed))
+    return crawled
+
+
+def refresh_network(twitter, frontier, max_workers=4, max_pages=MAX_ID_PAGES, checkpoint_dir=PAGES_DIR):
+    """ Recrawl the users of a frontier, refetching only the lists that changed.
+    All users are looked up again in batches of 100, which is cheap, and their
+    friends (followers) are fetched only if their friends_count (followers_count)
+    is not the one stored; the other lists are kept. The ids added and removed
+    are stored in the frontier as diffs (see CrawlFrontier.update). A list that
+    could not be fetched keeps its stored version and count, so the next refresh
+    tries it again. The requests skip the response cache, whose answers may be
+    older than the stored users.
+    Args:
+        twitter..........The TwitterAPI object.
+        frontier.........A CrawlFrontier with crawled users.
+        max_workers......The maximum number of concurrent requests.
+        max_pages........The maximum number of pages of 5000 ids per user, or None for all of them.
+        checkpoint_dir...Directory where the pages are checkpointed.
+    Returns:
+        A dict from user id to the diffs of the users whose lists changed.
+
+    >>> import tempfile
+    >>> from cache import ResponseCache
+    >>> from fetch import RequestScheduler
+    >>> from mockapi import LocalTwitterAPI, MockData, MockTwitterServer
+    >>> data = MockData([{'id': 1, 'screen_name': 'alice', 'protected': False, 'friends': [2, 3], 'followers': [3]}])
+    >>> frontier = CrawlFrontier(':memory:')
+    >>> with MockTwitterServer(data) as server:
+    ...     twitter = RequestScheduler([LocalTwitterAPI(server.url)], ResponseCache(tempfile.mkdtemp()))
+    ...     users = get_users_by_ids(twitter, [1])
+    ...     add_all_friends(twitter, users, checkpoint_dir=None)
+    ...     add_all_followers(twitter, users, checkpoint_dir=None)
+    ...     frontier.record(users[0])
+    ...     data.friends[1].append(4)
+    ...     data.users[1]['friends_count'] = 3
+    ...     refresh_network(twitter, frontier, checkpoint_dir=None)
+    1 of 1 users have new friends
+    0 of 1 users have new followers
+    {1: {'friends': ([4], [])}}
+    >>> [(c['kind'], c['added'], c['removed']) for c in frontier.changes(1)]
+    [('friends', [4], [])]
+    """
+    twitter = get_scheduler(twitter).refreshing()
+    stored = dict((u['id'], u) for u in frontier.users())
+    fresh = get_users_by_ids(twitter, list(stored))
+    for kind, count_key, add_all in (('friends', 'friends_count', add_all_friends),
+                                     ('followers', 'followers_count', add_all_followers)):
+        changed = [u for u in fresh if u[count_key] != stored[u['id']].get(count_key)]
+        print('%d of %d users have new %s' % (len(changed), len(fresh), kind))
+        add_all(twitter, changed, max_workers, max_pages, checkpoint_dir)
+        for u in fresh:
+            if kind not in u:
+                u[kind] = stored[u['id']].get(kind, [])
+                u[count_key] = stored[u['id']].get(count_key)
+    diffs = {}
+    for u in fresh:
+        diff = frontier.update(u)
+        if diff:
+            diffs[u['id']] = diff
+    return diffs
+
+
+def store_users(users, directory):
+    """ Store the users in a columnar user store (see userstore.py). """
+    write_user_store(users, directory)
+    print("Users stored to %s" % directory)
     
 
-def read_users(filename):
-    pickle.load(open(filename, 'rb'))
+def read_users(directory, fields=None):
+    """ Read the users of a user store, with only the given fields (all of them by default). """
+    return read_user_store(directory, fields)
 
 
-def main():
+def main(args):
+    # Run with --offline to replay the whole collection from the response cache, without network.
+    offline = '--offline' in args
+    # Run with --metrics-port=N to serve the metrics to Prometheus while collecting.
+    for arg in args:
+        if arg.startswith('--metrics-port='):
+            METRICS.serve(int(arg.split('=')[1]))
+
     # 0 - Create twitter connection and pick census names
-    male_names, female_names = get_census_names()
+    census = get_census_names()
+    male_names, female_names = census.male_names(), census.female_names()
     print('found %d female and %d male names' % (len(female_names), len(male_names)))
     print('male name sample:', list(male_names)[:5])
     print('female name sample:', list(female_names)[:5])
-    twitter = get_twitter('twitter.cfg')
+    twitter = get_twitter('twitter.cfg', offline=offline)
     print('Established Twitter connection.')
 
     # 1 - Retrieve real time tweets that match Blockchain related words
@@ -339,12 +529,14 @@ def main():
     words = ['ethereum', 'eth', 'bitcoin', 'btc', 'blockchain', 'cryptocurrencies', 'cryptocurrency', 'crypto', 'token', 'tokens',
             'solidity', 'litecoin', 'hyperledger','eos','dapp', 'dapps', 'smart contract', 'smart contracts', 'neo', 'miner', 'mining',
             'sidechain','pos','pow', 'dlt', 'polkadot']
-    filename = 'data/collect/real-time-tweets.pkl'
-    print("Pick tweets related to Blockchain words %s" % words)
-    tweets = get_realtime_tweets(twitter, 5000, words, male_names, female_names, filename)
+    # The stream cannot be replayed offline, the tweets kept by the last run are used.
+    if not offline:
+        print("Pick tweets related to Blockchain words %s" % words)
+        get_realtime_tweets(twitter, 5000, words, male_names, female_names, TWEETS_DIR)
     print("NUMBER OF TWEETS SAMPLED:")
-    print('sampled %d tweets' % len(tweets))
-    print('top names:', Counter(get_first_name(t) for t in tweets).most_common(10))
+    names = Counter(get_first_name(t) for t in read_segments(TWEETS_DIR))
+    print('sampled %d tweets' % sum(names.values()))
+    print('top names:', names.most_common(10))
     
     # 2 - Read the screen names we want to build the network from.
     screen_names = read_screen_names('data/collect/ethereum-accounts.txt')
@@ -355,42 +547,35 @@ def main():
     print('found %d users with screen_names %s' %
           (len(users), str([u['screen_name'] for u in users])))
         
-    # 4 - Get the user's each of this user follows (their "friends")
-    # Obtain all friends
-    add_all_friends(twitter, users)
-    print('Friends per candidate:')
-    print_num_friends(users)
-    friend_counts = count_friends(users)
-    print('Most common friends:\n%s' % str(friend_counts.most_common(5)))
-    
-    # Who follows this person?
-    # Pick the first 5.000 people that follow this person.
-    # 5 - Get the user's that follow this user(their "followers")
-    # Obtain all followers for each user
-    add_all_followers(twitter, users)
-    print('Followers per candidate:')
-    print_num_followers(users)
-    friend_and_followers_counts = count_friends_and_followers(users)
-    # Pick the 10 most common followers and users
-    most_common = friend_and_followers_counts.most_common(10)
-    print('Most common friends and followers:\n%s' % str(friend_and_followers_counts.most_common(10)))
-    # Store in a list all the id's of the 10 most common users
-    most_common_ids = [user_tuple[0] for user_tuple in most_common]
-    
-    # 6 - For each of the most common 100 users, obtain the user object and append it to the list of users' dict.
-    new_users = get_users_by_ids(twitter, most_common_ids)
-    print('found %d users with screen_names \n%s' %
-        (len(new_users), str([u['screen_name'] for u in new_users])))
-    
-    # 7 - Find the friends and followers for each of the 100 most common followed users.
-    add_all_friends(twitter, new_users)
-    add_all_followers(twitter, new_users)
-    
-    # 8 - Add new_users to the initial users list and store it in the file users.json
-    users_total = users + new_users
+    # 4 - Crawl the seed users, then the accounts most connected to the users already
+    # crawled (as friends or followers), up to MAX_DEPTH hops away. The frontier is
+    # kept in FRONTIER_FILE, so a new run resumes the crawl without refetching anyone.
+    frontier = CrawlFrontier(FRONTIER_FILE, MAX_DEPTH)
+    frontier.add_seeds(u['id'] for u in users)
+    # Run with --refresh to first update the users crawled by a previous run.
+    if '--refresh' in args:
+        diffs = refresh_network(twitter, frontier)
+        print('%d users changed since the last crawl' % len(diffs))
+    expand_network(twitter, frontier, len(users) + MAX_NEW_USERS)
+    users_total = sorted(frontier.users(), key=lambda x: x['screen_name'])
+    print('Friends and followers per user:')
+    print_num_friends(users_total)
+    print_num_followers(users_total)
+    print('Most common friends and followers:\n%s' % str(count_friends_and_followers(users_total).most_common(10)))
+    common = common_follows(twitter, users_total, [u['screen_name'] for u in users], max(2, len(users) // 2))
+    print('Accounts followed by at least half the seed accounts: %s' % [u['screen_name'] for u in common])
+    frontier.close()
+
+    # 5 - Store all the users crawled in the user store
     print("total user objects obtained with friends and followers %d" % len(users_total)) # Obtain total number of users to store
-    store_users(users_total, 'data/collect/users.pkl')
+    store_users(users_total, USERS_DIR)
+
+    # 6 - Where did the time go?
+    print(METRICS.summary())
+    METRICS.write(METRICS_FILE + '.json')
+    METRICS.write(METRICS_FILE + '.prom')
+    print("Request metrics saved to %s.json and %s.prom" % (METRICS_FILE, METRICS_FILE))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(sys.argv)
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""
+Compact graphs.
+
+An undirected graph is held as CSR (compressed sparse row) adjacency arrays
+over integer node indices: the neighbors of node i are the sorted
+indices[indptr[i]:indptr[i + 1]], and labels[i] is the name of node i. The
+arrays take 4 bytes per edge end, against a few hundred bytes per edge for the
+dicts of a networkx Graph, and are built from edge arrays in a few vectorized
+operations. to_networkx returns the networkx graph on demand, for drawing and
+community detection.
+
+The methods share their names, arguments and results with those of the
+CSRGraph of a1/csrgraph.py: from_arrays and the methods ending in _ids work on
+node indices.
+"""
+import numpy as np
+
+
+class CSRGraph(object):
+    """
+    An undirected graph in CSR form.
+
+    Params:
+        indptr.....int64 array of n + 1 offsets into indices.
+        indices....int32 array of the sorted neighbors of each node.
+        labels.....The list of the n node names.
+
+    >>> graph = CSRGraph.from_arrays(['a', 'b', 'c'], [0, 0, 1], [1, 2, 0])
+    >>> graph.number_of_nodes(), graph.number_of_edges(), graph.neighbor_ids(0).tolist()
+    (3, 2, [1, 2])
+    >>> sorted(graph.to_networkx().edges())
+    [('a', 'b'), ('a', 'c')]
+    """
+
+    def __init__(self, indptr, indices, labels):
+        self.indptr = indptr
+        self.indices = indices
+        self.labels = labels
+
+    @classmethod
+    def from_arrays(cls, labels, sources, targets):
+        """ Build a graph from the node labels and two arrays of node indices, one
+        edge per pair. Repeated edges, in either direction, are kept once.
+        """
+        n = len(labels)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        # Both directions of each edge, as unique row * n + column keys, which sorts them by row.
+        keys = np.sort(np.concatenate([sources * n + targets, targets * n + sources]))
+        keys = keys[np.diff(keys, prepend=-1) != 0]
+        rows = keys // n
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(rows, minlength=n))
+        return cls(indptr, (keys % n).astype(np.int32), list(labels))
+
+    @classmethod
+    def from_networkx(cls, graph):
+        """ Build a graph from a networkx Graph, keeping the order of its nodes. """
+        labels = list(graph.nodes())
+        index = dict((label, i) for i, label in enumerate(labels))
+        edges = np.array([(index[u], index[v]) for u, v in graph.edges()], dtype=np.int64).reshape(-1, 2)
+        return cls.from_arrays(labels, edges[:, 0], edges[:, 1])
+
+    def number_of_nodes(self):
+        return len(self.labels)
+
+    def number_of_edges(self):
+        rows, cols = self.edge_ids()
+        return len(rows)
+
+    def neighbor_ids(self, i):
+        """ Return the array of the neighbors of node i. """
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def degrees(self):
+        """ Return the array of the degree of every node (a self loop counts once). """
+        return np.diff(self.indptr)
+
+    def edge_ids(self):
+        """ Return two arrays with the ends u <= v of every edge, sorted. """
+        rows = np.repeat(np.arange(len(self.labels), dtype=np.int32), self.degrees())
+        keep = rows <= self.indices
+        return rows[keep], self.indices[keep]
+
+    def to_networkx(self):
+        """ Return the graph as a networkx Graph, with the nodes in index order. """
+        import networkx as nx
+        graph = nx.Graph()
+        graph.add_nodes_from(self.labels)
+        labels = self.labels
+        rows, cols = self.edge_ids()
+        graph.add_edges_from((labels[u], labels[v]) for u, v in zip(rows.tolist(), cols.tolist()))
+        return graph
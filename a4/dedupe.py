@@ -0,0 +1,139 @@
+"""
+Tweet deduplication.
+
+The stream delivers the same status more than once (reconnections, retweets of
+a tweet already kept, copies of the same text). Each tweet is checked against
+the ids and the normalized text hashes of the last tweets kept, held in bounded
+rolling sets, so memory stays flat on an endless stream. Retweets can be
+collapsed to the tweet they retweet.
+"""
+from collections import Counter, OrderedDict
+import hashlib
+import re
+
+from metrics import METRICS
+
+_RETWEET_PREFIX = re.compile(r'^rt @\w+:\s*')
+_URL = re.compile(r'https?://\S+')
+_MENTION = re.compile(r'@\w+')
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize_text(text):
+    """ Lower case a tweet text and drop what changes between copies of it:
+    the retweet prefix, links, mentions, punctuation and extra spaces.
+
+    >>> normalize_text('RT @bob: Buy #ETH now!! https://t.co/abc @alice')
+    'buy eth now'
+    """
+    text = _RETWEET_PREFIX.sub('', text.lower())
+    text = _MENTION.sub(' ', _URL.sub(' ', text))
+    return ' '.join(_NON_WORD.sub(' ', text).split())
+
+
+def text_hash(text):
+    """ Return a 64 bit hash of the normalized text. """
+    return int.from_bytes(hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class RollingSet(object):
+    """
+    A set that keeps only its last `capacity` items.
+
+    >>> s = RollingSet(2)
+    >>> s.add(1); s.add(2); s.add(3)
+    >>> 1 in s, 3 in s, len(s)
+    (False, True, 2)
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = OrderedDict()
+
+    def add(self, item):
+        self.items[item] = None
+        self.items.move_to_end(item)
+        if len(self.items) > self.capacity:
+            self.items.popitem(last=False)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+
+class Deduplicator(object):
+    """
+    Drop tweets already seen, by id and by normalized text.
+
+    Params:
+        capacity............How many ids and text hashes to remember.
+        by_text.............Also drop tweets whose normalized text was seen.
+        collapse_retweets...Replace each retweet by the tweet it retweets.
+
+    >>> dedupe = Deduplicator()
+    >>> original = {'id': 1, 'text': 'Ethereum is up', 'user': {'name': 'Ann'}}
+    >>> retweet = {'id': 2, 'text': 'RT @ann: Ethereum is up', 'user': {'name': 'Bob'}, 'retweeted_status': original}
+    >>> dedupe.check(retweet)['id'], dedupe.check(original), dedupe.check({'id': 3, 'text': 'ethereum IS up!'})
+    (1, None, None)
+    >>> sorted(dedupe.counts.items())
+    [('duplicate_id', 1), ('duplicate_text', 1), ('kept', 1), ('retweet', 1)]
+    """
+
+    def __init__(self, capacity=100000, by_text=True, collapse_retweets=True):
+        self.by_text = by_text
+        self.collapse_retweets = collapse_retweets
+        self.ids = RollingSet(capacity)
+        self.texts = RollingSet(capacity)
+        self.counts = Counter()
+
+    def add(self, tweet):
+        """ Remember a tweet as kept, e.g. one stored by a previous run. """
+        self.ids.add(tweet['id'])
+        if self.by_text and tweet.get('text'):
+            self.texts.add(text_hash(tweet['text']))
+
+    def _drop(self, reason):
+        self.counts[reason] += 1
+        METRICS.inc('dedupe_dropped_total', resource='statuses/filter', reason=reason)
+
+    def original(self, tweet):
+        """ Return the tweet check() decides on: the retweeted tweet of a collapsed retweet,
+        else the tweet itself.
+        """
+        if self.collapse_retweets and tweet.get('retweeted_status'):
+            return tweet['retweeted_status']
+        return tweet
+
+    def check(self, tweet):
+        """ Return the tweet to keep (the retweeted tweet for a collapsed retweet),
+        or None if it was already seen.
+        """
+        original = self.original(tweet)
+        if original is not tweet:
+            self.counts['retweet'] += 1
+            tweet = original
+        if tweet['id'] in self.ids:
+            self._drop('duplicate_id')
+            return None
+        if self.by_text and tweet.get('text') and text_hash(tweet['text']) in self.texts:
+            self._drop('duplicate_text')
+            # Remember the id too, so a re-delivery of this copy is dropped by id.
+            self.ids.add(tweet['id'])
+            return None
+        self.add(tweet)
+        self.counts['kept'] += 1
+        return tweet
+
+    def filter(self, tweets):
+        """ Yield the tweets of an iterable that are kept. """
+        for tweet in tweets:
+            tweet = self.check(tweet)
+            if tweet is not None:
+                yield tweet
+
+    def report(self):
+        """ Return a one line summary of what was kept and dropped. """
+        return 'kept %d tweets, dropped %d with a seen id and %d with a seen text, collapsed %d retweets' % (
+            self.counts['kept'], self.counts['duplicate_id'], self.counts['duplicate_text'], self.counts['retweet'])
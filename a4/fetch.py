@@ -0,0 +1,382 @@
+"""
+Fetch engine.
+
+Keep several Twitter requests in flight at once, while respecting the rate
+window of each endpoint through a token bucket per endpoint and credential set,
+kept in sync with the rate limit headers of the API. Any object with a
+`request(resource, params)` method can be used as the twitter connection, so the
+same code runs against the real API or a local stand-in server.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import threading
+import time
+
+from metrics import METRICS
+
+
+# Requests allowed per 15 minute window for each endpoint (user authentication).
+# See https://developer.twitter.com/en/docs/basics/rate-limits
+RATE_WINDOW = 15 * 60
+RATE_LIMITS = {
+    'friends/ids': 15,
+    'followers/ids': 15,
+    'users/lookup': 900,
+}
+DEFAULT_RATE_LIMIT = 15
+
+
+class TokenBucket(object):
+    """
+    A thread safe token bucket holding `capacity` tokens, refilled at a rate of
+    `capacity` tokens every `window` seconds.
+
+    Once the API reports the remaining calls and the reset time of the window
+    (see sync), the bucket follows the API instead: it holds the remaining calls
+    and is refilled all at once when the window resets.
+
+    >>> bucket = TokenBucket(2, 60)
+    >>> bucket.try_acquire(), bucket.try_acquire(), bucket.try_acquire()
+    (True, True, False)
+    >>> bucket = TokenBucket(15, 900)
+    >>> bucket.sync(15, 0, 0.05)
+    >>> bucket.try_acquire(), 0 < bucket.wait_time() <= 0.05
+    (False, True)
+    >>> time.sleep(0.05); bucket.try_acquire(), bucket.tokens
+    (True, 14.0)
+    """
+
+    def __init__(self, capacity, window):
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        # Tokens taken by requests still waiting for their response.
+        self.inflight = 0
+        # Monotonic time at which the API window resets, once known.
+        self.reset_at = None
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.reset_at is not None:
+            if now >= self.reset_at:
+                self.tokens = float(self.capacity)
+                self.reset_at = None
+        else:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """ Take a token if one is available. Returns True if a token was taken. """
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.inflight += 1
+                return True
+            return False
+
+    def release(self):
+        """ Mark the request of a token taken earlier as answered. """
+        with self.lock:
+            self.inflight = max(self.inflight - 1, 0)
+
+    def wait_time(self):
+        """ Return the number of seconds until a token is available. """
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                return 0.
+            if self.reset_at is not None:
+                return self.reset_at - self.updated
+            return (1 - self.tokens) / self.rate
+
+    def sync(self, limit, remaining, reset_in):
+        """ Update the bucket with the rate limit reported by the API.
+        Args:
+          limit ...... The number of calls allowed per window.
+          remaining .. The number of calls left in the current window.
+          reset_in ... Seconds until the window resets.
+        """
+        with self.lock:
+            self._refill()
+            self.capacity = limit
+            # Requests still in flight may not be counted in remaining yet.
+            self.tokens = float(max(remaining - self.inflight, 0))
+            self.reset_at = self.updated + max(reset_in, 0)
+
+    def drain(self):
+        """ Empty the bucket, e.g. after the API answered 429 (Too Many Requests)
+        without telling when the window resets.
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.)
+
+
+def parse_rate_limit(headers):
+    """ Read the rate limit headers of a Twitter response.
+    Args:
+      headers ... The response headers.
+    Returns:
+      A tuple (limit, remaining, reset_in) where reset_in is the number of seconds
+      until the window resets, or None if the headers are missing.
+
+    >>> parse_rate_limit({'x-rate-limit-limit': '15', 'x-rate-limit-remaining': '0',
+    ...                   'x-rate-limit-reset': str(int(time.time()) + 60)})[:2]
+    (15, 0)
+    >>> parse_rate_limit({}) is None
+    True
+    """
+    try:
+        return (int(headers['x-rate-limit-limit']), int(headers['x-rate-limit-remaining']),
+                int(headers['x-rate-limit-reset']) - time.time())
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RequestScheduler(object):
+    """
+    Send requests through several Twitter connections (one per credential set),
+    keeping one token bucket per connection and endpoint.
+
+    Each request goes to the next connection that still has calls left for the
+    endpoint. The buckets are kept in sync with the rate limit headers of every
+    response, so when all connections are exhausted the scheduler sleeps only
+    until the earliest actual reset. A RequestScheduler has the same `request`
+    method as a TwitterAPI object and can be used in its place.
+
+    With a ResponseCache (see cache.py), cached responses are returned without
+    taking a token, and new responses are stored. An offline cache needs no clients.
+    A fresh scheduler (see refreshing) skips the cached responses but still stores
+    the new ones.
+
+    Requests rotate over the credential sets, each one getting its share of the calls:
+
+    >>> from mockapi import LocalTwitterAPI, MockData, MockTwitterServer
+    >>> data = MockData([{'id': 1, 'screen_name': 'alice', 'friends': [2, 3]}])
+    >>> with MockTwitterServer(data, limits={'friends/ids': 2}) as server:
+    ...     scheduler = RequestScheduler([LocalTwitterAPI(server.url, 'a'), LocalTwitterAPI(server.url, 'b')])
+    ...     codes = [scheduler.request('friends/ids', {'user_id': 1}).status_code for i in range(4)]
+    ...     remaining = [server.windows[(c, 'friends/ids')][0] for c in 'ab']
+    >>> codes, remaining
+    ([200, 200, 200, 200], [0, 0])
+
+    A 429 answer syncs the bucket with the rate limit headers, and the retry waits
+    until the reset time they give:
+
+    >>> with MockTwitterServer(data, limits={'friends/ids': 1}, window=1) as server:
+    ...     reset = int(LocalTwitterAPI(server.url).request('friends/ids', {'user_id': 1}).headers['x-rate-limit-reset'])
+    ...     r = rate_limited_request(RequestScheduler([LocalTwitterAPI(server.url)]), 'friends/ids', {'user_id': 1})
+    ...     r.status_code, time.time() >= reset  # doctest: +ELLIPSIS
+    Got error ...
+     with status code 429 on friends/ids
+    All 1 credentials exhausted for friends/ids, sleeping ... seconds until reset.
+    (200, True)
+    """
+
+    def __init__(self, clients, cache=None, fresh=False):
+        self.clients = list(clients)
+        self.cache = cache
+        self.fresh = fresh
+        self.buckets = {}
+        self.next_client = 0
+        self.lock = threading.Lock()
+
+    def refreshing(self):
+        """ Return a fresh scheduler over the same clients and token buckets, whose
+        requests always go to the API, e.g. to see changes within the cache TTLs.
+        In offline mode there is nothing to refresh and the scheduler itself is returned.
+        """
+        if self.cache is not None and self.cache.offline:
+            return self
+        scheduler = RequestScheduler(self.clients, self.cache, fresh=True)
+        scheduler.buckets, scheduler.lock = self.buckets, self.lock
+        return scheduler
+
+    def bucket(self, client, resource):
+        """ Return the token bucket of a client index for a resource. """
+        with self.lock:
+            if (client, resource) not in self.buckets:
+                self.buckets[(client, resource)] = TokenBucket(RATE_LIMITS.get(resource, DEFAULT_RATE_LIMIT),
+                                                               RATE_WINDOW)
+            return self.buckets[(client, resource)]
+
+    def _acquire(self, resource):
+        """ Block until some client may call resource, rotating over the clients.
+        Returns:
+          The index of the client and its bucket.
+        """
+        while True:
+            with self.lock:
+                start = self.next_client
+                self.next_client = (self.next_client + 1) % len(self.clients)
+            order = [(start + i) % len(self.clients) for i in range(len(self.clients))]
+            for client in order:
+                bucket = self.bucket(client, resource)
+                if bucket.try_acquire():
+                    return client, bucket
+            wait = min(self.bucket(client, resource).wait_time() for client in order)
+            print('All %d credentials exhausted for %s, sleeping %.0f seconds until reset.' %
+                  (len(self.clients), resource, wait))
+            sys.stderr.flush()
+            METRICS.inc('sleep_seconds_total', wait, resource=resource, reason='rate_limit')
+            time.sleep(wait)
+
+    def request(self, resource, params=None):
+        if self.cache is not None and not self.fresh:
+            response = self.cache.get(resource, params)
+            if response is not None:
+                METRICS.inc('cache_hits_total', resource=resource)
+                return response
+        client, bucket = self._acquire(resource)
+        start = time.perf_counter()
+        try:
+            response = self.clients[client].request(resource, params)
+        except Exception:
+            METRICS.inc('requests_total', resource=resource, status='exception')
+            raise
+        finally:
+            bucket.release()
+            METRICS.observe('request_seconds', time.perf_counter() - start, resource=resource)
+        headers = getattr(response, 'headers', None) or {}
+        METRICS.inc('requests_total', resource=resource, status=response.status_code)
+        # Streams have no length; their bytes are counted as they are read (see lazyjson.py).
+        if headers.get('content-length'):
+            METRICS.inc('bytes_total', int(headers['content-length']), resource=resource)
+        rate_limit = parse_rate_limit(headers)
+        if rate_limit is not None:
+            bucket.sync(*rate_limit)
+            METRICS.set('rate_limit_remaining', rate_limit[1], resource=resource, credential=client)
+        elif response.status_code == 429:
+            bucket.drain()
+        if self.cache is not None:
+            self.cache.put(resource, params, response)
+        return response
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(twitter):
+    """ Return the RequestScheduler for a twitter connection.
+    A plain TwitterAPI object is wrapped in a single credential scheduler on first
+    use, so every request made with it shares the same token buckets.
+    """
+    if isinstance(twitter, RequestScheduler):
+        return twitter
+    with _schedulers_lock:
+        if twitter not in _schedulers:
+            _schedulers[twitter] = RequestScheduler([twitter])
+        return _schedulers[twitter]
+
+
+def rate_limited_request(twitter, resource, params, max_tries=5, backoff=5):
+    """ Make a Twitter request once the endpoint's rate window allows it (see RequestScheduler).
+    A 429 answer is retried as soon as a credential set has calls left, other
+    errors are retried with an exponential backoff. 404 (not found) and 401
+    (protected account) answers are returned, as retrying cannot change them.
+    Do this at most max_tries times before quitting.
+    Args:
+      twitter .... A TwitterAPI object or a RequestScheduler.
+      resource ... A resource string to request
+      params ..... A parameter dict for the request, e.g., to specify
+                   parameters like screen_name or count.
+      max_tries .. The maximum number of tries to attempt.
+      backoff .... Seconds to sleep after the first non rate limit error.
+    Returns:
+      A TwitterResponse object, or None if failed.
+    """
+    scheduler = get_scheduler(twitter)
+    for i in range(max_tries):
+        request = scheduler.request(resource, params)
+        if request.status_code in (200, 401, 404):
+            return request
+        print('Got error %s \n with status code %s on %s' % (request.text, request.status_code, resource))
+        sys.stderr.flush()
+        METRICS.inc('retries_total', resource=resource)
+        if request.status_code != 429:
+            METRICS.inc('sleep_seconds_total', backoff * 2 ** i, resource=resource, reason='backoff')
+            time.sleep(backoff * 2 ** i)
+
+
+def fetch_all(twitter, resource, params_list, max_workers=4):
+    """ Make one request per params dict, keeping up to max_workers requests in flight.
+    Args:
+      twitter ....... A TwitterAPI object.
+      resource ...... A resource string to request
+      params_list ... A list of parameter dicts, one per request.
+      max_workers ... The maximum number of concurrent requests.
+    Returns:
+      A list of TwitterResponse objects (or None if failed), in the same order as params_list.
+
+    >>> from mockapi import LocalTwitterAPI, MockData, MockTwitterServer
+    >>> with MockTwitterServer(MockData.synthetic(n_users=3, n_tweets=0), latency=0.2) as server:
+    ...     start = time.time()
+    ...     responses = fetch_all(LocalTwitterAPI(server.url), 'users/lookup',
+    ...                           [{'screen_name': 'user%d' % i} for i in (1002, 1000, 1001)])
+    ...     elapsed = time.time() - start
+    >>> [r.json()[0]['screen_name'] for r in responses], elapsed < 0.4
+    (['user1002', 'user1000', 'user1001'], True)
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda params: rate_limited_request(twitter, resource, params), params_list))
+
+
+# users/lookup accepts at most this many screen names or ids per request.
+LOOKUP_BATCH_SIZE = 100
+
+
+def chunks(items, size):
+    """ Split a list into consecutive lists of at most size items.
+
+    >>> chunks([1, 2, 3, 4, 5], 2)
+    [[1, 2], [3, 4], [5]]
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def lookup_users(twitter, screen_names=(), ids=(), max_workers=4):
+    """ Retrieve the user objects for many screen names and/or ids with users/lookup.
+    Screen names and ids are packed into batches of 100 and the batches are sent
+    concurrently.
+    Args:
+      twitter ....... A TwitterAPI object.
+      screen_names .. A list of screen name strings.
+      ids ........... A list of user ids.
+      max_workers ... The maximum number of concurrent requests.
+    Returns:
+      A list of user dicts, one per user found, in the order of screen_names and
+      then ids. Users requested twice (by screen name and id) appear only once.
+
+    >>> from mockapi import LocalTwitterAPI, MockData, MockTwitterServer
+    >>> with MockTwitterServer(MockData([])) as server:
+    ...     users = lookup_users(LocalTwitterAPI(server.url), ids=list(range(2000, 1750, -1)))
+    ...     calls = 900 - int(server.windows[('anonymous', 'users/lookup')][0])
+    ...     both = lookup_users(LocalTwitterAPI(server.url), ['user1760', 'USER1755'], [1755, 1754])
+    >>> len(users), calls, [u['id'] for u in users[:3]], [u['id'] for u in users[-2:]]
+    (250, 3, [2000, 1999, 1998], [1752, 1751])
+    >>> [u['screen_name'] for u in both]
+    ['user1760', 'user1755', 'user1754']
+    """
+    screen_names, ids = list(screen_names), [int(i) for i in ids]
+    params_list = [{'screen_name': ','.join(batch)}
+                   for batch in chunks(screen_names, LOOKUP_BATCH_SIZE)]
+    params_list.extend({'user_id': ','.join(str(i) for i in batch)}
+                       for batch in chunks(ids, LOOKUP_BATCH_SIZE))
+    users = {}
+    for response in fetch_all(twitter, 'users/lookup', params_list, max_workers):
+        # users/lookup answers 404 when none of the batch was found.
+        if response is not None and response.status_code == 200:
+            for u in response.json():
+                users[u['id']] = u
+    # The batches come back in any order: put the users back in the order asked for.
+    by_name = dict((u['screen_name'].lower(), u) for u in users.values())
+    found, seen = [], set()
+    for u in [by_name.get(s.lower()) for s in screen_names] + [users.get(i) for i in ids]:
+        if u is not None and u['id'] not in seen:
+            seen.add(u['id'])
+            found.append(u)
+    return found
@@ -0,0 +1,190 @@
+"""
+Crawl frontier.
+
+A SQLite backed frontier to expand the follow graph hop by hop from a set of
+seed accounts. Every account seen as a friend or follower of a crawled account
+is queued one hop further than it, with a score counting how many crawled
+accounts it is connected to; the highest scores are crawled first. The nodes
+table holds only this crawl state. Crawled accounts are stored in the users
+table, their friends and followers as sorted int64 id arrays (see idlists.py)
+kept as blobs, so a crawl interrupted at any point resumes where it stopped and
+nobody is fetched twice. When a crawled account is refreshed, the ids added to
+and removed from its lists are kept, as id arrays too, in a changes table, so
+the history of the network is stored as diffs.
+"""
+import json
+import sqlite3
+import time
+
+import numpy as np
+
+from idlists import as_ids
+
+QUEUED = 'queued'
+FETCHED = 'fetched'
+# Looked up but not returned by Twitter (suspended or deleted accounts).
+MISSING = 'missing'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    depth INTEGER NOT NULL,
+    score INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'queued'
+);
+CREATE INDEX IF NOT EXISTS nodes_queue ON nodes (state, score DESC);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    friends BLOB NOT NULL,
+    followers BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    changed_at REAL NOT NULL,
+    added BLOB NOT NULL,
+    removed BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_id ON changes (id);
+"""
+# The lists of a user dict that are stored as id arrays, and diffed on update.
+LISTS = ('friends', 'followers')
+
+
+def _from_blob(blob):
+    return np.frombuffer(blob, dtype=np.int64)
+
+
+class CrawlFrontier(object):
+    """
+    Params:
+        filename....The SQLite database file (':memory:' for a throwaway frontier).
+        max_depth...The number of hops from the seeds to crawl. Accounts further
+                    away are not queued.
+
+    >>> frontier = CrawlFrontier(':memory:', max_depth=1)
+    >>> frontier.add_seeds([1, 2])
+    >>> frontier.pop(10)
+    [1, 2]
+    >>> frontier.record({'id': 1, 'friends': [3, 4], 'followers': [2]})
+    >>> frontier.record({'id': 2, 'friends': [4], 'followers': []})
+    >>> frontier.pop(10), frontier.counts()
+    ([4, 3], {'fetched': 2, 'queued': 2})
+    >>> frontier.record({'id': 4, 'friends': [5], 'followers': []})
+    >>> frontier.pop(10), [(u['id'], u['friends'].tolist()) for u in frontier.users()]
+    ([3], [(1, [3, 4]), (2, [4]), (4, [5])])
+    >>> frontier.update({'id': 2, 'friends': [4, 6], 'followers': []})
+    {'friends': ([6], [])}
+    >>> [(c['kind'], c['added'], c['removed']) for c in frontier.changes(2)]
+    [('friends', [6], [])]
+    """
+
+    def __init__(self, filename, max_depth=1):
+        self.filename = filename
+        self.max_depth = max_depth
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+
+    def add_seeds(self, ids):
+        """ Queue the seed accounts at depth 0. Seeds already in the frontier are left alone. """
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO nodes (id, depth) VALUES (?, 0)",
+                                [(int(i),) for i in ids])
+
+    def pop(self, n):
+        """ Return up to n queued ids, the closest to the seeds and highest scores first.
+        They stay queued until recorded, so ids popped before a crash are returned again.
+        """
+        rows = self.db.execute("SELECT id FROM nodes WHERE state = ? ORDER BY depth, score DESC, id LIMIT ?",
+                               (QUEUED, n))
+        return [row[0] for row in rows]
+
+    def record(self, user):
+        """ Store a crawled user dict, with its 'friends' and 'followers' lists, and
+        queue its neighbours one hop further (or raise their score if already queued).
+        """
+        lists = dict((kind, as_ids(user.get(kind, []))) for kind in LISTS)
+        with self.db:
+            depth = self.db.execute("SELECT depth FROM nodes WHERE id = ?", (user['id'],)).fetchone()
+            depth = depth[0] if depth else 0
+            self.db.execute("INSERT OR REPLACE INTO nodes (id, depth, score, state) "
+                            "VALUES (?, ?, COALESCE((SELECT score FROM nodes WHERE id = ?), 0), ?)",
+                            (user['id'], depth, user['id'], FETCHED))
+            self._store(user, lists)
+            self._queue(np.union1d(lists['friends'], lists['followers']), depth + 1)
+
+    def _store(self, user, lists):
+        profile = dict((k, v) for k, v in user.items() if k not in LISTS)
+        self.db.execute("INSERT OR REPLACE INTO users (id, user, friends, followers) VALUES (?, ?, ?, ?)",
+                        (user['id'], json.dumps(profile), lists['friends'].tobytes(), lists['followers'].tobytes()))
+
+    def _queue(self, ids, depth):
+        if depth > self.max_depth:
+            return
+        self.db.executemany("INSERT INTO nodes (id, depth, score) VALUES (?, ?, 1) "
+                            "ON CONFLICT (id) DO UPDATE SET score = score + 1, depth = MIN(depth, excluded.depth)",
+                            [(i, depth) for i in np.asarray(ids, dtype=np.int64).tolist()])
+
+    def update(self, user):
+        """ Replace a crawled user dict by a fresher one. The ids added to and removed
+        from its friends and followers are stored in the changes table, and the added
+        ids are queued like the neighbours of a new user.
+        Returns:
+            A dict from 'friends' / 'followers' to a tuple (added ids, removed ids),
+            for the lists that changed.
+        """
+        row = self.db.execute("SELECT nodes.depth, users.friends, users.followers FROM nodes JOIN users "
+                              "ON users.id = nodes.id WHERE nodes.id = ? AND nodes.state = ?",
+                              (user['id'], FETCHED)).fetchone()
+        if row is None:
+            self.record(user)
+            return {}
+        depth, old = row[0], dict(zip(LISTS, (_from_blob(blob) for blob in row[1:])))
+        lists = dict((kind, as_ids(user.get(kind, []))) for kind in LISTS)
+        diffs = {}
+        for kind in LISTS:
+            added = np.setdiff1d(lists[kind], old[kind], assume_unique=True)
+            removed = np.setdiff1d(old[kind], lists[kind], assume_unique=True)
+            if len(added) or len(removed):
+                diffs[kind] = (added, removed)
+        with self.db:
+            self._store(user, lists)
+            now = time.time()
+            for kind, (added, removed) in diffs.items():
+                self.db.execute("INSERT INTO changes (id, kind, changed_at, added, removed) VALUES (?, ?, ?, ?, ?)",
+                                (user['id'], kind, now, added.tobytes(), removed.tobytes()))
+                self._queue(added, depth + 1)
+        return dict((kind, (added.tolist(), removed.tolist())) for kind, (added, removed) in diffs.items())
+
+    def changes(self, user_id):
+        """ Return the stored changes of a user, oldest first, as dicts with the keys
+        'kind', 'changed_at', 'added' and 'removed'.
+        """
+        rows = self.db.execute("SELECT kind, changed_at, added, removed FROM changes WHERE id = ? ORDER BY rowid",
+                               (int(user_id),))
+        return [{'kind': kind, 'changed_at': changed_at,
+                 'added': _from_blob(added).tolist(), 'removed': _from_blob(removed).tolist()}
+                for kind, changed_at, added, removed in rows]
+
+    def discard(self, ids):
+        """ Mark queued ids that could not be looked up, so they are not popped again. """
+        with self.db:
+            self.db.executemany("UPDATE nodes SET state = ? WHERE id = ? AND state = ?",
+                                [(MISSING, int(i), QUEUED) for i in ids])
+
+    def counts(self):
+        """ Return a dict from state to the number of ids in that state. """
+        return dict(self.db.execute("SELECT state, COUNT(*) FROM nodes GROUP BY state"))
+
+    def users(self):
+        """ Yield the crawled user dicts, in the order of their ids, with their friends
+        and followers as sorted int64 arrays.
+        """
+        for profile, friends, followers in self.db.execute("SELECT user, friends, followers FROM users ORDER BY id"):
+            user = json.loads(profile)
+            user['friends'], user['followers'] = _from_blob(friends), _from_blob(followers)
+            yield user
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,241 @@
+"""
+Graph snapshot history.
+
+Each cluster.py run overwrites data/cluster/graph.snapshot. record_snapshot
+keeps a copy of it in data/cluster/history, named by the UTC time of the run:
+
+    graph-20240131T120000.250000Z.snapshot
+
+so the changes of the network between runs can be followed. Nodes are matched
+across snapshots by name (a screen_name or a user id). diff_snapshots maps the
+nodes of two snapshots into one sorted vocabulary and compares their edges as
+sorted arrays of int64 keys, so a diff of millions of edges is a few array
+merges, not Python set operations.
+
+Community ids are arbitrary in each run. When a snapshot is recorded, each of
+its communities takes the id of the community of the previous snapshot it
+shares the most nodes with, so the same community keeps the same id, and the
+nodes that changed community can be listed.
+
+Run `python history.py` to print the changes between the last two snapshots.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+from idlists import contains
+from snapshot import read_snapshot, write_snapshot
+
+HISTORY_DIR = 'data/cluster/history'
+
+
+def list_snapshots(directory=HISTORY_DIR):
+    """ Return the snapshot files of the history, oldest first. """
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory))
+            if f.startswith('graph-') and f.endswith('.snapshot')]
+
+
+def community_attributes(snapshot):
+    """ Return the names of the attributes of a snapshot that hold community ids
+    (every integer attribute).
+    """
+    return [name for name in snapshot.attribute_names() if snapshot.attribute(name).dtype.kind == 'i']
+
+
+def match_communities(old, new, next_id=None):
+    """ Renumber the communities of new after those of old.
+    Params:
+        old.......Array of the community of each node in the old snapshot (-1 for none).
+        new.......Array of the community of the same nodes in the new snapshot.
+        next_id...The first id free in old (by default, one more than the largest in old).
+    Returns:
+        A dict from each community id of new to its id in old: the communities
+        sharing the most nodes are paired first, one to one. The communities left
+        unpaired get new ids from next_id on.
+
+    >>> match_communities(np.array([0, 0, 0, 1, 1, -1]), np.array([5, 5, 2, 2, 2, 7]))
+    {2: 1, 5: 0, 7: 2}
+    """
+    both = (old >= 0) & (new >= 0)
+    pairs, overlaps = np.unique(np.stack([new[both], old[both]], axis=1), axis=0, return_counts=True)
+    mapping = {}
+    taken = set()
+    # Largest overlaps first; ties by new then old id.
+    for i in np.lexsort((pairs[:, 1], pairs[:, 0], -overlaps)).tolist():
+        n, o = pairs[i].tolist()
+        if n not in mapping and o not in taken:
+            mapping[n] = o
+            taken.add(o)
+    if next_id is None:
+        next_id = int(old.max()) + 1 if len(old) else 0
+    for n in np.unique(new[new >= 0]).tolist():
+        if n not in mapping:
+            mapping[n] = next_id
+            next_id += 1
+    return mapping
+
+
+class _Vocabulary(object):
+    """ The sorted node names of two snapshots, with the position of each node of
+    each snapshot in it.
+    """
+
+    def __init__(self, old_labels, new_labels):
+        old_labels = np.array(old_labels, dtype=str)
+        new_labels = np.array(new_labels, dtype=str)
+        self.labels, inverse = np.unique(np.concatenate([old_labels, new_labels]), return_inverse=True)
+        self.old = inverse[:len(old_labels)].astype(np.int64)
+        self.new = inverse[len(old_labels):].astype(np.int64)
+
+    def edge_keys(self, graph, ids):
+        """ Return the sorted keys u * size + v, u < v, of the edges of a graph, in vocabulary ids. """
+        rows, cols = graph.edge_ids()
+        a, b = ids[rows], ids[cols]
+        return np.sort(np.minimum(a, b) * len(self.labels) + np.maximum(a, b))
+
+    def edges(self, keys):
+        u, v = np.divmod(keys, len(self.labels))
+        return list(zip(self.labels[u].tolist(), self.labels[v].tolist()))
+
+    def spread(self, ids, values, fill):
+        """ Return an array over the vocabulary with the values of the nodes ids, and fill elsewhere. """
+        result = np.full(len(self.labels), fill, dtype=np.asarray(values).dtype)
+        result[ids] = values
+        return result
+
+
+class GraphDiff(object):
+    """
+    The changes between two snapshots.
+
+    Params:
+        old....The file of the older snapshot.
+        new....The file of the newer snapshot.
+
+    Attributes (lists, sorted by node name):
+        nodes_joined.......The nodes only in new.
+        nodes_left.........The nodes only in old.
+        edges_added........The (u, v) edges only in new, u < v.
+        edges_removed......The (u, v) edges only in old.
+        degree_changes.....(node, old degree, new degree) for the nodes in both whose degree changed.
+        community_moves....A dict from each community attribute of both snapshots to
+                           (node, old community, new community) for the nodes in both
+                           whose community changed.
+    """
+
+    def __init__(self, old, new):
+        self.old, self.new = old, new
+        old_snapshot, new_snapshot = read_snapshot(old), read_snapshot(new)
+        old_graph, new_graph = old_snapshot.graph(), new_snapshot.graph()
+        vocabulary = _Vocabulary(old_graph.labels, new_graph.labels)
+        in_old = vocabulary.spread(vocabulary.old, True, False)
+        in_new = vocabulary.spread(vocabulary.new, True, False)
+        labels = vocabulary.labels
+        self.nodes_joined = labels[in_new & ~in_old].tolist()
+        self.nodes_left = labels[in_old & ~in_new].tolist()
+        old_keys = vocabulary.edge_keys(old_graph, vocabulary.old)
+        new_keys = vocabulary.edge_keys(new_graph, vocabulary.new)
+        self.edges_added = vocabulary.edges(new_keys[~contains(old_keys, new_keys)])
+        self.edges_removed = vocabulary.edges(old_keys[~contains(new_keys, old_keys)])
+        both = in_old & in_new
+        old_degrees = vocabulary.spread(vocabulary.old, old_graph.degrees(), 0)
+        new_degrees = vocabulary.spread(vocabulary.new, new_graph.degrees(), 0)
+        changed = np.flatnonzero(both & (old_degrees != new_degrees))
+        self.degree_changes = list(zip(labels[changed].tolist(), old_degrees[changed].tolist(),
+                                       new_degrees[changed].tolist()))
+        self.community_moves = {}
+        for name in community_attributes(old_snapshot):
+            if name not in community_attributes(new_snapshot):
+                continue
+            old_communities = vocabulary.spread(vocabulary.old, old_snapshot.attribute(name), -1)
+            new_communities = vocabulary.spread(vocabulary.new, new_snapshot.attribute(name), -1)
+            moved = np.flatnonzero(both & (old_communities != new_communities))
+            self.community_moves[name] = list(zip(labels[moved].tolist(), old_communities[moved].tolist(),
+                                                  new_communities[moved].tolist()))
+
+    def summary(self, top=5):
+        """ Return a few lines with the number of changes of each kind, and the
+        top nodes whose degree changed the most.
+        """
+        lines = ['%s -> %s' % (os.path.basename(self.old), os.path.basename(self.new)),
+                 '%d nodes joined, %d left; %d edges added, %d removed; %d nodes changed degree' % (
+                     len(self.nodes_joined), len(self.nodes_left), len(self.edges_added), len(self.edges_removed),
+                     len(self.degree_changes))]
+        for node, old, new in sorted(self.degree_changes, key=lambda x: (-abs(x[2] - x[1]), x[0]))[:top]:
+            lines.append('  %s: degree %d -> %d' % (node, old, new))
+        for name, moves in sorted(self.community_moves.items()):
+            lines.append('%d nodes changed %s community' % (len(moves), name))
+        return '\n'.join(lines)
+
+
+def diff_snapshots(old, new):
+    """ Return the GraphDiff between two snapshot files. """
+    return GraphDiff(old, new)
+
+
+def record_snapshot(filename, directory=HISTORY_DIR, now=None):
+    """ Copy a snapshot into the history, as graph-<UTC time>.snapshot, with its
+    communities renumbered after those of the last snapshot recorded.
+    Params:
+        filename.....The snapshot of this run, e.g. cluster.GRAPH_FILE.
+        directory....The history directory.
+        now..........The time of the run, in seconds since the epoch (the current time by default).
+    Returns:
+        The file of the recorded snapshot.
+
+    The name holds the time to the microsecond; a FileExistsError is raised rather
+    than overwrite a snapshot recorded at the same time.
+
+    >>> import tempfile
+    >>> from csrgraph import CSRGraph
+    >>> directory = tempfile.mkdtemp()
+    >>> filename = os.path.join(directory, 'graph.snapshot')
+    >>> write_snapshot(filename, CSRGraph.from_arrays(['a', 'b'], [0], [1]))
+    >>> os.path.basename(record_snapshot(filename, directory, now=1706702400.25))
+    'graph-20240131T120000.250000Z.snapshot'
+    >>> os.path.basename(record_snapshot(filename, directory, now=1706702400.5))
+    'graph-20240131T120000.500000Z.snapshot'
+    >>> record_snapshot(filename, directory, now=1706702400.5)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    FileExistsError: ...graph-20240131T120000.500000Z.snapshot already exists
+    >>> len(list_snapshots(directory))
+    2
+    """
+    seconds, microseconds = divmod(int((time.time() if now is None else now) * 1000000), 1000000)
+    stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime(seconds)) + '.%06dZ' % microseconds
+    recorded = os.path.join(directory, 'graph-%s.snapshot' % stamp)
+    if os.path.exists(recorded):
+        raise FileExistsError('%s already exists' % recorded)
+    snapshot = read_snapshot(filename, verify=True)
+    graph = snapshot.graph()
+    attributes = dict((name, np.array(values)) for name, values in snapshot.attributes().items())
+    previous = list_snapshots(directory)
+    if previous:
+        last = read_snapshot(previous[-1])
+        vocabulary = _Vocabulary(last.labels(), graph.labels)
+        for name in community_attributes(snapshot):
+            if name not in community_attributes(last):
+                continue
+            old = vocabulary.spread(vocabulary.old, last.attribute(name), -1)[vocabulary.new]
+            new = attributes[name]
+            mapping = match_communities(old, new, int(last.attribute(name).max(initial=-1)) + 1)
+            attributes[name] = np.array([mapping.get(c, c) for c in new.tolist()], dtype=new.dtype)
+    write_snapshot(recorded, graph, attributes)
+    return recorded
+
+
+def main(args):
+    directory = args[1] if len(args) > 1 else HISTORY_DIR
+    snapshots = list_snapshots(directory)
+    print('%d snapshots in %s' % (len(snapshots), directory))
+    if len(snapshots) > 1:
+        print(diff_snapshots(snapshots[-2], snapshots[-1]).summary())
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,186 @@
+"""
+Compact id lists.
+
+Friend and follower ids are kept as sorted int64 NumPy arrays (8 bytes per id,
+against about 36 for a list of Python ints), on which intersections and membership
+tests are vectorized.
+"""
+import numpy as np
+
+
+def as_ids(ids):
+    """ Return ids as a sorted int64 array without duplicates.
+
+    >>> as_ids([5, 3, 5, 1])
+    array([1, 3, 5])
+    """
+    return np.unique(np.asarray(ids, dtype=np.int64))
+
+
+def intersect(a, b):
+    """ Return the ids in both a and b.
+
+    >>> intersect(as_ids([1, 2, 3]), as_ids([2, 3, 4]))
+    array([2, 3])
+    """
+    return np.intersect1d(a, b, assume_unique=True)
+
+
+def contains(ids, values):
+    """ Return a boolean array telling which values are in the sorted ids.
+
+    >>> contains(as_ids([1, 3, 5]), [0, 3, 5, 6])
+    array([False,  True,  True, False])
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if len(ids) == 0:
+        return np.zeros(values.shape, dtype=bool)
+    idx = np.minimum(np.searchsorted(ids, values), len(ids) - 1)
+    return ids[idx] == values
+
+
+class IdCounts(object):
+    """
+    Counts of ids, held in two arrays, with the read methods of a Counter.
+
+    Params:
+        ids......Sorted int64 array of ids.
+        counts...Array with the count of each id.
+
+    >>> counts = IdCounts(as_ids([1, 2, 3]), np.array([1, 2, 2]))
+    >>> counts.most_common(2), counts[3], counts[7], counts.get(7), 2 in counts, len(counts)
+    ([(2, 2), (3, 2)], 2, 0, None, True, 3)
+    """
+
+    def __init__(self, ids, counts):
+        self.ids = ids
+        self.counts = counts
+
+    def _find(self, key):
+        i = int(np.searchsorted(self.ids, key))
+        return i if i < len(self.ids) and self.ids[i] == key else None
+
+    def get(self, key, default=None):
+        i = self._find(key)
+        return default if i is None else int(self.counts[i])
+
+    def __getitem__(self, key):
+        return self.get(key, 0)
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def keys(self):
+        return self.ids.tolist()
+
+    def items(self):
+        return zip(self.ids.tolist(), self.counts.tolist())
+
+    def most_common(self, n=None):
+        """ Return the n most common (id, count) pairs, like Counter.most_common. Ties
+        are in ascending order of id.
+        """
+        if n is not None and n < len(self.ids):
+            # Only sort the candidates: every id with a count of at least the n-th largest.
+            nth = np.partition(self.counts, len(self.counts) - n)[len(self.counts) - n]
+            candidates = np.flatnonzero(self.counts >= nth)
+        else:
+            candidates = np.arange(len(self.ids))
+        order = candidates[np.argsort(-self.counts[candidates], kind='stable')][:n]
+        return list(zip(self.ids[order].tolist(), self.counts[order].tolist()))
+
+
+def _sum_counts(ids, counts):
+    """ Merge the counts of repeated ids. """
+    ids, inverse = np.unique(ids, return_inverse=True)
+    return ids, np.bincount(inverse, weights=counts, minlength=len(ids)).astype(np.int64)
+
+
+class HeavyHitters(object):
+    """
+    Bounded memory counts of the most frequent ids of a stream of id lists (a
+    batched Misra-Gries summary). At most capacity ids are kept; when there are
+    more, the (capacity + 1)-th largest count is subtracted from every count and
+    the ids left at zero are dropped. The counts kept are underestimates by at
+    most `error`, and every id seen more than total / (capacity + 1) times is kept.
+
+    Params:
+        capacity....The number of ids kept.
+
+    >>> hh = HeavyHitters(3)
+    >>> for ids in [[1, 2, 3], [1, 2, 4], [1, 5], [1, 2]]:
+    ...     hh.update(ids)
+    >>> hh.counts().most_common(2), hh.error
+    ([(1, 3), (2, 2)], 1)
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.estimates = np.zeros(0, dtype=np.int64)
+        self.error = 0
+        self.total = 0
+
+    def update(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        self.total += len(ids)
+        batch_ids, batch_counts = np.unique(ids, return_counts=True)
+        self.ids, self.estimates = _sum_counts(np.concatenate([self.ids, batch_ids]),
+                                               np.concatenate([self.estimates, batch_counts]))
+        if len(self.ids) > self.capacity:
+            threshold = np.partition(self.estimates, len(self.estimates) - self.capacity - 1)[
+                len(self.estimates) - self.capacity - 1]
+            self.estimates = self.estimates - threshold
+            keep = self.estimates > 0
+            self.ids, self.estimates = self.ids[keep], self.estimates[keep]
+            self.error += int(threshold)
+
+    def counts(self):
+        """ Return the estimated counts as an IdCounts. """
+        return IdCounts(self.ids, self.estimates)
+
+
+def count_ids(id_lists, capacity=None):
+    """ Count in how many of the lists each id appears.
+    Params:
+        id_lists....An iterable of id lists or arrays, each without duplicates.
+        capacity....None to count every id exactly. Otherwise, the number of ids
+                    kept by a bounded memory HeavyHitters summary, whose most
+                    common ids are those of the exact count when they stand out.
+    Returns:
+        An IdCounts from id to count.
+
+    >>> count_ids([[1, 2], as_ids([2, 3]), []]).most_common(1)
+    [(2, 2)]
+    """
+    if capacity is not None:
+        heavy_hitters = HeavyHitters(capacity)
+        for ids in id_lists:
+            heavy_hitters.update(ids)
+        return heavy_hitters.counts()
+    arrays = [np.asarray(ids, dtype=np.int64) for ids in id_lists]
+    if not arrays:
+        return IdCounts(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    ids, counts = np.unique(np.concatenate(arrays), return_counts=True)
+    return IdCounts(ids, counts)
+
+
+def followed_by(id_lists, min_count=None):
+    """ Return the ids in at least min_count of the lists (all of them by default).
+    Params:
+        id_lists....A list of id lists or arrays, each without duplicates.
+        min_count...The number of lists an id must be in.
+    Returns:
+        A sorted int64 array.
+
+    >>> followed_by([[1, 2, 3], [2, 3, 4], [3, 4, 5]]).tolist(), followed_by([[1, 2, 3], [2, 3, 4], [3, 4, 5]], 2).tolist()
+    ([3], [2, 3, 4])
+    """
+    min_count = len(id_lists) if min_count is None else min_count
+    if not id_lists:
+        return np.zeros(0, dtype=np.int64)
+    ids, counts = np.unique(np.concatenate([np.asarray(i, dtype=np.int64) for i in id_lists]), return_counts=True)
+    return ids[counts >= min_count]
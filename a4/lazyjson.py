@@ -0,0 +1,186 @@
+"""
+Lazy field extraction for the realtime stream.
+
+Most messages of statuses/filter are dropped because the first name of their
+user is not a census name. Instead of decoding every message into nested dicts
+to read `user.name`, the few fields we need are pulled out of the raw bytes with
+regular expressions, and only the tweets that pass the filter are fully decoded.
+
+Run `python lazyjson.py` to compare the throughput of both paths.
+"""
+import json
+import pickle
+import re
+import sys
+import time
+
+from census import load_census_index
+from metrics import METRICS
+
+
+# A JSON string body: anything but quotes and backslashes, or an escape sequence.
+_STRING = rb'((?:[^"\\]|\\.)*)'
+# The user object comes before any quoted or retweeted status in a tweet, and
+# its name comes right after its ids, so the first match is the author's.
+FIELDS = {
+    'text': re.compile(rb'"text":\s*"' + _STRING + rb'"'),
+    'user.name': re.compile(rb'"user":\s*\{[^{}]*?"name":\s*"' + _STRING + rb'"'),
+    'user.description': re.compile(rb'"user":\s*\{[^{}]*?"description":\s*(?:null|"' + _STRING + rb'")'),
+}
+# The stream counts are added to METRICS once every this many messages, to keep
+# the lock of the registry off the hot path.
+STREAM_METRICS_EVERY = 1000
+
+
+def _decode(value):
+    """ Decode the bytes of a JSON string body. """
+    if b'\\' not in value:
+        return value.decode('utf-8')
+    return json.loads(b'"' + value + b'"')
+
+
+def extract_field(raw, field):
+    """ Return a string field of a raw tweet without decoding the whole tweet.
+    Params:
+        raw.......The bytes of one JSON encoded tweet.
+        field.....One of the keys of FIELDS, e.g. 'user.name'.
+    Returns:
+        The string value, or None if it cannot be found.
+
+    >>> raw = b'{"id":1,"text":"gm \\\\"ser\\\\"","user":{"id":2,"name":"Ana\\\\u00efs Nin","description":null}}'
+    >>> extract_field(raw, 'text'), extract_field(raw, 'user.name'), extract_field(raw, 'user.description')
+    ('gm "ser"', 'Ana\\xefs Nin', None)
+    """
+    match = FIELDS[field].search(raw)
+    if match is None or match.group(1) is None:
+        return None
+    return _decode(match.group(1))
+
+
+def raw_first_name(raw):
+    """ Return the lower cased first name of the author of a raw tweet.
+    Returns:
+        The first name; '' for messages without a user (e.g. limit or delete notices),
+        or None if the name cannot be read without decoding the tweet.
+
+    >>> raw_first_name(b'{"id":1,"user":{"id":2,"name":"Mary Smith"}}')
+    'mary'
+    >>> raw_first_name(b'{"limit":{"track":12}}')
+    ''
+    """
+    if b'"user":' not in raw:
+        return ''
+    name = extract_field(raw, 'user.name')
+    if name is None:
+        return None
+    parts = name.split()
+    return parts[0].lower() if parts else ''
+
+
+def iter_lines(response):
+    """ Return a generator of the raw bytes of each message of a stream response,
+    skipping keep-alive newlines, or None if the response does not give access to
+    its raw lines.
+    """
+    raw = getattr(response, 'response', None)
+    if raw is None or not hasattr(raw, 'iter_lines'):
+        return None
+    return (line for line in raw.iter_lines() if line.strip())
+
+
+def filter_stream(response, keep):
+    """ Yield the fully decoded tweets of a stream whose author's first name passes keep.
+    Tweets are filtered on their raw bytes first; only the ones that pass, or whose
+    name cannot be read from the bytes, are decoded.
+    Params:
+        response...A streaming TwitterResponse (or any iterable of tweet dicts).
+        keep.......A function from a lower cased first name to True if the tweet is wanted.
+    Returns:
+        A generator of tweet dicts that have a user. The caller should still check
+        the first name on the decoded tweet.
+    """
+    lines = iter_lines(response)
+    if lines is None:
+        for tweet in response:
+            if 'user' in tweet:
+                yield tweet
+        return
+    messages = size = decoded = 0
+    parsing = 0.
+    try:
+        for line in lines:
+            start = time.perf_counter()
+            messages += 1
+            size += len(line)
+            name = raw_first_name(line)
+            if name == '' or (name is not None and not keep(name)):
+                parsing += time.perf_counter() - start
+                continue
+            tweet = json.loads(line)
+            decoded += 1
+            parsing += time.perf_counter() - start
+            if messages >= STREAM_METRICS_EVERY:
+                _count_stream(messages, size, decoded, parsing)
+                messages = size = decoded = 0
+                parsing = 0.
+            if 'user' in tweet:
+                yield tweet
+    finally:
+        _count_stream(messages, size, decoded, parsing)
+
+
+def _count_stream(messages, size, decoded, parsing, resource='statuses/filter'):
+    METRICS.inc('stream_messages_total', messages, resource=resource)
+    METRICS.inc('stream_decoded_total', decoded, resource=resource)
+    METRICS.inc('bytes_total', size, resource=resource)
+    METRICS.inc('parse_seconds_total', parsing, resource=resource)
+
+
+def _full_decode_first_names(lines):
+    names = []
+    for line in lines:
+        tweet = json.loads(line)
+        if 'user' in tweet and 'name' in tweet['user']:
+            parts = tweet['user']['name'].split()
+            names.append(parts[0].lower() if parts else '')
+    return names
+
+
+def benchmark(lines, keep, repeat=5):
+    """ Compare the throughput of full decoding and raw pre-filtering on the same lines.
+    Returns:
+      A tuple (full decode lines per second, pre-filter lines per second, fraction kept).
+    """
+    start = time.perf_counter()
+    for i in range(repeat):
+        full = [n for n in _full_decode_first_names(lines) if keep(n)]
+    full_rate = repeat * len(lines) / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for i in range(repeat):
+        kept = []
+        for line in lines:
+            name = raw_first_name(line)
+            if name is None or (name and keep(name)):
+                kept.append(json.loads(line))
+    fast_rate = repeat * len(lines) / (time.perf_counter() - start)
+    if len(kept) != len(full):
+        raise ValueError('the pre-filter kept %d tweets, full decoding %d' % (len(kept), len(full)))
+    return full_rate, fast_rate, len(kept) / len(lines)
+
+
+def main(args):
+    tweets = pickle.load(open('data/collect/real-time-tweets-test-dataset.pkl', 'rb'))
+    census = load_census_index()
+    names = census.male_names() | census.female_names()
+    lines = [json.dumps(t, separators=(',', ':')).encode('utf-8') for t in tweets]
+    # The fixture tweets were all kept by the filter; keep only a tenth of the names,
+    # closer to the fraction of stream messages that match a census name.
+    sample = set(sorted(names)[::10])
+    full_rate, fast_rate, kept = benchmark(lines, lambda name: name in sample)
+    print('%d tweets, %.0f%% kept' % (len(lines), 100 * kept))
+    print('full decode: %8.0f tweets/second' % full_rate)
+    print('pre-filter:  %8.0f tweets/second (%.1fx)' % (fast_rate, fast_rate / full_rate))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
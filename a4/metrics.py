@@ -0,0 +1,186 @@
+"""
+Request metrics.
+
+Counters, gauges and latency histograms labeled by resource, shared by every
+thread of a run. The request path (fetch.py) records the latency, status and
+size of each request, the retries and the time spent sleeping for rate limits;
+the stream reader (lazyjson.py) records the messages and bytes read and the time
+spent parsing them. Metrics can be written as a JSON snapshot or in the
+Prometheus text format, served over HTTP, and printed as a summary table.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+import time
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+PREFIX = 'twitter_'
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Metrics(object):
+    """
+    A thread safe registry of metrics. Each metric has a name and labels.
+
+    >>> metrics = Metrics()
+    >>> metrics.inc('requests_total', resource='friends/ids', status=200)
+    >>> metrics.observe('request_seconds', 0.07, resource='friends/ids')
+    >>> metrics.set('rate_limit_remaining', 14, resource='friends/ids')
+    >>> print(metrics.to_prometheus())  # doctest: +ELLIPSIS
+    # TYPE twitter_rate_limit_remaining gauge
+    twitter_rate_limit_remaining{resource="friends/ids"} 14
+    # TYPE twitter_request_seconds histogram
+    twitter_request_seconds_bucket{le="0.01",resource="friends/ids"} 0
+    twitter_request_seconds_bucket{le="0.05",resource="friends/ids"} 0
+    twitter_request_seconds_bucket{le="0.1",resource="friends/ids"} 1
+    ...
+    twitter_request_seconds_bucket{le="+Inf",resource="friends/ids"} 1
+    twitter_request_seconds_sum{resource="friends/ids"} 0.07
+    twitter_request_seconds_count{resource="friends/ids"} 1
+    # TYPE twitter_requests_total counter
+    twitter_requests_total{resource="friends/ids",status="200"} 1
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """ Add value to a counter. """
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """ Set a gauge. """
+        with self.lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name, seconds, **labels):
+        """ Add a duration to a histogram. """
+        key = (name, _labels(labels))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = {'counts': [0] * len(self.buckets), 'sum': 0., 'count': 0}
+            histogram = self.histograms[key]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def snapshot(self):
+        """ Return all the metrics as a JSON serializable dict. """
+        with self.lock:
+            return {
+                'time': time.time(),
+                'counters': [{'name': n, 'labels': dict(l), 'value': v} for (n, l), v in sorted(self.counters.items())],
+                'gauges': [{'name': n, 'labels': dict(l), 'value': v} for (n, l), v in sorted(self.gauges.items())],
+                'histograms': [{'name': n, 'labels': dict(l), 'buckets': list(self.buckets),
+                                'counts': list(h['counts']), 'sum': h['sum'], 'count': h['count']}
+                               for (n, l), h in sorted(self.histograms.items())],
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=1)
+
+    def to_prometheus(self):
+        """ Return the metrics in the Prometheus text exposition format. """
+        def line(name, labels, value):
+            text = ','.join('%s="%s"' % (k, v) for k, v in sorted(labels.items()))
+            return '%s%s%s %s' % (PREFIX, name, '{%s}' % text if text else '', value)
+        snapshot = self.snapshot()
+        metrics = [(m['name'], 'counter', m) for m in snapshot['counters']] + \
+                  [(m['name'], 'gauge', m) for m in snapshot['gauges']] + \
+                  [(m['name'], 'histogram', m) for m in snapshot['histograms']]
+        lines = []
+        typed = set()
+        for name, kind, m in sorted(metrics, key=lambda x: x[0]):
+            if name not in typed:
+                lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+                typed.add(name)
+            if kind != 'histogram':
+                lines.append(line(name, m['labels'], m['value']))
+                continue
+            for bound, count in zip(m['buckets'], m['counts']):
+                lines.append(line(name + '_bucket', dict(m['labels'], le=bound), count))
+            lines.append(line(name + '_bucket', dict(m['labels'], le='+Inf'), m['count']))
+            lines.append(line(name + '_sum', m['labels'], round(m['sum'], 6)))
+            lines.append(line(name + '_count', m['labels'], m['count']))
+        return '\n'.join(lines)
+
+    def write(self, filename):
+        """ Write the metrics to filename, in the Prometheus format if it ends with .prom, else as JSON. """
+        text = self.to_prometheus() + '\n' if filename.endswith('.prom') else self.to_json()
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        with open(filename + '.tmp', 'w') as fout:
+            fout.write(text)
+        os.replace(filename + '.tmp', filename)
+
+    def serve(self, port):
+        """ Serve the metrics in the Prometheus format on http://127.0.0.1:port/metrics,
+        from a background thread. Returns the server; call shutdown() to stop it.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = (metrics.to_prometheus() + '\n').encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def summary(self):
+        """ Return a table with, per resource, the requests, errors, retries, bytes,
+        the mean and total request time, and the time spent sleeping and parsing.
+        """
+        totals = {}
+        snapshot = self.snapshot()
+        for m in snapshot['counters'] + snapshot['histograms']:
+            resource = m['labels'].get('resource')
+            if resource is None:
+                continue
+            row = totals.setdefault(resource, dict.fromkeys(('requests', 'errors', 'retries', 'cached', 'bytes',
+                                                             'latency', 'sleep', 'parse'), 0))
+            name = m['name']
+            if name == 'requests_total':
+                row['requests'] += m['value']
+                if str(m['labels'].get('status')) not in ('200', '401', '404'):
+                    row['errors'] += m['value']
+            elif name == 'cache_hits_total':
+                row['cached'] += m['value']
+            elif name in ('retries_total', 'bytes_total', 'sleep_seconds_total', 'parse_seconds_total'):
+                row[name.split('_')[0]] += m['value']
+            elif name == 'request_seconds':
+                row['latency'] += m['sum']
+        header = '%-18s %9s %7s %7s %7s %12s %9s %9s %9s %9s' % (
+            'resource', 'requests', 'errors', 'retries', 'cached', 'bytes', 'mean s', 'request s', 'sleep s', 'parse s')
+        lines = [header, '-' * len(header)]
+        for resource, row in sorted(totals.items()):
+            mean = row['latency'] / row['requests'] if row['requests'] else 0.
+            lines.append('%-18s %9d %7d %7d %7d %12d %9.3f %9.1f %9.1f %9.1f' % (
+                resource, row['requests'], row['errors'], row['retries'], row['cached'], row['bytes'],
+                mean, row['latency'], row['sleep'], row['parse']))
+        return '\n'.join(lines)
+
+
+# The registry used by fetch.py and lazyjson.py.
+METRICS = Metrics()
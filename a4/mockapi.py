@@ -0,0 +1,413 @@
+"""
+Local Twitter API stand-in.
+
+A small HTTP server emulating the parts of the Twitter API used by collect.py:
+users/lookup, friends/ids and followers/ids (with cursors), the rate limit
+headers of each endpoint and the statuses/filter stream. Its data is seeded from
+recorded fixtures (the user store and tweet pickles under data/collect, the
+response cache of cache.py) or from a synthetic generator, and it can add latency
+and inject errors. LocalTwitterAPI is the matching client, usable anywhere a
+TwitterAPI object is.
+
+Run `python mockapi.py` to benchmark the collection throughput against it.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+import json
+import math
+import os
+import pickle
+import random
+import sys
+import threading
+import time
+
+import requests
+
+from cache import cache_key
+from fetch import RATE_LIMITS, RATE_WINDOW, DEFAULT_RATE_LIMIT
+from userstore import read_user_store
+
+
+FIRST_NAMES = ['james', 'mary', 'john', 'patricia', 'robert', 'jennifer', 'michael', 'linda', 'satoshi', 'vitalik']
+
+
+def synthetic_user(user_id, friends_count=0, followers_count=0):
+    """ Return a minimal user object for an id.
+
+    >>> synthetic_user(42)['screen_name']
+    'user42'
+    """
+    return {'id': user_id, 'id_str': str(user_id), 'screen_name': 'user%d' % user_id,
+            'name': 'User %d' % user_id, 'description': '', 'protected': False,
+            'friends_count': friends_count, 'followers_count': followers_count}
+
+
+def synthetic_tweet(tweet_id, rng):
+    """ Return a minimal tweet object, written by a user with a random first name. """
+    user_id = rng.randrange(1, 10 ** 6)
+    user = synthetic_user(user_id)
+    user['name'] = '%s %s' % (rng.choice(FIRST_NAMES).title(), user['name'])
+    return {'id': tweet_id, 'id_str': str(tweet_id), 'text': 'tweet %d about #ethereum' % tweet_id,
+            'lang': 'en', 'user': user}
+
+
+class MockData(object):
+    """
+    The users, follow lists and tweets served by the stand-in.
+
+    Params:
+        users....List of user dicts, each with 'friends' and 'followers' id lists.
+        tweets...List of tweet dicts for the statuses/filter stream.
+    """
+
+    def __init__(self, users, tweets=()):
+        self.users = {}
+        self.screen_names = {}
+        self.friends = {}
+        self.followers = {}
+        for u in users:
+            u = dict(u)
+            self.friends[u['id']] = list(u.pop('friends', []))
+            self.followers[u['id']] = list(u.pop('followers', []))
+            u['friends_count'] = len(self.friends[u['id']])
+            u['followers_count'] = len(self.followers[u['id']])
+            self.users[u['id']] = u
+            self.screen_names[u['screen_name'].lower()] = u['id']
+        self.tweets = list(tweets)
+        # Recorded responses by cache key, served as they are (see load_cache).
+        self.recorded = {}
+
+    @classmethod
+    def from_fixtures(cls, users_dir='data/collect/users',
+                      tweets_file='data/collect/real-time-tweets-test-dataset.pkl'):
+        """ Load the users collected by a previous run, from its user store (see userstore.py),
+        and recorded tweets.
+
+        >>> import tempfile
+        >>> from userstore import write_user_store
+        >>> users_dir = os.path.join(tempfile.mkdtemp(), 'users')
+        >>> write_user_store([{'id': 1, 'screen_name': 'alice', 'friends': [3, 2], 'followers': [3]}], users_dir)
+        >>> data = MockData.from_fixtures(users_dir, None)
+        >>> data.friends, data.users[1]['friends_count'], data.tweets
+        ({1: [2, 3]}, 2, [])
+        """
+        users = read_user_store(users_dir)
+        for u in users:
+            # Plain ints, to be sent as JSON.
+            for key in ('friends', 'followers'):
+                if key in u:
+                    u[key] = [int(i) for i in u[key]]
+        tweets = pickle.load(open(tweets_file, 'rb')) if tweets_file and os.path.exists(tweets_file) else []
+        return cls(users, tweets)
+
+    @classmethod
+    def synthetic(cls, n_users=100, n_friends=5000, n_followers=5000, pool_size=50000, n_tweets=1000, seed=1234):
+        """ Generate n_users accounts (user1000, user1001, ...) whose friends and followers
+        are drawn from a shared pool of ids, so that they overlap.
+        """
+        rng = random.Random(seed)
+        pool = range(10 ** 6, 10 ** 6 + pool_size)
+        users = []
+        for i in range(n_users):
+            u = synthetic_user(1000 + i)
+            u['friends'] = rng.sample(pool, min(n_friends, pool_size))
+            u['followers'] = rng.sample(pool, min(n_followers, pool_size))
+            users.append(u)
+        tweets = [synthetic_tweet(10 ** 15 + i, rng) for i in range(n_tweets)]
+        return cls(users, tweets)
+
+    def load_cache(self, directory='data/cache'):
+        """ Serve the responses recorded in a response cache (see cache.py) as they are. """
+        for root, dirs, files in os.walk(directory):
+            for filename in files:
+                if filename.endswith('.json'):
+                    with open(os.path.join(root, filename)) as fin:
+                        entry = json.load(fin)
+                    self.recorded[cache_key(entry['resource'], dict(entry['params']))] = entry
+        return self
+
+    def user_id(self, params):
+        """ Return the id of the user named by the screen_name or user_id param. """
+        if 'user_id' in params:
+            return int(params['user_id'])
+        name = params.get('screen_name', '').lower()
+        if name in self.screen_names:
+            return self.screen_names[name]
+        if name.startswith('user') and name[4:].isdigit():
+            return int(name[4:])
+
+    def user(self, user_id):
+        """ Return the user object of an id; ids only seen in follow lists get a synthetic one. """
+        return self.users.get(user_id) or synthetic_user(user_id)
+
+
+class MockTwitterServer(object):
+    """
+    Serve MockData over HTTP on a background thread.
+
+    Params:
+        data..........The MockData to serve.
+        port..........Port to listen to; 0 picks a free one.
+        latency.......Seconds to wait before answering each request.
+        error_rate....Fraction of requests answered 503 (Over capacity).
+        limits........Dict from resource to calls allowed per window and credential.
+        window........Seconds of each rate limit window.
+        page_size.....Maximum ids per page of friends/ids and followers/ids.
+        stream_limit..Number of tweets sent on the stream before closing it; tweets
+                      are repeated with new ids when there are not enough.
+        seed..........Seed of the error injection.
+
+    >>> with MockTwitterServer(MockData.synthetic(n_users=2, n_friends=3, n_followers=3)) as server:
+    ...     twitter = LocalTwitterAPI(server.url)
+    ...     r = twitter.request('friends/ids', {'screen_name': 'user1000'})
+    ...     r.status_code, len(r.json()['ids']), r.headers['x-rate-limit-remaining']
+    (200, 3, '14')
+    """
+
+    def __init__(self, data, port=0, latency=0., error_rate=0., limits=RATE_LIMITS, window=RATE_WINDOW,
+                 page_size=5000, stream_limit=None, seed=0):
+        self.data = data
+        self.latency = latency
+        self.error_rate = error_rate
+        self.limits = limits
+        self.window = window
+        self.page_size = page_size
+        self.stream_limit = stream_limit
+        self.rng = random.Random(seed)
+        self.windows = {}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def rate_limit(self, credential, resource):
+        """ Count a call against the window of this credential and resource.
+        Returns:
+          The rate limit headers, and True if the call is over the limit.
+        """
+        limit = self.limits.get(resource, DEFAULT_RATE_LIMIT)
+        now = time.time()
+        with self.lock:
+            remaining, reset = self.windows.get((credential, resource), (limit, now + self.window))
+            if now >= reset:
+                remaining, reset = limit, now + self.window
+            exceeded = remaining <= 0
+            remaining = max(remaining - 1, 0)
+            self.windows[(credential, resource)] = (remaining, reset)
+        headers = {'x-rate-limit-limit': str(limit), 'x-rate-limit-remaining': str(remaining),
+                   'x-rate-limit-reset': str(int(math.ceil(reset)))}
+        return headers, exceeded
+
+    def inject_error(self):
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+    def answer(self, resource, params):
+        """ Compute the status code and JSON body of a REST request. """
+        recorded = self.data.recorded.get(cache_key(resource, params))
+        if recorded is not None:
+            return recorded['status_code'], json.loads(recorded['text'])
+        if resource == 'users/lookup':
+            if 'user_id' in params:
+                ids = [int(i) for i in params['user_id'].split(',') if i]
+            else:
+                ids = [self.data.user_id({'screen_name': s}) for s in params.get('screen_name', '').split(',') if s]
+            if len(ids) > 100:
+                return 403, {'errors': [{'code': 18, 'message': 'Too many terms specified in query.'}]}
+            users = [self.data.user(i) for i in ids if i is not None]
+            if not users:
+                return 404, {'errors': [{'code': 17, 'message': 'No user matches for specified terms.'}]}
+            return 200, users
+        if resource in ('friends/ids', 'followers/ids'):
+            user_id = self.data.user_id(params)
+            if user_id is None:
+                return 404, {'errors': [{'code': 34, 'message': 'Sorry, that page does not exist.'}]}
+            if self.data.user(user_id).get('protected'):
+                return 401, {'request': resource, 'error': 'Not authorized.'}
+            ids = (self.data.friends if resource == 'friends/ids' else self.data.followers).get(user_id, [])
+            start = max(int(params.get('cursor', -1)), 0)
+            count = min(int(params.get('count', self.page_size)), self.page_size)
+            next_cursor = start + count if start + count < len(ids) else 0
+            return 200, {'ids': ids[start:start + count], 'next_cursor': next_cursor,
+                         'next_cursor_str': str(next_cursor), 'previous_cursor': 0, 'previous_cursor_str': '0'}
+        return 404, {'errors': [{'code': 34, 'message': 'Sorry, that page does not exist.'}]}
+
+    def stream(self):
+        """ Generate the tweets sent on the statuses/filter stream. """
+        tweets = self.data.tweets
+        limit = len(tweets) if self.stream_limit is None else self.stream_limit
+        for i in range(limit if tweets else 0):
+            tweet = tweets[i % len(tweets)]
+            if i >= len(tweets):
+                tweet = dict(tweet, id=tweet['id'] + i, id_str=str(tweet['id'] + i))
+            yield tweet
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, a keep-alive client
+    # waits for a delayed ACK on every response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, params):
+        mock = self.server.mock
+        url = urlparse(self.path)
+        params.update(parse_qsl(url.query))
+        resource = url.path.lstrip('/')
+        if resource.startswith('1.1/'):
+            resource = resource[len('1.1/'):]
+        if resource.endswith('.json'):
+            resource = resource[:-len('.json')]
+        if mock.latency:
+            time.sleep(mock.latency)
+        if mock.inject_error():
+            return self._send(503, {'errors': [{'code': 130, 'message': 'Over capacity'}]})
+        if resource == 'statuses/filter':
+            return self._stream(mock)
+        credential = self.headers.get('Authorization', 'anonymous')
+        headers, exceeded = mock.rate_limit(credential, resource)
+        if exceeded:
+            return self._send(429, {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]}, headers)
+        status, body = mock.answer(resource, params)
+        self._send(status, body, headers)
+
+    def _stream(self, mock):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for tweet in mock.stream():
+                line = json.dumps(tweet).encode('utf-8') + b'\r\n'
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def do_GET(self):
+        self._handle({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._handle(dict(parse_qsl(self.rfile.read(length).decode('utf-8'))))
+
+
+class LocalResponse(object):
+    """ Wrap a requests response with the attributes of a TwitterResponse. """
+
+    def __init__(self, response, is_stream=False):
+        self.response = response
+        self.is_stream = is_stream
+
+    @property
+    def status_code(self):
+        return self.response.status_code
+
+    @property
+    def headers(self):
+        return self.response.headers
+
+    @property
+    def text(self):
+        return self.response.text
+
+    def json(self):
+        return self.response.json()
+
+    def __iter__(self):
+        if self.is_stream:
+            for line in self.response.iter_lines():
+                if line:
+                    yield json.loads(line)
+        else:
+            data = self.json()
+            for item in (data if isinstance(data, list) else [data]):
+                yield item
+
+
+class LocalTwitterAPI(object):
+    """
+    A client for MockTwitterServer with the `request` method of TwitterAPI.
+
+    Params:
+        url..........Base url of the server.
+        credential...Name sent as credential; each one has its own rate limit windows.
+    """
+
+    def __init__(self, url, credential='anonymous'):
+        self.url = url
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = credential
+
+    def request(self, resource, params=None):
+        url = '%s/1.1/%s.json' % (self.url, resource)
+        params = {k: ','.join(str(i) for i in v) if isinstance(v, (list, tuple)) else v
+                  for k, v in (params or {}).items()}
+        if resource == 'statuses/filter':
+            return LocalResponse(self.session.post(url, data=params, stream=True), is_stream=True)
+        return LocalResponse(self.session.get(url, params=params))
+
+
+def benchmark(data, workers=(1, 2, 4, 8), latency=0.05, credentials=1):
+    """ Time the friend and follower collection of every user of data against a
+    stand-in server with the given latency, for each number of concurrent workers.
+    Returns:
+      A list of (workers, seconds, requests per second) tuples.
+    """
+    from fetch import RequestScheduler
+    from paginate import fetch_ids
+    limits = {resource: 10 ** 6 for resource in RATE_LIMITS}
+    screen_names = sorted(u['screen_name'] for u in data.users.values())
+    results = []
+    for n in workers:
+        with MockTwitterServer(data, latency=latency, limits=limits, page_size=1000) as server:
+            twitter = RequestScheduler([LocalTwitterAPI(server.url, 'credential%d' % i) for i in range(credentials)])
+            start = time.time()
+            ids = fetch_ids(twitter, 'friends/ids', screen_names, max_workers=n)
+            ids.update(fetch_ids(twitter, 'followers/ids', screen_names, max_workers=n))
+            elapsed = time.time() - start
+        requests_made = sum(max(1, math.ceil(len(ids[i]) / 1000)) for ids in (data.friends, data.followers)
+                            for i in data.users)
+        results.append((n, elapsed, requests_made / elapsed))
+    return results
+
+
+def main(args):
+    data = MockData.synthetic(n_users=int(args[1]) if len(args) > 1 else 20)
+    print('Benchmarking friends/ids and followers/ids for %d users (50ms latency):' % len(data.users))
+    for n, elapsed, rate in benchmark(data):
+        print('%2d workers: %6.2f seconds, %6.1f requests/second' % (n, elapsed, rate))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
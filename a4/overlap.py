@@ -0,0 +1,146 @@
+"""
+All-pairs friend overlap.
+
+The friend lists of n users are put once into a sparse n x m incidence matrix
+(one row per user, one column per account followed). The product of the matrix
+with its transpose gives the number of accounts every pair of users follows in
+common, which can be normalized into a Jaccard or cosine similarity. The
+product is computed a block of rows at a time, so the pairs can be streamed
+to a file, or reduced to the top k of each user, for thousands of users with
+tens of thousands of friends each.
+
+Run `python overlap.py` to write the overlaps of the collected users to
+data/cluster/overlap.tsv and print the closest users of each seed account.
+"""
+import heapq
+import sys
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+METRICS = ('count', 'jaccard', 'cosine')
+
+
+def incidence_matrix(id_lists):
+    """ Return the sparse users x accounts matrix, with a 1 where a user follows an account,
+    and the account id of each column.
+
+    >>> X, ids = incidence_matrix([[3, 1], [1, 2]])
+    >>> X.toarray().tolist(), ids.tolist()
+    ([[1, 0, 1], [1, 1, 0]], [1, 2, 3])
+    """
+    arrays = [np.unique(np.asarray(ids)) for ids in id_lists]
+    sizes = [len(a) for a in arrays]
+    if sum(sizes) == 0:
+        return csr_matrix((len(arrays), 0), dtype=np.int32), np.zeros(0, dtype=np.int64)
+    ids, columns = np.unique(np.concatenate(arrays), return_inverse=True)
+    indptr = np.zeros(len(arrays) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(sizes)
+    data = np.ones(len(columns), dtype=np.int32)
+    return csr_matrix((data, columns, indptr), shape=(len(arrays), len(ids))), ids
+
+
+def normalize(overlaps, sizes_a, sizes_b, metric='count'):
+    """ Turn overlap counts into the given metric.
+    Params:
+        overlaps....Array of the number of accounts in common of each pair.
+        sizes_a.....Array of the number of accounts of the first user of each pair.
+        sizes_b.....Array of the number of accounts of the second user of each pair.
+        metric......'count', 'jaccard' (common / union) or 'cosine' (common / sqrt(product of sizes)).
+
+    >>> normalize(np.array([2]), np.array([3]), np.array([4]), 'jaccard').tolist()
+    [0.4]
+    """
+    if metric == 'count':
+        return overlaps
+    overlaps = overlaps.astype(np.float64)
+    if metric == 'jaccard':
+        denominator = sizes_a + sizes_b - overlaps
+    elif metric == 'cosine':
+        denominator = np.sqrt(sizes_a.astype(np.float64) * sizes_b)
+    else:
+        raise ValueError('unknown metric %r, expected one of %s' % (metric, METRICS))
+    return np.divide(overlaps, denominator, out=np.zeros(len(overlaps)), where=denominator > 0)
+
+
+def iter_overlaps(id_lists, metric='count', min_overlap=1, block_size=1000):
+    """ Yield (i, j, score) for every pair of lists i < j with at least min_overlap ids
+    in common, a block of block_size rows at a time.
+
+    >>> sorted(iter_overlaps([[1, 2, 3], [2, 3, 4], [1, 2, 3], [9]]))
+    [(0, 1, 2), (0, 2, 3), (1, 2, 2)]
+    >>> [(i, j, round(s, 2)) for i, j, s in iter_overlaps([[1, 2, 3], [2, 3, 4]], 'jaccard')]
+    [(0, 1, 0.5)]
+    """
+    X, ids = incidence_matrix(id_lists)
+    XT = X.T.tocsr()
+    sizes = np.asarray(X.sum(axis=1)).ravel()
+    for start in range(0, X.shape[0], block_size):
+        block = (X[start:start + block_size] @ XT).tocoo()
+        rows = block.row + start
+        keep = (block.col > rows) & (block.data >= min_overlap)
+        rows, cols, overlaps = rows[keep], block.col[keep], block.data[keep]
+        order = np.lexsort((cols, rows))
+        rows, cols, overlaps = rows[order], cols[order], overlaps[order]
+        scores = normalize(overlaps, sizes[rows], sizes[cols], metric)
+        for i, j, score in zip(rows.tolist(), cols.tolist(), scores.tolist()):
+            yield i, j, score
+
+
+def top_k(names, id_lists, k=5, metric='count', min_overlap=1, block_size=1000):
+    """ Return a dict from each name to its k closest names, as (name, score) tuples,
+    highest score first (ties broken by name).
+
+    >>> top_k(['a', 'b', 'c'], [[1, 2, 3], [2, 3, 4], [3]], k=1)
+    {'a': [('b', 2)], 'b': [('a', 2)], 'c': [('a', 1)]}
+    >>> top_k(['x', 'abc', 'ab'], [[1, 2], [1], [2]], k=1)['x']
+    [('ab', 1)]
+    """
+    # The position of each name in alphabetical order, to break ties without comparing strings.
+    rank = [0] * len(names)
+    for r, i in enumerate(sorted(range(len(names)), key=lambda i: names[i])):
+        rank[i] = r
+    heaps = [[] for name in names]
+    for i, j, score in iter_overlaps(id_lists, metric, min_overlap, block_size):
+        for a, b in ((i, j), (j, i)):
+            # Keep the k largest (score, first name) in a min heap.
+            item = (score, -rank[b], b)
+            if len(heaps[a]) < k:
+                heapq.heappush(heaps[a], item)
+            elif item > heaps[a][0]:
+                heapq.heapreplace(heaps[a], item)
+    return dict((name, [(names[b], score) for score, _, b in sorted(heap, reverse=True)])
+                for name, heap in zip(names, heaps))
+
+
+def write_overlaps(names, id_lists, filename, metric='count', min_overlap=1, block_size=1000):
+    """ Stream every pair with at least min_overlap ids in common to a tab separated file.
+    Returns:
+      The number of pairs written.
+    """
+    count = 0
+    with open(filename, 'w') as fout:
+        fout.write('user1\tuser2\t%s\n' % metric)
+        for i, j, score in iter_overlaps(id_lists, metric, min_overlap, block_size):
+            fout.write('%s\t%s\t%s\n' % (names[i], names[j], score))
+            count += 1
+    return count
+
+
+def main(args):
+    from userstore import UserStore
+    metric = args[1] if len(args) > 1 else 'jaccard'
+    store = UserStore('data/collect/users')
+    names = store.column('screen_name')
+    friends = store.id_lists('friends')
+    count = write_overlaps(names, friends, 'data/cluster/overlap.tsv', metric)
+    print('%d pairs of %d users written to data/cluster/overlap.tsv' % (count, len(names)))
+    with open('data/collect/ethereum-accounts.txt') as fin:
+        seeds = set(l.strip() for l in fin)
+    for name, closest in sorted(top_k(names, friends, 3, metric).items()):
+        if name in seeds:
+            print('%s: %s' % (name, ', '.join('%s (%.3f)' % c for c in closest)))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
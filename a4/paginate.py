@@ -0,0 +1,163 @@
+"""
+Cursor pagination.
+
+Follow the `next_cursor` of cursored endpoints such as friends/ids and
+followers/ids, yielding one page of ids at a time. Each page can be written to a
+checkpoint directory, so a crash or a long rate limit stall resumes at the last
+cursor instead of starting over. The checkpoint of a list is removed once the
+list is complete, so the next fetch gets the list as it is then.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import shutil
+
+from fetch import rate_limited_request
+
+
+class PageError(IOError):
+    """ Raised when a page of a cursored resource cannot be fetched, so the ids
+    read so far are not the whole list.
+    """
+
+
+def _write_json(obj, filename):
+    """ Write obj to filename atomically, so a crash never leaves a half written file. """
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as fout:
+        json.dump(obj, fout)
+    os.replace(tmp, filename)
+
+
+def _read_json(filename):
+    with open(filename) as fin:
+        return json.load(fin)
+
+
+def checkpoint_path(checkpoint_dir, resource, key):
+    """ Return the directory holding the pages of one resource and key.
+
+    >>> checkpoint_path('data/collect/pages', 'followers/ids', 'ethereum')
+    'data/collect/pages/followers-ids/ethereum'
+    """
+    return os.path.join(checkpoint_dir, resource.replace('/', '-'), str(key))
+
+
+def iterate_cursor(twitter, resource, params, max_pages=None, checkpoint=None):
+    """ Request every page of a cursored resource, yielding the ids of each page as it arrives.
+
+    When checkpoint is given, each page is stored as page-N.json in that directory
+    together with a cursor.json file holding the next cursor. Pages already on disk
+    are yielded first, then the requests resume at the stored cursor. Once the last
+    page (or max_pages pages) has been yielded, the directory is removed.
+
+    Args:
+      twitter ..... A TwitterAPI object.
+      resource .... A cursored resource string, e.g. "followers/ids".
+      params ...... A parameter dict for the request, e.g., {'screen_name': 'ethereum', 'count': 5000}.
+      max_pages ... The maximum number of pages to yield, or None to follow the cursor to the end.
+      checkpoint .. Directory where pages and the cursor are stored, or None to keep nothing on disk.
+    Returns:
+      A generator of lists of ids, one per page. It yields nothing more once the
+      user is not found (404) or is protected (401).
+    Raises:
+      PageError if a request fails after its retries. The checkpoint is kept, so
+      the next call resumes at the failed page.
+
+    >>> import tempfile
+    >>> from mockapi import LocalTwitterAPI, MockData, MockTwitterServer
+    >>> data = MockData([{'id': 1, 'screen_name': 'alice', 'friends': [10, 11, 12, 13, 14]}])
+    >>> checkpoint = checkpoint_path(tempfile.mkdtemp(), 'friends/ids', 'alice')
+    >>> with MockTwitterServer(data, page_size=2) as server:
+    ...     twitter = LocalTwitterAPI(server.url)
+    ...     pages = iterate_cursor(twitter, 'friends/ids', {'screen_name': 'alice'}, checkpoint=checkpoint)
+    ...     first = next(pages)
+    ...     pages.close()  # e.g. a crash after the first page
+    ...     kept = sorted(os.listdir(checkpoint))
+    ...     resumed = list(iterate_cursor(twitter, 'friends/ids', {'screen_name': 'alice'}, checkpoint=checkpoint))
+    ...     calls = 15 - int(server.windows[('anonymous', 'friends/ids')][0])
+    ...     cut = list(iterate_cursor(twitter, 'friends/ids', {'screen_name': 'alice'}, max_pages=2))
+    Stopped friends/ids {'screen_name': 'alice'} after 2 pages, more ids remain
+    >>> first, kept, resumed, calls, os.path.exists(checkpoint)
+    ([10, 11], ['cursor.json', 'page-0.json'], [[10, 11], [12, 13], [14]], 3, False)
+    >>> cut
+    [[10, 11], [12, 13]]
+    """
+    cursor, pages = -1, 0
+    if checkpoint:
+        os.makedirs(checkpoint, exist_ok=True)
+        state_file = os.path.join(checkpoint, 'cursor.json')
+        if os.path.exists(state_file):
+            state = _read_json(state_file)
+            cursor = state['next_cursor']
+            for pages in range(state['pages']):
+                if max_pages is not None and pages >= max_pages:
+                    break
+                yield _read_json(os.path.join(checkpoint, 'page-%d.json' % pages))
+            pages = state['pages']
+    while cursor != 0 and (max_pages is None or pages < max_pages):
+        request = rate_limited_request(twitter, resource, dict(params, cursor=cursor))
+        if request is None:
+            raise PageError('%s %s failed at page %d' % (resource, params, pages))
+        if request.status_code != 200:
+            # Not found or protected: there is nothing (more) to read.
+            cursor = 0
+            break
+        response = request.json()
+        cursor = response['next_cursor']
+        if checkpoint:
+            _write_json(response['ids'], os.path.join(checkpoint, 'page-%d.json' % pages))
+            _write_json({'next_cursor': cursor, 'pages': pages + 1}, state_file)
+        pages += 1
+        yield response['ids']
+    if cursor != 0:
+        print('Stopped %s %s after %d pages, more ids remain' % (resource, params, pages))
+    if checkpoint:
+        shutil.rmtree(checkpoint, ignore_errors=True)
+
+
+def get_all_ids(twitter, resource, screen_name, max_pages=None, checkpoint_dir=None):
+    """ Return the ids of all pages of friends/ids or followers/ids for one user.
+    Args:
+      twitter .......... A TwitterAPI object.
+      resource ......... Either "friends/ids" or "followers/ids".
+      screen_name ...... A string of a Twitter screen name.
+      max_pages ........ The maximum number of pages of 5000 ids, or None for all of them.
+      checkpoint_dir ... Root directory for page checkpoints, or None to keep nothing on disk.
+    Returns:
+      A list of ints, one per id, sorted in ascending order.
+    Raises:
+      PageError if a page cannot be fetched (see iterate_cursor).
+    """
+    checkpoint = checkpoint_path(checkpoint_dir, resource, screen_name) if checkpoint_dir else None
+    ids = []
+    for page in iterate_cursor(twitter, resource, {'screen_name': screen_name, 'count': 5000},
+                               max_pages, checkpoint):
+        ids.extend(page)
+    return sorted(ids)
+
+
+def fetch_ids(twitter, resource, screen_names, max_workers=4, max_pages=None, checkpoint_dir=None):
+    """ Fetch all pages of the id list (friends/ids or followers/ids) of each screen name,
+    paginating several users concurrently.
+    Args:
+      twitter .......... A TwitterAPI object.
+      resource ......... Either "friends/ids" or "followers/ids".
+      screen_names ..... A list of screen name strings.
+      max_workers ...... The maximum number of concurrent requests.
+      max_pages ........ The maximum number of pages of 5000 ids per user, or None for all of them.
+      checkpoint_dir ... Root directory for page checkpoints, or None to keep nothing on disk.
+    Returns:
+      A dict from screen name to the sorted list of ids. Users not found (404) or
+      protected (401) map to an empty list, and users whose requests failed to None,
+      so callers can skip them or try them again.
+    """
+    def fetch(screen_name):
+        try:
+            return get_all_ids(twitter, resource, screen_name, max_pages, checkpoint_dir)
+        except PageError as e:
+            print('Skipping %s: %s' % (screen_name, e))
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(screen_names, executor.map(fetch, screen_names)))
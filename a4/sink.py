@@ -0,0 +1,162 @@
+"""
+Tweet sink.
+
+Tweets go through a bounded queue to a writer thread that appends them to
+compressed JSON lines segments (tweets-00000.jsonl.gz, tweets-00001.jsonl.gz, ...).
+Segments are flushed and fsynced periodically and rotated after a number of
+tweets, so memory stays flat whatever the number of tweets, and a crash loses at
+most the tweets written since the last flush.
+"""
+import glob
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+
+
+def segment_files(directory, prefix='tweets'):
+    """ Return the segment files of a directory, in the order they were written. """
+    return sorted(glob.glob(os.path.join(directory, '%s-*.jsonl.gz' % prefix)))
+
+
+def read_segments(directory, prefix='tweets'):
+    """ Read the tweets stored by a TweetSink, one at a time.
+    A segment cut short by a crash is read up to its last complete tweet.
+    Params:
+        directory....The directory of the segments.
+        prefix.......The prefix of the segment file names.
+    Returns:
+        A generator of tweet dicts, in the order they were written.
+    """
+    for filename in segment_files(directory, prefix):
+        try:
+            with gzip.open(filename, 'rt', encoding='utf-8') as fin:
+                for line in fin:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # Last line of a segment cut short by a crash.
+                        break
+        except (EOFError, zlib.error):
+            continue
+
+
+class SegmentWriter(object):
+    """
+    Append JSON records to gzip compressed segments, rotating to a new segment
+    every max_records records. Each flush ends with a gzip sync point, so
+    everything flushed can be read back even if the segment is never closed.
+
+    Params:
+        directory.......The directory of the segments. Writing continues after the
+                        segments already there.
+        prefix..........The prefix of the segment file names.
+        max_records.....The number of records per segment.
+        flush_every.....Flush and fsync after this many records...
+        flush_seconds...or after this many seconds, whichever comes first.
+    """
+
+    def __init__(self, directory, prefix='tweets', max_records=10000, flush_every=100, flush_seconds=5.):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_records = max_records
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        os.makedirs(directory, exist_ok=True)
+        self.segment = len(segment_files(directory, prefix))
+        self.fout = None
+        self.records = 0
+        self.unflushed = 0
+        self.flushed_at = time.time()
+
+    def _open(self):
+        filename = os.path.join(self.directory, '%s-%05d.jsonl.gz' % (self.prefix, self.segment))
+        self.fout = gzip.open(filename, 'ab')
+        self.segment += 1
+        self.records = 0
+
+    def write(self, record):
+        if self.fout is None:
+            self._open()
+        self.fout.write(json.dumps(record).encode('utf-8') + b'\n')
+        self.records += 1
+        self.unflushed += 1
+        if self.records >= self.max_records:
+            self.close()
+        elif self.unflushed >= self.flush_every or time.time() - self.flushed_at >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if self.fout is not None and self.unflushed:
+            self.fout.flush(zlib.Z_SYNC_FLUSH)
+            os.fsync(self.fout.fileno())
+        self.unflushed = 0
+        self.flushed_at = time.time()
+
+    def close(self):
+        if self.fout is not None:
+            self.flush()
+            self.fout.close()
+            self.fout = None
+
+
+class TweetSink(object):
+    """
+    Producer/consumer sink: put() hands a tweet to a bounded queue, and a writer
+    thread appends the queued tweets to a SegmentWriter. When the writer falls
+    behind, put() blocks instead of letting the queue grow.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> with TweetSink(directory, max_records=2) as sink:
+    ...     for i in range(5):
+    ...         sink.put({'id': i})
+    >>> [t['id'] for t in read_segments(directory)], len(segment_files(directory))
+    ([0, 1, 2, 3, 4], 3)
+    """
+
+    def __init__(self, directory, queue_size=1000, **writer_args):
+        self.writer = SegmentWriter(directory, **writer_args)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.count = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._consume, daemon=True)
+        self.thread.start()
+
+    def _consume(self):
+        while True:
+            tweet = self.queue.get()
+            if tweet is None:
+                break
+            # After an error keep draining the queue, so put() never blocks forever.
+            if self.error is None:
+                try:
+                    self.writer.write(tweet)
+                except Exception as e:
+                    self.error = e
+        try:
+            self.writer.close()
+        except Exception as e:
+            self.error = self.error or e
+
+    def put(self, tweet):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(tweet)
+        self.count += 1
+
+    def close(self):
+        """ Write the queued tweets, close the last segment and stop the writer thread. """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
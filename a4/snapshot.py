@@ -0,0 +1,224 @@
+"""
+Graph snapshots.
+
+A snapshot stores a CSRGraph (see csrgraph.py), the names of its nodes and
+any number of per node attributes (which nodes are labeled, the community of
+each node for each clustering algorithm, ...) in one file:
+
+    magic, format version, header length and header CRC32   (24 bytes)
+    header                  JSON: the numbers of nodes and edges, the creation
+                            time, and the name, dtype, offset, length and CRC32
+                            of every section
+    sections                each one a raw array, 64 byte aligned:
+                              indptr, indices       the CSR arrays
+                              labels.offsets, labels.data
+                                                    the UTF-8 bytes of the node
+                                                    names one after the other,
+                                                    and where each one starts
+                              attribute.<name>      one value per node
+
+Opening a snapshot reads the header only; every section is memory-mapped, so
+a graph of millions of edges opens at once, and one node name or attribute
+can be read without loading the others. Checksums are checked by verify().
+
+Run `python snapshot.py FILE` to verify a snapshot and print its header.
+"""
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from csrgraph import CSRGraph
+
+MAGIC = b'TWGRAPH\x00'
+SNAPSHOT_FORMAT = 1
+_PREFIX = struct.Struct('<8sIII4x')
+ALIGNMENT = 64
+
+
+def _align(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def _crc32(array):
+    return zlib.crc32(memoryview(np.ascontiguousarray(array)).cast('B'))
+
+
+def write_snapshot(filename, graph, attributes=None):
+    """ Write a CSRGraph and its node attributes to filename, replacing what was there.
+    The file is written next to it first, so readers never see half a snapshot.
+    Params:
+        filename......The snapshot file.
+        graph.........A CSRGraph.
+        attributes....A dict from attribute name to an array (or list) with one number
+                      or boolean per node.
+
+    >>> import tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'graph.snapshot')
+    >>> graph = CSRGraph.from_arrays(['alice', '12', 'bob'], [0, 2], [1, 1])
+    >>> write_snapshot(filename, graph, {'community': [0, 0, 1]})
+    >>> snapshot = read_snapshot(filename, verify=True)
+    >>> snapshot.label(2), snapshot.labels(), snapshot.attribute('community').tolist()
+    ('bob', ['alice', '12', 'bob'], [0, 0, 1])
+    >>> snapshot.graph().neighbor_ids(1).tolist(), snapshot.header['edges']
+    ([0, 2], 2)
+    """
+    labels = [label.encode('utf-8') for label in graph.labels]
+    label_offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+    label_offsets[1:] = np.cumsum([len(label) for label in labels])
+    sections = [('indptr', np.asarray(graph.indptr, dtype=np.int64)),
+                ('indices', np.asarray(graph.indices, dtype=np.int32)),
+                ('labels.offsets', label_offsets),
+                ('labels.data', np.frombuffer(b''.join(labels), dtype=np.uint8))]
+    for name, values in sorted((attributes or {}).items()):
+        values = np.asarray(values)
+        if len(values) != graph.number_of_nodes():
+            raise ValueError('attribute %r has %d values for %d nodes' % (name, len(values), graph.number_of_nodes()))
+        sections.append(('attribute.' + name, values))
+    offsets, entries, end = [], [], 0
+    for name, array in sections:
+        offsets.append(end)
+        entries.append({'name': name, 'dtype': array.dtype.str, 'count': len(array), 'crc32': _crc32(array)})
+        end += _align(array.nbytes)
+    header = {'nodes': graph.number_of_nodes(), 'edges': graph.number_of_edges(),
+              'created': time.time(), 'sections': entries}
+    # The header holds the offsets of the sections, which come after it: move them
+    # until the header fits before the first one.
+    start = 0
+    while True:
+        for entry, offset in zip(entries, offsets):
+            entry['offset'] = start + offset
+        data = json.dumps(header).encode('utf-8')
+        if _align(_PREFIX.size + len(data)) <= start:
+            break
+        start = _align(_PREFIX.size + len(data))
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename + '.tmp', 'wb') as fout:
+        fout.write(_PREFIX.pack(MAGIC, SNAPSHOT_FORMAT, len(data), zlib.crc32(data)))
+        fout.write(data)
+        for entry, (name, array) in zip(entries, sections):
+            fout.write(b'\x00' * (entry['offset'] - fout.tell()))
+            fout.write(np.ascontiguousarray(array).tobytes())
+    os.replace(filename + '.tmp', filename)
+
+
+class GraphSnapshot(object):
+    """
+    A snapshot opened for reading. Only the header is read; the sections are
+    memory-mapped when first used.
+
+    Params:
+        filename....The snapshot file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fin:
+            prefix = fin.read(_PREFIX.size)
+            if len(prefix) < _PREFIX.size or prefix[:len(MAGIC)] != MAGIC:
+                raise ValueError('%s is not a graph snapshot' % filename)
+            _, version, length, crc = _PREFIX.unpack(prefix)
+            if version != SNAPSHOT_FORMAT:
+                raise ValueError('%s has snapshot format %d, expected %d' % (filename, version, SNAPSHOT_FORMAT))
+            data = fin.read(length)
+        if zlib.crc32(data) != crc:
+            raise ValueError('%s has a corrupt header' % filename)
+        self.header = json.loads(data.decode('utf-8'))
+        self.sections = dict((entry['name'], entry) for entry in self.header['sections'])
+        self._arrays = {}
+        self._labels = None
+
+    def _section(self, name):
+        if name not in self._arrays:
+            entry = self.sections[name]
+            if entry['count'] == 0:
+                self._arrays[name] = np.zeros(0, dtype=entry['dtype'])
+            else:
+                self._arrays[name] = np.memmap(self.filename, dtype=entry['dtype'], mode='r',
+                                               offset=entry['offset'], shape=(entry['count'],))
+        return self._arrays[name]
+
+    def verify(self):
+        """ Check every section against its checksum; raise a ValueError if one does not match. """
+        for name, entry in self.sections.items():
+            if _crc32(self._section(name)) != entry['crc32']:
+                raise ValueError('%s: section %s does not match its checksum' % (self.filename, name))
+
+    def label(self, i):
+        """ Return the name of node i, without decoding the others. """
+        offsets = self._section('labels.offsets')
+        return self._section('labels.data')[offsets[i]:offsets[i + 1]].tobytes().decode('utf-8')
+
+    def labels(self):
+        """ Return the list of all the node names. """
+        if self._labels is None:
+            data = self._section('labels.data').tobytes()
+            offsets = self._section('labels.offsets').tolist()
+            if data.isascii():
+                # Byte offsets are character offsets: decode once and slice.
+                data = data.decode('ascii')
+                self._labels = [data[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+            else:
+                self._labels = [data[a:b].decode('utf-8') for a, b in zip(offsets[:-1], offsets[1:])]
+        return self._labels
+
+    def graph(self):
+        """ Return the CSRGraph, over the memory-mapped arrays. """
+        return CSRGraph(self._section('indptr'), self._section('indices'), self.labels())
+
+    def attribute_names(self):
+        return sorted(name[len('attribute.'):] for name in self.sections if name.startswith('attribute.'))
+
+    def attribute(self, name):
+        """ Return the array of the values of a node attribute. """
+        return self._section('attribute.' + name)
+
+    def attributes(self):
+        """ Return a dict from every attribute name to its array. """
+        return dict((name, self.attribute(name)) for name in self.attribute_names())
+
+
+def read_snapshot(filename, verify=False):
+    """ Open a snapshot. If verify is True, also check the checksums of all its sections. """
+    snapshot = GraphSnapshot(filename)
+    if verify:
+        snapshot.verify()
+    return snapshot
+
+
+def set_attributes(filename, node_values, default=-1):
+    """ Add node attributes to a snapshot, or replace them.
+    Params:
+        filename.......The snapshot file.
+        node_values....A dict from attribute name to a dict from node name to value,
+                       e.g. the community of each node.
+        default........The value of the nodes missing from a dict.
+    """
+    snapshot = read_snapshot(filename, verify=True)
+    graph = snapshot.graph()
+    index = dict(zip(graph.labels, range(len(graph.labels))))
+    attributes = dict((name, np.array(values)) for name, values in snapshot.attributes().items())
+    for name, values in node_values.items():
+        array = np.full(len(index), default, dtype=np.int32)
+        for node, value in values.items():
+            array[index[node]] = value
+        attributes[name] = array
+    write_snapshot(filename, graph, attributes)
+
+
+def main(args):
+    snapshot = read_snapshot(args[1], verify=True)
+    header = snapshot.header
+    print('%s: format %d, %d nodes, %d edges, written %s' % (
+        args[1], SNAPSHOT_FORMAT, header['nodes'], header['edges'],
+        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(header['created']))))
+    for entry in header['sections']:
+        print('  %-28s %8s %12d values at %d' % (entry['name'], entry['dtype'], entry['count'], entry['offset']))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
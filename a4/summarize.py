@@ -1,20 +1,39 @@
 """
 Summarize data.
+
+The three stages run in this process, one after the other, so they share the
+imports and the Twitter connections of the run (see client.py).
 """
-import os, sys
+import sys
+import traceback
 
-def main(args):
-	print("SUMMARY FOR collect.py:")
-	os.system('python collect.py')
+import classify
+import cluster
+import collect
+
+
+def run_stage(name, stage, *args):
+	""" Run the main function of a stage. Like a separate process, a failed stage
+	does not stop the next ones. """
+	print("SUMMARY FOR %s:" % name)
+	try:
+		stage(*args)
+	except Exception:
+		traceback.print_exc()
 	print("\n\n")
-	print("SUMMARY FOR cluster.py:")
+
+
+def main(args):
+	if '--offline' in args:
+		# Replay the collection from the response cache.
+		run_stage('collect.py', collect.main, ['collect.py', '--offline'])
+		args = [arg for arg in args if arg != '--offline']
+	else:
+		run_stage('collect.py', collect.main, ['collect.py'])
 	if len(args) > 1:
-		#arg = 'python cluster.py %s' 
-		os.system('python cluster.py %s' % args[1])
+		run_stage('cluster.py', cluster.main, ['cluster.py', args[1]])
 	else:
-		os.system('python cluster.py')
-	print("\n\n")
-	print("SUMMARY FOR classify.py:")
-	os.system('python classify.py')
+		run_stage('cluster.py', cluster.main, ['cluster.py'])
+	run_stage('classify.py', classify.main)
 if __name__ == "__main__":
     main(sys.argv)
@@ -0,0 +1,162 @@
+"""
+Columnar user store.
+
+The users collected are stored column by column in a directory:
+
+    meta.json                    the number of users and the kind of each column
+    <field>.npy                  a numeric or boolean profile field, one value per user
+    <field>.data, <field>.offsets.npy
+                                 a text field: the UTF-8 bytes of all the values one
+                                 after the other, and where each value starts
+                                 (other fields are stored the same way, as JSON text)
+    <list>.ids.npy, <list>.offsets.npy
+                                 an id list (friends, followers): the sorted ids of all
+                                 the users concatenated, and where each user's start
+
+Every file is memory-mapped on load, and a column is only read when it is used,
+so loading the ids and screen names does not touch the descriptions or the
+follower lists of anybody.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+from idlists import as_ids
+
+STORE_FORMAT = 1
+ID_LISTS = ('friends', 'followers')
+
+
+def _kind(values):
+    """ Return how a column of values is stored: 'bool', 'int', 'float', 'str' or 'json'.
+
+    >>> _kind([1, 2]), _kind([1, 2.5]), _kind([True, False]), _kind(['a', None]), _kind(['a', 'b'])
+    ('int', 'float', 'bool', 'json', 'str')
+    """
+    if all(isinstance(v, bool) for v in values):
+        return 'bool'
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return 'int'
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return 'float'
+    if all(isinstance(v, str) for v in values):
+        return 'str'
+    return 'json'
+
+
+def _concatenate(arrays, dtype):
+    """ Return the concatenation of arrays, and the offsets of each one (len(arrays) + 1 of them). """
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(a) for a in arrays])
+    data = np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype=dtype)
+    return data, offsets
+
+
+def write_user_store(users, directory):
+    """ Store a list of user dicts in directory, replacing what was there.
+    The store is written next to it first, so readers never see half a store.
+    """
+    tmp = directory.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    fields = sorted(set(k for u in users for k in u))
+    columns = {}
+    for field in fields:
+        values = [u.get(field) for u in users]
+        if field in ID_LISTS:
+            ids, offsets = _concatenate([as_ids(v if v is not None else []) for v in values], np.int64)
+            np.save(os.path.join(tmp, field + '.ids.npy'), ids)
+            np.save(os.path.join(tmp, field + '.offsets.npy'), offsets)
+            columns[field] = 'ids'
+            continue
+        kind = _kind(values)
+        if kind in ('bool', 'int', 'float'):
+            np.save(os.path.join(tmp, field + '.npy'), np.array(values, dtype={'bool': bool, 'int': np.int64,
+                                                                              'float': np.float64}[kind]))
+        else:
+            texts = [(v if kind == 'str' else json.dumps(v)).encode('utf-8') for v in values]
+            data, offsets = _concatenate([np.frombuffer(t, dtype=np.uint8) for t in texts], np.uint8)
+            data.tofile(os.path.join(tmp, field + '.data'))
+            np.save(os.path.join(tmp, field + '.offsets.npy'), offsets)
+        columns[field] = kind
+    with open(os.path.join(tmp, 'meta.json'), 'w') as fout:
+        json.dump({'format': STORE_FORMAT, 'count': len(users), 'columns': columns}, fout, indent=1)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(tmp, directory)
+
+
+class UserStore(object):
+    """
+    Read access to a store written by write_user_store.
+
+    >>> import tempfile
+    >>> directory = os.path.join(tempfile.mkdtemp(), 'users')
+    >>> write_user_store([{'id': 2, 'screen_name': 'b', 'friends': [5, 3], 'protected': False},
+    ...                   {'id': 1, 'screen_name': 'a', 'followers': [9], 'location': {'x': 1}}], directory)
+    >>> store = UserStore(directory)
+    >>> len(store), store.column('id').tolist(), store.column('screen_name')
+    (2, [2, 1], ['b', 'a'])
+    >>> store.ids('friends', 0).tolist(), store.ids('friends', 1).tolist(), store.column('location')
+    ([3, 5], [], [None, {'x': 1}])
+    >>> store.users(['screen_name', 'followers'])[1]['followers'].tolist()
+    [9]
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as fin:
+            meta = json.load(fin)
+        if meta['format'] != STORE_FORMAT:
+            raise ValueError('%s is a user store of format %s, not %s' % (directory, meta['format'], STORE_FORMAT))
+        self.count = meta['count']
+        self.columns = meta['columns']
+        self.cache = {}
+
+    def __len__(self):
+        return self.count
+
+    def _load(self, name):
+        if name not in self.cache:
+            path = os.path.join(self.directory, name)
+            if name.endswith('.data'):
+                size = os.path.getsize(path)
+                self.cache[name] = np.memmap(path, dtype=np.uint8, mode='r') if size else np.zeros(0, np.uint8)
+            else:
+                self.cache[name] = np.load(path, mmap_mode='r')
+        return self.cache[name]
+
+    def column(self, field):
+        """ Return a profile field of every user: an array for numeric and boolean
+        fields, a list of values for the others.
+        """
+        kind = self.columns[field]
+        if kind == 'ids':
+            return self.id_lists(field)
+        if kind in ('bool', 'int', 'float'):
+            return self._load(field + '.npy')
+        data, offsets = self._load(field + '.data'), self._load(field + '.offsets.npy')
+        texts = [bytes(data[offsets[i]:offsets[i + 1]]).decode('utf-8') for i in range(self.count)]
+        return texts if kind == 'str' else [json.loads(t) for t in texts]
+
+    def ids(self, field, i):
+        """ Return the sorted id array of list field (e.g. 'friends') of the i-th user, without copying it. """
+        offsets = self._load(field + '.offsets.npy')
+        return self._load(field + '.ids.npy')[offsets[i]:offsets[i + 1]]
+
+    def id_lists(self, field):
+        """ Return the id arrays of list field for every user. """
+        return [self.ids(field, i) for i in range(self.count)]
+
+    def users(self, fields=None):
+        """ Return user dicts with only the given fields (all of them by default). """
+        fields = sorted(self.columns) if fields is None else fields
+        columns = dict((f, self.column(f)) for f in fields)
+        return [dict((f, columns[f][i].item() if isinstance(columns[f], np.ndarray) else columns[f][i])
+                     for f in fields) for i in range(self.count)]
+
+
+def read_user_store(directory, fields=None):
+    """ Return the user dicts of a store, with only the given fields (see UserStore.users). """
+    return UserStore(directory).users(fields)
@@ -0,0 +1,341 @@
+"""
+Crawl workers.
+
+The collection can be split across processes (or machines sharing a directory)
+that take jobs from a shared SQLite job queue. A job is one request: a
+users/lookup batch, or one page of friends/ids or followers/ids. Each worker
+has its own credential set, so throughput grows with the number of credential
+sets. A worker claims a job for a lease of some seconds; a job whose worker
+dies is claimed again when its lease expires, and a job claimed too many times
+(bad credentials, a dead endpoint) is marked failed instead of being retried
+forever. A job is completed at most once: its result and the jobs that follow
+from it (the friends and followers pages of the users looked up, the next page
+of a list) are stored in one transaction, and only by the worker holding the
+lease.
+
+Run `python workers.py 4` to crawl the accounts of ethereum-accounts.txt with 4
+workers, or `python workers.py 4 --mock` to time 1 to 4 workers against the
+local stand-in API (see mockapi.py).
+"""
+import functools
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+from cache import normalize_params
+from fetch import LOOKUP_BATCH_SIZE, RATE_WINDOW, chunks, rate_limited_request
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+FAILED = 'failed'
+JOBS_FILE = 'data/collect/jobs.db'
+# Seconds a job stays claimed. A worker can wait up to a rate window for a call of
+# its credential set once it holds a job, so the lease must outlast that wait, or
+# another worker would claim the job and spend a second call on it.
+LEASE = 2 * RATE_WINDOW
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    resource TEXT NOT NULL,
+    params TEXT NOT NULL,
+    user_id INTEGER,
+    page INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    claimed_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    status_code INTEGER,
+    result TEXT,
+    UNIQUE (resource, params)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, claimed_at);
+"""
+
+
+class JobQueue(object):
+    """
+    Params:
+        filename.......The SQLite database shared by the workers.
+        lease..........Seconds a worker holds a job before others can claim it again.
+        max_attempts...The number of times a job is claimed before it is marked failed.
+
+    >>> queue = JobQueue(':memory:')
+    >>> queue.add('friends/ids', {'user_id': 1, 'cursor': -1}, user_id=1)
+    >>> job = queue.claim('a')
+    >>> job['params'], queue.claim('b')
+    ({'cursor': '-1', 'user_id': '1'}, None)
+    >>> queue.complete(job, 200, [2, 3], [('friends/ids', {'user_id': 1, 'cursor': 7}, 1, 1)])
+    True
+    >>> queue.complete(job, 200, [2, 3])
+    False
+    >>> queue.counts()
+    {'done': 1, 'pending': 1}
+
+    A job that keeps failing is given up after max_attempts claims:
+
+    >>> queue = JobQueue(':memory:', max_attempts=2)
+    >>> queue.add('users/lookup', {'screen_name': 'nobody'})
+    >>> queue.release(queue.claim('a'))
+    >>> queue.release(queue.claim('a'))
+    >>> queue.claim('a'), queue.counts(), queue.unfinished()
+    (None, {'failed': 1}, 0)
+    """
+
+    def __init__(self, filename=JOBS_FILE, lease=LEASE, max_attempts=5):
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.db = sqlite3.connect(filename, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def _insert(self, resource, params, user_id=None, page=0):
+        self.db.execute("INSERT OR IGNORE INTO jobs (resource, params, user_id, page) VALUES (?, ?, ?, ?)",
+                        (resource, json.dumps(normalize_params(params)), user_id, page))
+
+    def add(self, resource, params, user_id=None, page=0):
+        """ Queue a request, unless the same request is already queued or done. """
+        self._insert(resource, params, user_id, page)
+
+    def claim(self, worker):
+        """ Take the oldest pending job, or a job whose lease has expired. An expired
+        job already claimed max_attempts times is marked failed instead.
+        Returns:
+            A job dict (id, resource, params, user_id, page, attempts), or None if there is none.
+        """
+        now = time.time()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.execute("UPDATE jobs SET state = ? WHERE state = ? AND claimed_at < ? AND attempts >= ?",
+                            (FAILED, CLAIMED, now - self.lease, self.max_attempts))
+            row = self.db.execute("SELECT id, resource, params, user_id, page, attempts FROM jobs WHERE state = ? "
+                                  "OR (state = ? AND claimed_at < ?) ORDER BY id LIMIT 1",
+                                  (PENDING, CLAIMED, now - self.lease)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE jobs SET state = ?, worker = ?, claimed_at = ?, attempts = attempts + 1 "
+                                "WHERE id = ?",
+                                (CLAIMED, worker, now, row[0]))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return {'id': row[0], 'resource': row[1], 'params': dict(json.loads(row[2])),
+                'user_id': row[3], 'page': row[4], 'attempts': row[5] + 1, 'worker': worker, 'claimed_at': now}
+
+    def complete(self, job, status_code, result, followups=()):
+        """ Store the result of a claimed job and queue its follow-up jobs, given as
+        (resource, params, user_id, page) tuples.
+        Returns:
+            False, and stores nothing, if the lease of this worker was lost and
+            the job was claimed or completed by another one.
+        """
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            updated = self.db.execute("UPDATE jobs SET state = ?, status_code = ?, result = ? "
+                                      "WHERE id = ? AND state = ? AND worker = ? AND claimed_at = ?",
+                                      (DONE, status_code, json.dumps(result), job['id'], CLAIMED,
+                                       job['worker'], job['claimed_at'])).rowcount
+            if updated:
+                for followup in followups:
+                    self._insert(*followup)
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return updated == 1
+
+    def release(self, job):
+        """ Give a claimed job back to the queue, e.g. after a failed request, or mark
+        it failed if it was claimed max_attempts times.
+        """
+        self.db.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END "
+                        "WHERE id = ? AND state = ? AND worker = ? AND claimed_at = ?",
+                        (self.max_attempts, FAILED, PENDING, job['id'], CLAIMED, job['worker'], job['claimed_at']))
+
+    def unfinished(self):
+        """ Return the number of jobs pending or claimed. """
+        return self.db.execute("SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)", (PENDING, CLAIMED)).fetchone()[0]
+
+    def counts(self):
+        """ Return a dict from state to the number of jobs in that state. """
+        return dict(self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+    def results(self, resource):
+        """ Yield (user_id, page, status_code, result) for the completed jobs of a resource. """
+        for user_id, page, status_code, result in self.db.execute(
+                "SELECT user_id, page, status_code, result FROM jobs WHERE resource = ? AND state = ? "
+                "ORDER BY user_id, page", (resource, DONE)):
+            yield user_id, page, status_code, json.loads(result)
+
+    def close(self):
+        self.db.close()
+
+
+def add_lookups(queue, screen_names=(), ids=()):
+    """ Queue the users/lookup batches of some screen names and ids. """
+    for batch in chunks(sorted(screen_names), LOOKUP_BATCH_SIZE):
+        queue.add('users/lookup', {'screen_name': ','.join(batch)})
+    for batch in chunks(sorted(ids), LOOKUP_BATCH_SIZE):
+        queue.add('users/lookup', {'user_id': ','.join(str(i) for i in batch)})
+
+
+def followups(job, status_code, result, max_pages):
+    """ Return the jobs that follow from the result of a job: the first page of
+    friends and followers of each user looked up, or the next page of a list.
+    """
+    if status_code != 200:
+        return []
+    if job['resource'] == 'users/lookup':
+        return [(resource, {'user_id': u['id'], 'count': 5000, 'cursor': -1}, u['id'], 0)
+                for u in result if not u.get('protected') for resource in ('friends/ids', 'followers/ids')]
+    next_cursor = result['next_cursor']
+    if next_cursor and (max_pages is None or job['page'] + 1 < max_pages):
+        params = dict(job['params'], cursor=next_cursor)
+        return [(job['resource'], params, job['user_id'], job['page'] + 1)]
+    return []
+
+
+def run_worker(queue_file, make_twitter, name=None, max_pages=20, poll=1., lease=LEASE, max_attempts=5):
+    """ Claim and run jobs until the queue has no unfinished job left.
+    Params:
+        queue_file.....The SQLite job queue.
+        make_twitter...A function returning this worker's TwitterAPI object (or RequestScheduler).
+        name...........The name of the worker; defaults to host:pid.
+        max_pages......The maximum number of pages of 5000 ids per user, or None for all of them.
+        poll...........Seconds to wait when no job is pending but other workers are still busy.
+        lease..........Seconds this worker holds a job before others can claim it again.
+        max_attempts...The number of times a job is tried before it is marked failed.
+    Returns:
+        The number of jobs this worker completed.
+    """
+    name = name or '%s:%d' % (socket.gethostname(), os.getpid())
+    queue = JobQueue(queue_file, lease, max_attempts)
+    twitter = make_twitter()
+    completed = 0
+    while True:
+        job = queue.claim(name)
+        if job is None:
+            if not queue.unfinished():
+                break
+            time.sleep(poll)
+            continue
+        try:
+            response = rate_limited_request(twitter, job['resource'], job['params'])
+        except Exception as e:
+            print('%s: %s failed: %s' % (name, job['resource'], e))
+            response = None
+        if response is None:
+            queue.release(job)
+            if job['attempts'] >= max_attempts:
+                print('%s: giving up %s %s after %d attempts' % (name, job['resource'], job['params'], max_attempts))
+            time.sleep(poll)
+            continue
+        result = response.json() if response.status_code == 200 else []
+        if response.status_code == 200 and job['resource'] != 'users/lookup':
+            result = {'ids': result['ids'], 'next_cursor': result['next_cursor']}
+        if queue.complete(job, response.status_code, result, followups(job, response.status_code, result, max_pages)):
+            completed += 1
+    queue.close()
+    return completed
+
+
+def run_workers(queue_file, twitter_factories, max_pages=20):
+    """ Run one worker process per TwitterAPI factory, and wait for all of them. """
+    processes = [multiprocessing.Process(target=run_worker, args=(queue_file, factory),
+                                         kwargs={'max_pages': max_pages})
+                 for factory in twitter_factories]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+
+def assemble_users(queue):
+    """ Join the results of a finished crawl into user dicts with 'friends' and 'followers' lists.
+    Returns:
+        A list of user dicts, sorted by screen_name.
+    """
+    users = {}
+    for user_id, page, status_code, result in queue.results('users/lookup'):
+        for u in result:
+            u.setdefault('friends', [])
+            u.setdefault('followers', [])
+            users[u['id']] = u
+    for resource, key in (('friends/ids', 'friends'), ('followers/ids', 'followers')):
+        for user_id, page, status_code, result in queue.results(resource):
+            if status_code == 200 and user_id in users:
+                users[user_id][key].extend(result['ids'])
+    for u in users.values():
+        u['friends'].sort()
+        u['followers'].sort()
+    return sorted(users.values(), key=lambda u: u['screen_name'])
+
+
+def twitter_sections(config_file):
+    """ Return the names of the credential sections of a config file. """
+    import configparser
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    return [section for section in config.sections() if section.startswith('twitter')]
+
+
+def benchmark(n_workers, n_users=20, latency=0.02, limit=20, window=2.):
+    """ Time a crawl of synthetic users against the stand-in API with 1 to n_workers
+    workers, each with its own credential of limit calls per window seconds.
+    Returns:
+      A list of (workers, seconds, requests per second) tuples.
+    """
+    import tempfile
+    from mockapi import LocalTwitterAPI, MockData, MockTwitterServer
+    data = MockData.synthetic(n_users=n_users, n_friends=3000, n_followers=3000, pool_size=10000)
+    limits = {'users/lookup': limit, 'friends/ids': limit, 'followers/ids': limit}
+    results = []
+    for n in range(1, n_workers + 1):
+        with MockTwitterServer(data, latency=latency, limits=limits, window=window, page_size=1000) as server:
+            queue_file = os.path.join(tempfile.mkdtemp(), 'jobs.db')
+            queue = JobQueue(queue_file)
+            add_lookups(queue, screen_names=[u['screen_name'] for u in data.users.values()])
+            start = time.time()
+            run_workers(queue_file, [functools.partial(LocalTwitterAPI, server.url, 'credential%d' % i)
+                                     for i in range(n)])
+            elapsed = time.time() - start
+            jobs = queue.counts().get(DONE, 0)
+            users = assemble_users(queue)
+            crawled, expected = sum(len(u['friends']) for u in users), sum(len(data.friends[i]) for i in data.users)
+            if crawled != expected:
+                raise ValueError('%d workers crawled %d friend ids, expected %d' % (n, crawled, expected))
+            queue.close()
+        results.append((n, elapsed, jobs / elapsed))
+    return results
+
+
+def main(args):
+    n_workers = int(args[1]) if len(args) > 1 and args[1].isdigit() else 2
+    if '--mock' in args:
+        print('Crawling synthetic users with 20 calls per 2 seconds per credential:')
+        for n, elapsed, rate in benchmark(n_workers):
+            print('%2d workers: %6.2f seconds, %6.1f requests/second' % (n, elapsed, rate))
+        return
+    from collect import USERS_DIR, get_twitter, read_screen_names, store_users
+    sections = twitter_sections('twitter.cfg')
+    os.makedirs(os.path.dirname(JOBS_FILE), exist_ok=True)
+    queue = JobQueue(JOBS_FILE)
+    add_lookups(queue, screen_names=read_screen_names('data/collect/ethereum-accounts.txt'))
+    # Each worker gets one credential set; with more workers than sets, they share them.
+    run_workers(JOBS_FILE, [functools.partial(get_twitter, 'twitter.cfg', sections=[sections[i % len(sections)]])
+                            for i in range(n_workers)])
+    users = assemble_users(queue)
+    counts = queue.counts()
+    print('crawled %d users with %d jobs, %d failed' % (len(users), counts.get(DONE, 0), counts.get(FAILED, 0)))
+    store_users(users, USERS_DIR)
+
+
+if __name__ == "__main__":
+    main(sys.argv)